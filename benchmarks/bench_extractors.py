@@ -0,0 +1,65 @@
+"""
+Benchmarks for the HTML extractors used by the research tools
+"""
+import io
+from unittest.mock import patch
+
+import ddg_search
+import mega_research
+from conftest import read_fixture
+
+SEARCH = read_fixture("search.html")
+ARTICLE = read_fixture("article.html")
+ARTICLE_BYTES = ARTICLE.encode("utf-8")
+
+
+def _serve_article(request, timeout=None):
+    """Stands in for urlopen, returning the article fixture without a network round trip"""
+    return io.BytesIO(ARTICLE_BYTES)
+
+
+def bench_ddg_results(benchmark):
+    results = benchmark(ddg_search._extract_ddg_results, SEARCH)
+    assert len(results) >= 10
+
+
+def bench_ddg_metadata(benchmark):
+    metadata = benchmark(ddg_search._extract_comprehensive_metadata, ARTICLE)
+    assert metadata["title"] == "Benchmark Article - Example News"
+
+
+def bench_ddg_main_content(benchmark):
+    content = benchmark(ddg_search._extract_main_content, ARTICLE, 50000)
+    assert content["word_count"] > 1000
+
+
+def bench_ddg_links(benchmark):
+    links = benchmark(ddg_search._extract_all_links, ARTICLE, "https://news.example.com/story")
+    assert links
+
+
+def bench_ddg_structured_data(benchmark):
+    benchmark(ddg_search._extract_structured_data, ARTICLE)
+
+
+def bench_mega_readability(benchmark):
+    with patch.object(mega_research, "_urlopen", _serve_article):
+        text = benchmark(mega_research._extract_with_readability, "https://news.example.com/story")
+    assert len(text) > 1000
+
+
+def bench_mega_newspaper(benchmark):
+    with patch.object(mega_research, "_urlopen", _serve_article):
+        benchmark(mega_research._extract_with_newspaper, "https://news.example.com/story")
+
+
+def bench_mega_basic_content(benchmark):
+    with patch.object(mega_research, "_urlopen", _serve_article):
+        text = benchmark(mega_research._extract_basic_content, "https://news.example.com/story")
+    assert len(text) > 1000
+
+
+def bench_mega_text_content(benchmark):
+    with patch.object(mega_research, "_urlopen", _serve_article):
+        text = benchmark(mega_research._extract_text_content, "https://news.example.com/story")
+    assert text
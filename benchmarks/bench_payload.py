@@ -0,0 +1,78 @@
+"""
+Benchmarks for building and serializing request payloads
+"""
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from llm_io_intelligence import IOIntelligenceModel, canonical_json
+
+WORDS = "compression latency stream token cache router budget daemon gateway schema".split()
+
+
+class PastResponse:
+    """A previous exchange in a conversation, as llm stores it"""
+
+    def __init__(self, prompt, text):
+        self.prompt = SimpleNamespace(prompt=prompt, system=None, tool_results=[])
+        self._text = text
+
+    def text(self):
+        return self._text
+
+    def tool_calls(self):
+        return []
+
+
+def _conversation(turns):
+    rng = random.Random(turns)
+    responses = [
+        PastResponse(" ".join(rng.choice(WORDS) for _ in range(40)), " ".join(rng.choice(WORDS) for _ in range(200)))
+        for _ in range(turns)
+    ]
+    return SimpleNamespace(id=f"bench-{turns}", responses=responses)
+
+
+def _prompt(**extra):
+    return SimpleNamespace(prompt="And what about HTTP/2?", system="You are a helpful assistant.",
+                           attachments=[], tools=[], tool_results=[], options=None, **extra)
+
+
+@pytest.fixture
+def model():
+    return IOIntelligenceModel("ionet/bench", "bench/model", 128000)
+
+
+@pytest.mark.parametrize("turns", [10, 200])
+def bench_build_messages(benchmark, model, turns):
+    conversation = _conversation(turns)
+    messages = benchmark(model.build_messages, _prompt(), conversation)
+    assert len(messages) == 2 * turns + 2
+
+
+def bench_build_payload(benchmark, model):
+    tools = [{"type": "function", "function": {"name": f"tool_{i}", "description": "A tool " * 20,
+                                               "parameters": {"type": "object", "properties": {}}}}
+             for i in range(20)]
+    payload = benchmark(model.build_payload, _prompt(), tools, True, _conversation(50))
+    assert len(payload["messages"]) == 102
+
+
+@pytest.mark.parametrize("turns", [10, 200])
+def bench_canonical_json(benchmark, model, turns):
+    payload = model.build_payload(_prompt(), [], True, _conversation(turns))
+    body = benchmark(canonical_json, payload)
+    assert body.startswith(b"{")
+
+
+@pytest.mark.parametrize("count,size", [(1, 4 << 20), (20, 64 << 10)])
+def bench_process_attachments(benchmark, model, tmp_path, count, size):
+    rng = random.Random(size)
+    attachments = []
+    for i in range(count):
+        path = tmp_path / f"attachment-{i}.png"
+        path.write_bytes(rng.getrandbits(size * 8).to_bytes(size, "little"))
+        attachments.append(SimpleNamespace(path=str(path), mime_type="image/png"))
+    processed = benchmark(model._process_attachments, attachments)
+    assert len(processed) == count
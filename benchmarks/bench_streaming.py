@@ -0,0 +1,91 @@
+"""
+Benchmarks for parsing streamed chat completions
+"""
+import asyncio
+from unittest.mock import patch
+
+from conftest import read_fixture
+from llm_io_intelligence import IOIntelligenceModel, ToolCallStreamParser
+
+STREAM = read_fixture("stream.sse", "rb")
+
+
+class Content:
+    def __init__(self, data, chunk_size):
+        self._chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        self._index = 0
+
+    async def readany(self):
+        if self._index == len(self._chunks):
+            return b""
+        self._index += 1
+        return self._chunks[self._index - 1]
+
+
+class ReplayedResponse:
+    """Stands in for an aiohttp response replaying the stream fixture"""
+
+    status = 200
+
+    def __init__(self, data, chunk_size):
+        self.content = Content(data, chunk_size)
+
+    def release(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _parse_stream(model, loop, chunk_size, want_reasoning):
+    async def send(*args, **kwargs):
+        return ReplayedResponse(STREAM, chunk_size), None
+
+    async def consume():
+        return [chunk async for chunk in model._stream_completion({"stream": True}, "key", want_reasoning)]
+
+    with patch.object(model, "_send", send):
+        return loop.run_until_complete(consume())
+
+
+def _bench_stream(benchmark, chunk_size, want_reasoning):
+    model = IOIntelligenceModel("ionet/bench", "bench/model", 128000)
+    loop = asyncio.new_event_loop()
+    try:
+        chunks = benchmark(_parse_stream, model, loop, chunk_size, want_reasoning)
+    finally:
+        loop.close()
+    assert len(chunks) == 601 + (150 if want_reasoning else 0)
+
+
+def bench_sse_parse_small_reads(benchmark):
+    """Network-sized reads of a few hundred bytes, reasoning dropped unparsed"""
+    _bench_stream(benchmark, 256, False)
+
+
+def bench_sse_parse_large_reads(benchmark):
+    """Reads of 16KB, as when the consumer falls behind the server"""
+    _bench_stream(benchmark, 16384, False)
+
+
+def bench_sse_parse_with_reasoning(benchmark):
+    """Reasoning deltas decoded and passed through"""
+    _bench_stream(benchmark, 256, True)
+
+
+def bench_tool_call_stream_parser(benchmark):
+    """Text with an embedded tool call fed to the parser in small deltas"""
+    text = ("Let me look that up. " * 200
+            + '<tool_call>{"name": "research_topic", "arguments": {"query": "http/2 multiplexing"}}</tool_call>'
+            + " Done." * 50)
+    deltas = [text[i:i + 7] for i in range(0, len(text), 7)]
+
+    def parse():
+        parser = ToolCallStreamParser(["research_topic"])
+        calls = []
+        for delta in deltas:
+            calls.extend(parser.feed(delta)[1])
+        calls.extend(parser.finish()[1])
+        return calls
+
+    assert len(benchmark(parse)) == 1
@@ -0,0 +1,188 @@
+"""
+Benchmark harness for the micro-benchmarks in this directory
+
+Each bench_* function takes the ``benchmark`` fixture and calls it with the
+code to time, in the style of pytest-benchmark:
+
+    def bench_parse(benchmark):
+        result = benchmark(parse, FIXTURE)
+
+The function is run in rounds of enough iterations to take at least
+--bench-min-round seconds, for --bench-time seconds per benchmark. Results
+are saved as JSON under benchmarks/baselines/ and compared by median:
+
+    pytest benchmarks --bench-save=main
+    pytest benchmarks --bench-compare=main --bench-max-regression=0.25
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINES = os.path.join(HERE, "baselines")
+FIXTURES = os.path.join(HERE, "fixtures")
+
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "test_functions"))
+
+_results = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("bench", "micro-benchmarks")
+    group.addoption("--bench-time", type=float, default=1.0, help="Seconds to spend timing each benchmark")
+    group.addoption("--bench-min-round", type=float, default=0.005, help="Minimum seconds per timing round")
+    group.addoption("--bench-save", metavar="NAME", help="Save the results as benchmarks/baselines/NAME.json")
+    group.addoption("--bench-compare", metavar="NAME", help="Compare with benchmarks/baselines/NAME.json")
+    group.addoption("--bench-max-regression", type=float, default=None,
+                    help="Fail when a median is this fraction slower than the compared baseline, e.g. 0.25")
+
+
+def read_fixture(name, mode="r"):
+    """Contents of a file in benchmarks/fixtures"""
+    with open(os.path.join(FIXTURES, name), mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        return f.read()
+
+
+class Benchmark:
+    """Times a callable over calibrated rounds and keeps per-call statistics"""
+
+    def __init__(self, name, max_time, min_round):
+        self.name = name
+        self.max_time = max_time
+        self.min_round = min_round
+        self.stats = None
+
+    def __call__(self, function, *args, **kwargs):
+        # Calibrate the iterations per round so timer resolution does not matter
+        iterations = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                result = function(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.min_round or iterations >= 1 << 20:
+                break
+            iterations *= max(2, min(10, int(self.min_round / max(elapsed, 1e-9)) + 1))
+        timings = []
+        deadline = time.perf_counter() + self.max_time
+        while len(timings) < 5 or (time.perf_counter() < deadline and len(timings) < 10000):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                function(*args, **kwargs)
+            timings.append((time.perf_counter() - start) / iterations)
+        self.stats = {
+            "min": min(timings),
+            "max": max(timings),
+            "mean": statistics.fmean(timings),
+            "median": statistics.median(timings),
+            "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            "rounds": len(timings),
+            "iterations": iterations,
+        }
+        return result
+
+
+@pytest.fixture
+def benchmark(request):
+    config = request.config
+    bench = Benchmark(request.node.nodeid, config.getoption("--bench-time"), config.getoption("--bench-min-round"))
+    yield bench
+    if bench.stats is not None:
+        _results[request.node.nodeid] = bench.stats
+
+
+def _machine():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f}{unit}"
+    return f"{seconds / 1e-9:.1f}ns"
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    name = config.getoption("--bench-compare")
+    threshold = config.getoption("--bench-max-regression")
+    if name and threshold is not None and _results:
+        baseline = _load_baseline(name)
+        if baseline and any(
+            stats["median"] > baseline["benchmarks"][test]["median"] * (1 + threshold)
+            for test, stats in _results.items() if test in baseline["benchmarks"]
+        ):
+            session.exitstatus = pytest.ExitCode.TESTS_FAILED
+    save = config.getoption("--bench-save")
+    if save and _results:
+        os.makedirs(BASELINES, exist_ok=True)
+        with open(os.path.join(BASELINES, f"{save}.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "saved": datetime.now().isoformat(timespec="seconds"),
+                "commit": _commit(),
+                "machine": _machine(),
+                "benchmarks": dict(sorted(_results.items())),
+            }, f, indent=2)
+            f.write("\n")
+
+
+def _load_baseline(name):
+    path = os.path.join(BASELINES, f"{name}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if not _results:
+        return
+    name = config.getoption("--bench-compare")
+    baseline = _load_baseline(name) if name else None
+    threshold = config.getoption("--bench-max-regression")
+    write = terminalreporter.write_line
+    terminalreporter.section("benchmarks")
+    if name and baseline is None:
+        write(f"No baseline named {name!r} in {BASELINES}")
+    elif baseline and baseline["machine"] != _machine():
+        write(f"Baseline {name!r} was saved on a different machine or Python, compare with care")
+    header = f"{'benchmark':<60} {'median':>10} {'min':>10} {'stddev':>10} {'rounds':>7}"
+    write(header + (f" {'baseline':>10} {'change':>8}" if baseline else ""))
+    regressions = 0
+    for test, stats in sorted(_results.items()):
+        line = (f"{test.split('::')[-1] if len(test) > 60 else test:<60} {_format_time(stats['median']):>10} "
+                f"{_format_time(stats['min']):>10} {_format_time(stats['stddev']):>10} {stats['rounds']:>7}")
+        previous = baseline["benchmarks"].get(test) if baseline else None
+        if previous:
+            change = stats["median"] / previous["median"] - 1
+            flag = ""
+            if threshold is not None and change > threshold:
+                flag = " REGRESSION"
+                regressions += 1
+            line += f" {_format_time(previous['median']):>10} {change:>+8.1%}{flag}"
+        write(line)
+    if regressions:
+        write(f"{regressions} benchmark(s) more than {threshold:.0%} slower than {name!r}", red=True)
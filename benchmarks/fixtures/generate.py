@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Regenerate the benchmark fixtures in this directory
+
+The output is deterministic, so regenerating only changes the files when this
+script changes. Baselines saved against older fixtures are not comparable.
+
+    python benchmarks/fixtures/generate.py
+"""
+import json
+import os
+import random
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORDS = ("the model streams tokens over server sent events while tools fetch pages and summarize "
+         "results for research questions about latency throughput caching compression and routing").split()
+
+
+def sentence(rng, words=14):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def stream_fixture(rng):
+    """A captured-style chat completion stream: reasoning, content deltas, keep-alives and usage"""
+    lines = []
+    for _ in range(150):
+        delta = {"reasoning_content": rng.choice(WORDS) + " "}
+        lines.append(f"data: {json.dumps({'id': 'chatcmpl-1', 'choices': [{'index': 0, 'delta': delta}]})}")
+        lines.append("")
+    for i in range(600):
+        delta = {"content": rng.choice(WORDS) + (" " if i % 9 else ".\n")}
+        lines.append(f"data: {json.dumps({'id': 'chatcmpl-1', 'choices': [{'index': 0, 'delta': delta}]})}")
+        lines.append("")
+        if i % 100 == 99:
+            lines.append(": keep-alive")
+            lines.append("")
+    usage = {"prompt_tokens": 1200, "completion_tokens": 750, "total_tokens": 1950}
+    lines.append(f"data: {json.dumps({'id': 'chatcmpl-1', 'choices': [], 'usage': usage})}")
+    lines.append("")
+    lines.append("data: [DONE]")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def search_fixture(rng):
+    """A DuckDuckGo HTML results page"""
+    results = []
+    for i in range(30):
+        url = f"https://site{i}.example.org/articles/{rng.randrange(10000)}"
+        results.append(
+            f'<div class="result results_links results_links_deep web-result">\n'
+            f'  <div class="links_main links_deep result__body">\n'
+            f'    <h2 class="result__title"><a rel="nofollow" class="result__a" href="{url}">'
+            f'{sentence(rng, 6)}</a></h2>\n'
+            f'    <a class="result__snippet" href="{url}">{sentence(rng, 30)}</a>\n'
+            f'  </div>\n'
+            f'</div>\n'
+        )
+    return (
+        "<!DOCTYPE html><html><head><title>benchmark query at DuckDuckGo</title>"
+        '<link rel="stylesheet" href="/dist/s.css"></head><body>\n'
+        '<div id="links" class="results">\n' + "".join(results) + "</div>\n"
+        + "".join(f'<a href="/html/?q=page{i}">Page {i}</a>\n' for i in range(10))
+        + "</body></html>\n"
+    )
+
+
+def article_fixture(rng):
+    """A news article page with navigation, scripts, metadata and a long body"""
+    paragraphs = "\n".join(
+        f"<p>{sentence(rng, 40)} <a href=\"https://ref{i}.example.com/doc\">{sentence(rng, 3)}</a> {sentence(rng, 25)}</p>"
+        for i in range(120)
+    )
+    head = (
+        "<head><title>Benchmark Article - Example News</title>\n"
+        '<meta name="description" content="A long article used to benchmark content extraction">\n'
+        '<meta name="keywords" content="benchmark, extraction, html">\n'
+        '<meta name="author" content="Example Newsroom">\n'
+        '<meta property="og:title" content="Benchmark Article">\n'
+        '<meta property="og:image" content="https://cdn.example.com/lead.jpg">\n'
+        '<meta name="twitter:card" content="summary_large_image">\n'
+        '<script type="application/ld+json">{"@type": "NewsArticle", "headline": "Benchmark Article"}</script>\n'
+        "<style>body { font-family: serif; }</style>\n"
+        "</head>\n"
+    )
+    nav = "<nav>" + "".join(f'<a href="/section/{i}">Section {i}</a>' for i in range(40)) + "</nav>\n"
+    scripts = "".join(f"<script>var tracker{i} = {{id: {i}}};</script>\n" for i in range(20))
+    images = "".join(f'<img src="/img/{i}.jpg" alt="{sentence(rng, 4)}">\n' for i in range(15))
+    return (
+        "<!DOCTYPE html><html>" + head + "<body>\n<header>Example News</header>\n" + nav + scripts
+        + '<main><article class="story article-body">\n<h1>Benchmark Article</h1>\n<h2>Background</h2>\n'
+        + images + paragraphs + "\n</article></main>\n<footer>Copyright Example News</footer>\n</body></html>\n"
+    )
+
+
+def main():
+    rng = random.Random(2024)
+    for name, build in (("stream.sse", stream_fixture), ("search.html", search_fixture),
+                        ("article.html", article_fixture)):
+        with open(os.path.join(HERE, name), "w", encoding="utf-8", newline="\n") as f:
+            f.write(build(rng))
+
+
+if __name__ == "__main__":
+    main()
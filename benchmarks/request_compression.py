@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark upload time for large chat completion requests with and without compression
+
+Runs a local server that reads request bodies at a limited bandwidth, standing
+in for a home or office uplink, and times how long it takes the plugin to get
+a reply for conversations of several sizes.
+
+    python benchmarks/request_compression.py --uplink-mbit 20 --sizes 256,1024,4096
+"""
+import os
+import sys
+import time
+import json
+import base64
+import asyncio
+import argparse
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from llm_io_intelligence import IOIntelligenceModel, close_sessions, request_encoding
+from mock_server import MockServer
+
+
+def build_prompt(kind: str, size_kb: int) -> str:
+    """Prompt text of roughly size_kb kilobytes"""
+    if kind == "image":
+        # Base64 of random bytes, the worst case for compression
+        return base64.b64encode(os.urandom(size_kb * 768)).decode()
+    # Source code and prose, like a pasted file or a long conversation
+    with open(os.path.join(ROOT, "README.md"), encoding="utf-8") as f:
+        text = f.read()
+    return (text * (size_kb * 1024 // len(text) + 1))[:size_kb * 1024]
+
+
+def throttled_server(bytes_per_second: float) -> MockServer:
+    async def handler(request):
+        received = 0
+        start = time.perf_counter()
+        async for chunk in request.content.iter_any():
+            received += len(chunk)
+            # Hold the upload back to the simulated uplink speed
+            delay = start + received / bytes_per_second - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        return web.json_response({"choices": [{"message": {"content": f"{received} bytes"}}]})
+
+    return MockServer({"POST /api/v1/chat/completions": handler},
+                      handler_args={"auto_decompress": False}, client_max_size=1 << 30)
+
+
+async def timed_request(api_base: str, prompt: str) -> tuple:
+    model = IOIntelligenceModel("ionet/bench", "bench/model", 128000)
+    model.api_base = api_base
+    request = SimpleNamespace(prompt=prompt, attachments=[], tools=[])
+    start = time.perf_counter()
+    result = [r async for r in model.execute_async_with_tools(request, get_env_var=lambda n: "bench", stream=False)]
+    return time.perf_counter() - start, int(result[0]["content"].split()[0])
+
+
+async def run(args) -> list:
+    rows = []
+    async with throttled_server(args.uplink_mbit * 1_000_000 / 8) as server:
+        try:
+            for kind in args.kinds.split(","):
+                for size_kb in [int(size) for size in args.sizes.split(",")]:
+                    prompt = build_prompt(kind, size_kb)
+                    for mode in ["off"] + args.modes.split(","):
+                        with patch.dict(os.environ, {"IONET_REQUEST_COMPRESSION": mode}):
+                            encoding = request_encoding() or "identity"
+                            seconds, sent = await timed_request(server.api_base, prompt)
+                        rows.append({"kind": kind, "size_kb": size_kb, "mode": mode, "encoding": encoding,
+                                     "sent_bytes": sent, "seconds": round(seconds, 3)})
+        finally:
+            await close_sessions()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--uplink-mbit", type=float, default=20.0, help="Simulated upload bandwidth")
+    parser.add_argument("--sizes", default="64,512,2048", help="Prompt sizes in KB")
+    parser.add_argument("--kinds", default="text,image", help="Prompt contents: text, image")
+    parser.add_argument("--modes", default="gzip,zstd", help="Compression settings to compare with off")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    env = {"IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0", "IONET_COMPRESS_MIN_BYTES": "0"}
+    with patch.dict(os.environ, env):
+        rows = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    baseline = {(row["kind"], row["size_kb"]): row["seconds"] for row in rows if row["mode"] == "off"}
+    print(f"Uplink {args.uplink_mbit:g} Mbit/s")
+    print(f"{'kind':<6} {'size':>8} {'mode':<5} {'encoding':<9} {'sent':>10} {'time':>8} {'saved':>7}")
+    for row in rows:
+        saved = 1 - row["seconds"] / baseline[(row["kind"], row["size_kb"])]
+        print(f"{row['kind']:<6} {row['size_kb']:>6}KB {row['mode']:<5} {row['encoding']:<9} "
+              f"{row['sent_bytes']:>10} {row['seconds']:>7.3f}s {saved:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
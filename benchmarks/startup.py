@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Benchmark plugin start-up: import, model registration and the first request
+
+Every measurement runs in a fresh interpreter against a local mock of the
+io.net API (selected with IONET_API_BASE), so the numbers cover what
+`llm models list` and `llm -m ionet/... 'hi'` pay on each invocation:
+
+- interpreter: a bare `python -c pass`, for reference
+- import_llm / import_plugin: importing llm, then the plugin on top of it
+- register_cold / register_warm: register_models with an empty and a
+  primed model catalog cache
+- first_chunk / first_request: the first streamed prompt after registration
+- cli_models_list / cli_prompt: the llm CLI end to end
+
+    python benchmarks/startup.py --runs 10 -o startup.json
+    python benchmarks/startup.py --compare startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# Runs the llm CLI with the plugin from this checkout, whether or not it is installed
+CLI_SHIM = """
+import sys
+import llm.plugins
+import llm_io_intelligence
+llm.plugins.load_plugins()
+if llm.plugins.pm.get_plugin("llm-io-intelligence") is None:
+    llm.plugins.pm.register(llm_io_intelligence, name="llm-io-intelligence")
+from llm.cli import cli
+cli.main(sys.argv[1:], prog_name="llm")
+"""
+
+
+def mock_api(catalog_size: int, latency: float):
+    """io.net stand-in serving a model catalog and streamed chat completions"""
+    # Imported here so the child interpreters being timed do not load asyncio and aiohttp up front
+    import asyncio
+
+    from aiohttp import web
+
+    sys.path.insert(0, ROOT)
+    from mock_server import MockServer, delta, stream_response
+
+    async def models(request):
+        await asyncio.sleep(latency)
+        return web.json_response({"data": [{"id": f"bench/model-{i}"} for i in range(catalog_size)]})
+
+    async def chat(request):
+        await request.read()
+        await asyncio.sleep(latency)
+        return await stream_response(request, [delta("Hello"), delta(" there"), delta("!")])
+
+    return MockServer({"GET /api/v1/models": models, "POST /api/v1/chat/completions": chat})
+
+
+def child(mode: str):
+    """Measure one start-up stage inside a fresh interpreter and print the timings as JSON"""
+    timings = {}
+    start = time.perf_counter()
+    import llm
+    timings["import_llm"] = time.perf_counter() - start
+    start = time.perf_counter()
+    import llm_io_intelligence
+    timings["import_plugin"] = time.perf_counter() - start
+    if mode != "import":
+        models = []
+        start = time.perf_counter()
+        llm_io_intelligence.register_models(models.append)
+        timings["register"] = time.perf_counter() - start
+        timings["models"] = len(models)
+    if mode == "request":
+        model = next(model for model in models if isinstance(model, llm_io_intelligence.IOIntelligenceModel))
+        start = time.perf_counter()
+        chunks = iter(model.prompt("hi", stream=True))
+        next(chunks)
+        timings["first_chunk"] = time.perf_counter() - start
+        for _ in chunks:
+            pass
+        timings["first_request"] = time.perf_counter() - start
+    del llm
+    print(json.dumps(timings))
+
+
+def run_child(mode: str, env) -> dict:
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode], env=env,
+                            capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode} run failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def timed_process(args, env) -> float:
+    start = time.perf_counter()
+    # llm reads a piped stdin into the prompt, so give it an empty one
+    result = subprocess.run(args, env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=120)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{args} failed:\n{result.stderr}")
+    return elapsed
+
+
+def import_profile(env, top: int) -> list:
+    """The plugin's slowest direct imports, from python -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import llm_io_intelligence"],
+                            env=env, capture_output=True, text=True, timeout=120)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({"module": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000,
+                     "depth": (len(name) - len(name.lstrip()) - 1) // 2})
+    # Depth 1 are the plugin's own imports (depth 0 is the plugin and interpreter start-up)
+    return sorted((row for row in rows if row["depth"] == 1), key=lambda row: -row["cumulative_ms"])[:top]
+
+
+def summarize(samples: list) -> dict:
+    return {"median": statistics.median(samples), "min": min(samples), "max": max(samples),
+            "samples": [round(sample, 6) for sample in samples]}
+
+
+def benchmark(args) -> dict:
+    server = mock_api(args.catalog_size, args.latency_ms / 1000).start_thread()
+    workdir = tempfile.mkdtemp(prefix="ionet-startup-")
+    cache = os.path.join(workdir, "cache.db")
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")])),
+        "IONET": "bench-key",
+        "IONET_API_BASE": server.api_base,
+        "IONET_CACHE": f"sqlite://{cache}",
+        "IONET_DAEMON": "0",
+        "IONET_USAGE_LEDGER": "0",
+        "LLM_USER_PATH": workdir,
+    })
+    for name in ("IONET_KEYS", "IONET_LOG", "IONET_PROFILE_DIR", "IONET_TRACE_FILE"):
+        env.pop(name, None)
+    samples = {name: [] for name in ("interpreter", "import_llm", "import_plugin", "register_cold", "register_warm",
+                                     "first_chunk", "first_request", "cli_models_list", "cli_prompt")}
+    models = None
+    try:
+        for _ in range(args.runs):
+            samples["interpreter"].append(timed_process([sys.executable, "-c", "pass"], env))
+            imported = run_child("import", env)
+            samples["import_llm"].append(imported["import_llm"])
+            samples["import_plugin"].append(imported["import_plugin"])
+            if os.path.exists(cache):
+                os.remove(cache)
+            cold = run_child("register", env)
+            samples["register_cold"].append(cold["register"])
+            models = cold["models"]
+            # The cold run left the catalog in the cache
+            samples["register_warm"].append(run_child("register", env)["register"])
+            request = run_child("request", env)
+            samples["first_chunk"].append(request["first_chunk"])
+            samples["first_request"].append(request["first_request"])
+            if not args.no_cli:
+                samples["cli_models_list"].append(timed_process([sys.executable, "-c", CLI_SHIM, "models", "list"], env))
+                samples["cli_prompt"].append(timed_process(
+                    [sys.executable, "-c", CLI_SHIM, "-m", "ionet/bench/model-0", "--no-log", "hi"], env
+                ))
+        profile = import_profile(env, args.top_imports)
+    finally:
+        server.stop_thread()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "saved": datetime.now().isoformat(timespec="seconds"),
+        "machine": {"python": platform.python_version(), "system": platform.system(),
+                    "machine": platform.machine(), "cpu_count": os.cpu_count()},
+        "settings": {"runs": args.runs, "catalog_size": args.catalog_size, "latency_ms": args.latency_ms,
+                     "registered_models": models},
+        "results": {name: summarize(values) for name, values in samples.items() if values},
+        "slowest_imports": profile,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument("--catalog-size", type=int, default=40, help="Models the mock API lists")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mock API response latency")
+    parser.add_argument("--top-imports", type=int, default=15, help="Slowest imports to include")
+    parser.add_argument("--no-cli", action="store_true", help="Skip the end-to-end llm CLI runs")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Previous JSON report to compare medians with")
+    parser.add_argument("--json", action="store_true", help="Print the JSON report instead of a table")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    report = benchmark(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)["results"]
+    print(f"{'stage':<16} {'median':>9} {'min':>9} {'max':>9}" + (f" {'before':>9} {'change':>8}" if previous else ""))
+    for name, result in report["results"].items():
+        line = f"{name:<16} {result['median'] * 1000:>7.1f}ms {result['min'] * 1000:>7.1f}ms {result['max'] * 1000:>7.1f}ms"
+        if name in previous:
+            before = previous[name]["median"]
+            line += f" {before * 1000:>7.1f}ms {result['median'] / before - 1:>+8.1%}"
+        print(line)
+    print("\nSlowest imports (cumulative):")
+    for row in report["slowest_imports"]:
+        print(f"  {row['cumulative_ms']:>8.1f}ms  {row['module']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Thin client for the IO Intelligence daemon started with ``llm ionet daemon``
+
+Only uses the standard library, so a call costs a Python start-up and a Unix
+socket round trip instead of importing llm, registering models and opening a
+fresh TLS connection to io.net. The daemon speaks the OpenAI chat completions
+protocol over the socket.
+
+    echo "Summarize this" | ionet-prompt -m ionet/llama-3.3-70b
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional
+
+
+def _uid() -> int:
+    return os.getuid() if hasattr(os, "getuid") else 0
+
+
+def fallback_socket_dir() -> str:
+    """Private directory for the socket when there is no XDG_RUNTIME_DIR"""
+    return os.path.join(tempfile.gettempdir(), f"ionet-{_uid()}")
+
+
+def default_socket_path() -> str:
+    """Socket used by the daemon, overridable with IONET_DAEMON_SOCKET
+
+    XDG_RUNTIME_DIR is only accessible to its user. Without it the socket
+    goes in a 0700 directory of its own, since anyone can create files in
+    the shared temporary directory.
+    """
+    configured = os.environ.get("IONET_DAEMON_SOCKET")
+    if configured:
+        return configured
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, f"ionet-{_uid()}.sock")
+    return os.path.join(fallback_socket_dir(), "daemon.sock")
+
+
+class DaemonUnavailableError(Exception):
+    """The daemon socket is missing or nothing is listening on it"""
+
+
+class UntrustedSocketError(DaemonUnavailableError):
+    """The socket, or the directory made for it, belongs to another user"""
+
+
+def private_socket_dir(path: str) -> str:
+    """Create the directory with mode 0700 unless it exists, then check only we control it"""
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != _uid() or info.st_mode & 0o077:
+        raise UntrustedSocketError(f"{path} must be a directory owned by you with mode 0700")
+    return path
+
+
+def check_socket_owner(socket_path: str):
+    """Refuse a socket another user created, which would receive our prompts and token"""
+    try:
+        info = os.lstat(socket_path)
+    except OSError as e:
+        raise DaemonUnavailableError(f"IO Intelligence daemon is not running on {socket_path}: {e}")
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != _uid():
+        raise UntrustedSocketError(f"Refusing to use {socket_path}: it is not a socket owned by you")
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket"""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        check_socket_owner(self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise DaemonUnavailableError(f"IO Intelligence daemon is not running on {self.socket_path}: {e}")
+        self.sock = sock
+
+
+def _request(method: str, path: str, body: Optional[Dict[str, Any]] = None, socket_path: Optional[str] = None,
+             timeout: Optional[float] = None):
+    connection = UnixHTTPConnection(socket_path or default_socket_path(), timeout=timeout)
+    headers = {"Content-Type": "application/json"}
+    token = os.environ.get("IONET_GATEWAY_TOKEN")
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = connection.getresponse()
+    if response.status != 200:
+        error = response.read().decode("utf-8", "replace")
+        connection.close()
+        raise Exception(f"Daemon request failed: {response.status} - {error}")
+    return connection, response
+
+
+def list_models(socket_path: Optional[str] = None, timeout: float = 2.0) -> List[Dict[str, Any]]:
+    """Models the daemon serves, as returned by /v1/models"""
+    connection, response = _request("GET", "/v1/models", socket_path=socket_path, timeout=timeout)
+    try:
+        return json.loads(response.read())["data"]
+    finally:
+        connection.close()
+
+
+def stream_chat(messages: List[Dict[str, Any]], model: str, socket_path: Optional[str] = None,
+                **params) -> Iterator[str]:
+    """Send a chat completion to the daemon and yield content deltas as they stream back"""
+    body = dict(params, model=model, messages=messages, stream=True)
+    connection, response = _request("POST", "/v1/chat/completions", body, socket_path=socket_path)
+    try:
+        for raw_line in response:
+            line = raw_line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                return
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            for choice in event.get("choices") or []:
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    yield content
+    finally:
+        connection.close()
+
+
+def complete(messages: List[Dict[str, Any]], model: str, socket_path: Optional[str] = None, **params) -> str:
+    """Send a chat completion to the daemon and return the whole reply"""
+    body = dict(params, model=model, messages=messages, stream=False)
+    connection, response = _request("POST", "/v1/chat/completions", body, socket_path=socket_path)
+    try:
+        return json.loads(response.read())["choices"][0]["message"]["content"] or ""
+    finally:
+        connection.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="ionet-prompt", description="Send a prompt to the IO Intelligence daemon")
+    parser.add_argument("prompt", nargs="*", help="Prompt text; standard input is prepended when piped")
+    parser.add_argument("-m", "--model", default=os.environ.get("IONET_DEFAULT_MODEL", "ionet/llama-3.3-70b"))
+    parser.add_argument("-s", "--system", help="System prompt")
+    parser.add_argument("--no-stream", action="store_true", help="Wait for the whole reply")
+    parser.add_argument("--socket", help="Daemon socket path")
+    args = parser.parse_args(argv)
+
+    parts = []
+    if not sys.stdin.isatty():
+        parts.append(sys.stdin.read())
+    if args.prompt:
+        parts.append(" ".join(args.prompt))
+    prompt = "\n".join(part for part in parts if part)
+    if not prompt:
+        parser.error("no prompt given")
+
+    messages = []
+    if args.system:
+        messages.append({"role": "system", "content": args.system})
+    messages.append({"role": "user", "content": prompt})
+    try:
+        if args.no_stream:
+            sys.stdout.write(complete(messages, args.model, args.socket))
+        else:
+            for chunk in stream_chat(messages, args.model, args.socket):
+                sys.stdout.write(chunk)
+                sys.stdout.flush()
+    except UntrustedSocketError as e:
+        sys.stderr.write(f"{e}\n")
+        return 1
+    except DaemonUnavailableError as e:
+        sys.stderr.write(f"{e}\nStart it with: llm ionet daemon\n")
+        return 1
+    except Exception as e:
+        sys.stderr.write(f"Error: {e}\n")
+        return 1
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
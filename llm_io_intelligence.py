@@ -2,33 +2,370 @@ import os
 import json
 import logging
 import base64
+import codecs
+import contextlib
+import contextvars
+import cProfile
+import gzip
 from typing import Optional, List, Dict, Any, Union, Iterator
 import asyncio
+import atexit
 import aiohttp
+import click
 import llm
+import sys
 from pathlib import Path
 from datetime import datetime, timedelta
+import functools
 import hashlib
+import importlib
+import inspect
+import itertools
+import math
 import mimetypes
+import multiprocessing
+import operator
+import pstats
 import queue
+import random
+import re
+import socket
+from collections import deque
+import sqlite3
 import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from types import SimpleNamespace
+from urllib.parse import unquote, urlparse
 
-# Configure logging to be less verbose - only warnings and errors
-logging.basicConfig(level=logging.WARNING)
+import ionet_client
+from pydantic import Field, field_validator
+
+try:
+    from llm.parts import StreamEvent
+except ImportError:  # Older llm releases have no typed stream events
+    StreamEvent = None
+
+# Library logging: nothing is printed unless the host application configures
+# logging, or IONET_LOG asks for the plugin's own handler (see _configure_logging)
 logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Events logged often enough to be sampled by default, as the fraction kept
+DEFAULT_LOG_SAMPLE_RATES = {"stream.chunk": 0.01}
+
+# Field values replaced by their size unless IONET_LOG_BODIES=1
+_BODY_FIELDS = {"payload", "body", "messages", "response", "content", "prompt"}
+_SECRET_FIELDS = {"api_key", "key", "authorization", "token"}
+_BEARER = re.compile(r"(Bearer\s+)[^\s\"',]+", re.IGNORECASE)
+
+
+def _secret_values() -> List[str]:
+    """Configured API keys, so they can be scrubbed wherever they appear"""
+    values = [os.environ.get("IONET", "")] + re.split(r"[\s,]+", os.environ.get("IONET_KEYS", ""))
+    return [value for value in values if len(value) >= 8]
+
+
+def mask_secret(value: str) -> str:
+    return f"...{value[-4:]}" if value and len(value) > 8 else "***"
+
+
+def redact_text(text: str) -> str:
+    """Remove bearer tokens and configured API keys from a log message"""
+    text = _BEARER.sub(r"\1***", text)
+    for secret in _secret_values():
+        if secret in text:
+            text = text.replace(secret, mask_secret(secret))
+    return text
+
+
+def redact_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of an event's fields that is safe to log"""
+    include_bodies = os.environ.get("IONET_LOG_BODIES", "0").strip().lower() in ("1", "true", "yes")
+    safe = {}
+    for name, value in fields.items():
+        if name in _SECRET_FIELDS and value is not None:
+            safe[name] = mask_secret(str(value))
+        elif name in _BODY_FIELDS and not include_bodies and value is not None:
+            size = len(value) if isinstance(value, (bytes, str)) else len(json.dumps(value, default=str))
+            safe[name] = f"<{size} bytes>"
+        elif isinstance(value, str):
+            safe[name] = redact_text(value)
+        elif isinstance(value, BaseException):
+            safe[name] = redact_text(str(value))
+        else:
+            safe[name] = value
+    return safe
+
+
+class LogSampler:
+    """Keeps one in every 1/rate records of an event, counting deterministically"""
+
+    def __init__(self, rates: Dict[str, float]):
+        self.rates = rates
+        self._counts: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls) -> "LogSampler":
+        """Default rates overridden by IONET_LOG_SAMPLE, e.g. ``stream.chunk=0.1,request.start=0.5``"""
+        rates = dict(DEFAULT_LOG_SAMPLE_RATES)
+        for item in os.environ.get("IONET_LOG_SAMPLE", "").split(","):
+            event, _, rate = item.partition("=")
+            try:
+                rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+            except ValueError:
+                continue
+        return cls(rates)
+
+    def keep(self, event: str) -> bool:
+        rate = self.rates.get(event, 1.0)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        count = self._counts.get(event, 0)
+        self._counts[event] = count + 1
+        return count % round(1 / rate) == 0
+
+
+class _EventMessage:
+    """Log message formatted from an event's fields only when a handler asks for it"""
+
+    __slots__ = ("template", "fields")
+
+    def __init__(self, template: str, fields: Dict[str, Any]):
+        self.template = template
+        self.fields = fields
+
+    def __str__(self):
+        return self.template.format(**redact_fields(self.fields))
+
+
+def log_event(level: int, event: str, template: str, **fields):
+    """Log a structured event
+
+    Costs a level check when the level is disabled. The message (a
+    str.format template over the fields) is only built when a handler
+    formats the record, with secrets and bodies redacted. The event name
+    and fields are attached to the record as ``event`` and ``fields`` for
+    JSONLogFormatter.
+    """
+    if not logger.isEnabledFor(level) or not _log_sampler.keep(event):
+        return
+    logger.log(level, _EventMessage(template, fields), extra={"event": event, "fields": fields}, stacklevel=2)
+
+
+class RedactingFilter(logging.Filter):
+    """Scrubs API keys from every record the plugin logs, including plain messages"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not isinstance(record.msg, _EventMessage):
+            record.msg = redact_text(record.getMessage())
+            record.args = None
+        return True
+
+
+class JSONLogFormatter(logging.Formatter):
+    """One JSON object per line, with the event name and fields as top-level keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            for name, value in redact_fields(fields).items():
+                entry.setdefault(name, value)
+        if record.exc_info:
+            entry["exception"] = redact_text(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+def _configure_logging():
+    """Attach the plugin's own handler when IONET_LOG is text or json
+
+    IONET_LOG_LEVEL sets the level (default info) and IONET_LOG_FILE the
+    destination (default stderr). Only this module's logger is touched, and
+    it stops propagating so records are not printed twice.
+    """
+    global _log_sampler
+    _log_sampler = LogSampler.from_env()
+    if not any(isinstance(f, RedactingFilter) for f in logger.filters):
+        logger.addFilter(RedactingFilter())
+    for handler in [h for h in logger.handlers if getattr(h, "_ionet", False)]:
+        logger.removeHandler(handler)
+        handler.close()
+    mode = os.environ.get("IONET_LOG", "").strip().lower()
+    if mode not in ("text", "json"):
+        logger.propagate = True
+        return
+    path = os.environ.get("IONET_LOG_FILE")
+    handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler()
+    handler._ionet = True
+    if mode == "json":
+        handler.setFormatter(JSONLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(getattr(logging, os.environ.get("IONET_LOG_LEVEL", "info").strip().upper(), logging.INFO))
+    logger.propagate = False
+
+
+_log_sampler = LogSampler(DEFAULT_LOG_SAMPLE_RATES)
+_configure_logging()
+
+
+class StreamStalledError(Exception):
+    """Raised when a streaming response stops producing data"""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a request runs past the deadline option"""
+
+
+class ReasoningChunk(str):
+    """Reasoning text streamed separately from the response content"""
+
+
+class ChoiceChunk(str):
+    """Content delta of one of several choices requested with the n option"""
+
+    def __new__(cls, text: str, index: int):
+        chunk = super().__new__(cls, text)
+        chunk.index = index
+        return chunk
+
+
+# Shown between samples when several are generated for one llm response
+SAMPLE_SEPARATOR = "\n\n--- sample {number} ---\n\n"
+
+
+REASONING_MODES = ("drop", "stream", "file")
+
+# Markers showing an SSE event carries more than a reasoning delta; fields
+# sent as null (e.g. "usage":null) don't count
+_OUTPUT_MARKERS = re.compile(r'"content":\s*"|"tool_calls":\s*\[|"usage":\s*\{|"finish_reason":\s*"')
+
+
+def _reasoning_mode() -> str:
+    """How to handle reasoning deltas, from IONET_REASONING (drop, stream or file)"""
+    mode = os.environ.get("IONET_REASONING", "drop").strip().lower()
+    if mode not in REASONING_MODES:
+        logger.warning("Ignoring invalid IONET_REASONING=%r, expected one of %s", mode, ', '.join(REASONING_MODES))
+        return "drop"
+    return mode
+
+
+def _reasoning_event(text: str):
+    """Surface reasoning on llm's reasoning channel, or stderr on older llm releases"""
+    if StreamEvent is not None:
+        return StreamEvent(type="reasoning", chunk=str(text))
+    sys.stderr.write(text)
+    sys.stderr.flush()
+    return None
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a numeric setting from the environment, falling back on bad values"""
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning("Ignoring invalid %s=%r, using %s", name, value, default)
+        return default
+
+
+def daemon_socket() -> Optional[str]:
+    """Socket of a running `llm ionet daemon` to forward requests to, unless IONET_DAEMON=0"""
+    if os.environ.get("IONET_DAEMON", "1").strip().lower() in ("0", "false", "no"):
+        return None
+    path = ionet_client.default_socket_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        ionet_client.check_socket_owner(path)
+    except ionet_client.DaemonUnavailableError as e:
+        logger.warning("Not forwarding to the daemon: %s", e)
+        return None
+    return path
+
+
+DEFAULT_API_BASE = "https://api.intelligence.io.solutions/api/v1"
+
+
+def get_api_base() -> str:
+    """The io.net API root, overridable with IONET_API_BASE (e.g. to point at a mock server)"""
+    return (os.environ.get("IONET_API_BASE") or DEFAULT_API_BASE).rstrip("/")
+
+
+def get_api_key() -> Optional[str]:
+    """Resolve the API key from the LLM key system, falling back to the IONET environment variable"""
+    api_key = None
+    try:
+        if hasattr(llm, 'get_key'):
+            api_key = llm.get_key(None, "ionet", None)
+        # If no API key from LLM key system, try environment variable
+        if not api_key:
+            api_key = os.environ.get("IONET")
+    except Exception as e:
+        logger.warning("Error getting API key: %s", e)
+        # Fall back to environment variable
+        api_key = os.environ.get("IONET")
+    return api_key
+
+
+async def fetch_available_models(api_key: Optional[str] = None) -> List[tuple]:
+    """Fetch available models from IO Intelligence API, cached for IONET_CATALOG_TTL seconds
+
+    Without an explicit key the listing leases a key from the key pool.
+    """
+    ttl = _env_float("IONET_CATALOG_TTL", 600)
+    if ttl <= 0:
+        return await _fetch_model_catalog(api_key)
 
+    async def compute():
+        models = await _fetch_model_catalog(api_key)
+        # Failed fetches return nothing and are not cached
+        return json.dumps(models).encode("utf-8") if models else None
 
-async def fetch_available_models(api_key: str) -> List[tuple]:
-    """Fetch available models from IO Intelligence API"""
-    api_base = "https://api.intelligence.io.solutions/api/v1"
+    try:
+        cache = get_cache()
+    except ValueError as e:
+        logger.warning("Model catalog cache disabled: %s", e)
+        return await _fetch_model_catalog(api_key)
+    pool = None if api_key else get_key_pool()
+    # The keys of one pool share a cached catalog
+    owner = ",".join(state.key for state in pool.states) if pool else api_key or get_api_key() or ""
+    key = UsageLedger.key_hash(owner)
+    if get_api_base() != DEFAULT_API_BASE:
+        # Catalogs of other endpoints are cached separately
+        key = f"{key}:{hashlib.sha256(get_api_base().encode()).hexdigest()[:16]}"
+    data = await cache.get_or_compute(f"catalog:{key}", compute, ttl)
+    return [tuple(model) for model in json.loads(data)] if data else []
+
+
+async def _fetch_model_catalog(api_key: Optional[str] = None) -> List[tuple]:
+    api_base = get_api_base()
+    pool = None if api_key else get_key_pool()
+    lease = await pool.acquire() if pool else None
     headers = {
-        "Authorization": f"Bearer {api_key}",
+        "Authorization": f"Bearer {lease.key if lease else api_key or get_api_key()}",
         "Content-Type": "application/json"
     }
+    status = response_headers = None
     
     async with aiohttp.ClientSession() as session:
         try:
             async with session.get(f"{api_base}/models", headers=headers) as response:
+                status, response_headers = response.status, response.headers
                 if response.status == 200:
                     data = await response.json()
                     models = []
@@ -45,86 +382,2879 @@ async def fetch_available_models(api_key: str) -> List[tuple]:
                             models.append((model_id, full_name, context_length))
                     return models
                 else:
-                    logger.warning(f"Failed to fetch models: {response.status}")
+                    logger.warning("Failed to fetch models: %s", response.status)
                     return []
         except Exception as e:
-            logger.warning(f"Error fetching models from API: {e}")
+            logger.warning("Error fetching models from API: %s", e)
             return []
+        finally:
+            if lease:
+                pool.release(lease, status, response_headers)
 
 @llm.hookimpl
 def register_models(register):
     logger.debug("Registering io intelligence models")
     
-    # Try to get API key from LLM key system
-    api_key = None
+    api_key = get_api_key()
+    # A key pool on its own is enough to list the models
+    pool = get_key_pool()
+    
+    # A running daemon already knows the models, which saves a request to io.net
+    models = []
+    socket_path = daemon_socket()
+    if socket_path:
+        try:
+            models = [
+                (model["id"], model["root"], model.get("context_length"))
+                for model in ionet_client.list_models(socket_path)
+                if model["id"] != IORouterModel.model_id
+            ]
+            logger.debug("Fetched %s models from the daemon", len(models))
+        except Exception as e:
+            logger.debug("Could not list models from the daemon: %s", e)
+
+    # Try to fetch models from API if API key is available
+    if (api_key or pool) and not models:
+        logger.debug("Attempting to fetch models from API")
+        try:
+            # Run the async function in a new event loop
+            try:
+                loop = asyncio.get_event_loop()
+            except RuntimeError:
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                
+            # Without a key of its own the listing goes through the key pool
+            models = loop.run_until_complete(fetch_available_models(None if pool else api_key))
+            logger.debug("Successfully fetched %s models from API", len(models))
+        except Exception as e:
+            logger.warning("Failed to fetch models from API: %s", e)
+            # If API fetch fails, don't fall back to hardcoded models when API key is present
+            # This ensures we only use API models when API key is set
+            models = []
+    else:
+        logger.debug("No API key present, will use hardcoded models")
+    
+    # Fallback to hardcoded models only if no API key is present
+    if not (api_key or pool) and not models:
+        logger.debug("Using hardcoded model list")
+        models = [
+            # Current models from API
+            ("ionet/llama-4-maverick-17b", "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8", 430000),
+            ("ionet/deepseek-r1-0528", "deepseek-ai/DeepSeek-R1-0528", 128000),
+            ("ionet/intel-qwen3-coder-480b", "Intel/Qwen3-Coder-480B-A35B-Instruct-int4-mixed-ar", 32000),
+            ("ionet/qwen3-235b", "Qwen/Qwen3-235B-A22B-FP8", 32000),
+            ("ionet/llama-3.2-90b-vision", "meta-llama/Llama-3.2-90B-Vision-Instruct", 16000),
+            ("ionet/qwen2.5-vl-32b", "Qwen/Qwen2.5-VL-32B-Instruct", 32000),
+            ("ionet/llama-3.3-70b", "meta-llama/Llama-3.3-70B-Instruct", 128000),
+            ("ionet/devstral-small-2505", "mistralai/Devstral-Small-2505", 32000),
+            ("ionet/magistral-small-2506", "mistralai/Magistral-Small-2506", 32000),
+            ("ionet/mistral-large-2411", "mistralai/Mistral-Large-Instruct-2411", 128000),
+            ("ionet/aya-expanse-32b", "CohereForAI/aya-expanse-32b", 8000),
+        ]
+    
+    logger.debug("Registering %s models", len(models))
+    registered = []
+    for model_id, full_name, context_length in models:
+        logger.debug("Registering model: %s (%s)", model_id, full_name)
+        model = IOIntelligenceModel(model_id, full_name, context_length)
+        register(model)
+        registered.append(model)
+
+    # Virtual model that routes each prompt to the fastest healthy backend
+    backends = select_router_backends(registered)
+    if backends:
+        logger.debug("Registering router over %s backends", len(backends))
+        register(IORouterModel(backends))
+
+
+@llm.hookimpl
+def register_commands(cli):
+    @cli.group()
+    def ionet():
+        "Commands for the IO Intelligence plugin"
+
+    @ionet.command()
+    @click.option("--days", type=float, default=1.0, show_default=True, help="How many days of usage to show")
+    @click.option("json_", "--json", is_flag=True, help="Output as JSON")
+    def usage(days, json_):
+        "Show recorded token usage per API key and model"
+        ledger = get_usage_ledger()
+        if ledger is None:
+            raise click.ClickException("The usage ledger is disabled (IONET_USAGE_LEDGER=0)")
+        rows = ledger.summary(since=time.time() - days * 86400)
+        if json_:
+            click.echo(json.dumps(rows, indent=2))
+            return
+        if not rows:
+            click.echo("No usage recorded")
+            return
+        for row in rows:
+            click.echo(
+                f"{row['key']}  {row['model']}  requests={row['requests']} "
+                f"prompt={row['prompt_tokens']} completion={row['completion_tokens']} total={row['total_tokens']}"
+            )
+
+    @ionet.command(name="semantic-hits")
+    @click.option("--days", type=float, default=1.0, show_default=True, help="How many days of hits to show")
+    @click.option("--forget", "forget_ids", type=int, multiple=True, metavar="ENTRY_ID",
+                  help="Stop serving a cached entry (repeatable)")
+    @click.option("json_", "--json", is_flag=True, help="Output as JSON")
+    def semantic_hits(days, forget_ids, json_):
+        "Show prompts answered by the semantic cache and the prompts they matched"
+        path = semantic_cache_path()
+        if not path.exists():
+            raise click.ClickException(f"No semantic cache at {path} (enable it with IONET_SEMANTIC_CACHE_TTL)")
+        cache = SemanticCache(path)
+        if forget_ids:
+            for entry_id in forget_ids:
+                found = cache.forget(entry_id)
+                click.echo(f"Forgot entry {entry_id}" if found else f"No entry {entry_id}", err=True)
+            return
+        rows = cache.hits(since=time.time() - days * 86400)
+        if json_:
+            click.echo(json.dumps(rows, indent=2))
+            return
+        if not rows:
+            click.echo("No semantic cache hits")
+            return
+        for row in rows:
+            when = datetime.fromtimestamp(row["ts"]).isoformat(sep=" ", timespec="seconds")
+            click.echo(f"{when}  {row['model']}  similarity={row['similarity']:.3f}  entry={row['entry_id']}")
+            click.echo(f"  asked:   {row['prompt']}")
+            click.echo(f"  matched: {row['matched_prompt']}")
+
+    @ionet.command()
+    @click.argument("path", type=click.File("r", encoding="utf-8"), default="-")
+    @click.option("-m", "--model", "model_id", default="ionet/llama-3.3-70b", show_default=True, help="Model to summarize with")
+    @click.option("--chunk-tokens", type=int, help="Tokens per chunk (default: half the model's context)")
+    @click.option("-j", "--concurrency", type=int, default=4, show_default=True, help="Parallel requests")
+    @click.option("-i", "--instructions", help="Extra instructions, e.g. what to focus on")
+    @click.option("--no-cache", is_flag=True, help="Do not read or write cached partial summaries")
+    @click.option("--stats", is_flag=True, help="Print chunk and cache statistics to stderr")
+    def summarize(path, model_id, chunk_tokens, concurrency, instructions, no_cache, stats):
+        "Summarize a document of any length with a map-reduce pipeline"
+        try:
+            model = llm.get_model(model_id)
+        except llm.UnknownModelError as e:
+            raise click.ClickException(str(e))
+        if not isinstance(model, IOIntelligenceModel):
+            raise click.ClickException(f"{model_id} is not an IO Intelligence model")
+        cache_path = None
+        if not no_cache:
+            cache_path = Path(os.environ.get("IONET_SUMMARY_CACHE") or llm.user_dir() / "ionet_summaries.db")
+        summarizer = DocumentSummarizer(model, chunk_tokens, concurrency, cache_path, instructions)
+        text = path.read()
+
+        async def run():
+            try:
+                return await summarizer.summarize(text)
+            finally:
+                await close_sessions()
+
+        click.echo(asyncio.run(run()))
+        if stats:
+            click.echo(json.dumps(summarizer.stats), err=True)
+
+    @ionet.command()
+    @click.argument("input_file", metavar="INPUT", type=click.File("r", encoding="utf-8"), default="-")
+    @click.option("-m", "--model", "model_id", default="ionet/llama-3.3-70b", show_default=True, help="Model to run")
+    @click.option("-o", "--output", type=click.File("w", encoding="utf-8"), default="-", help="JSONL output file")
+    @click.option("-w", "--workers", type=int, default=os.cpu_count() or 1, show_default=True, help="Worker processes")
+    @click.option("--rpm", type=float, default=0, help="Requests per minute across all workers (0 = unlimited)")
+    @click.option("--burst", type=int, default=1, show_default=True, help="Requests allowed back-to-back")
+    @click.option("-s", "--system", help="System prompt for records without one")
+    @click.option("--post-process", help="module:function applied to each response in the workers")
+    def batch(input_file, model_id, output, workers, rpm, burst, system, post_process):
+        """Run many prompts across worker processes sharing one rate limit
+
+        INPUT has one prompt per line: plain text, or JSON objects with a
+        "prompt" and optional "system" and "id". Results are written as JSONL
+        in input order.
+        """
+        try:
+            model = llm.get_model(model_id)
+        except llm.UnknownModelError as e:
+            raise click.ClickException(str(e))
+        if not isinstance(model, IOIntelligenceModel):
+            raise click.ClickException(f"{model_id} is not an IO Intelligence model")
+        if post_process:
+            try:
+                load_callable(post_process)
+            except (ValueError, ImportError, AttributeError) as e:
+                raise click.ClickException(f"Invalid --post-process: {e}")
+        records = []
+        for line in input_file:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line) if line.startswith("{") else {"prompt": line}
+            if system and "system" not in record:
+                record["system"] = system
+            records.append(record)
+        for result in run_batch(model, records, workers, rpm, burst, post_process):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+    @ionet.command()
+    @click.argument("prompt", required=False)
+    @click.option("--schema", "schema_input", required=True, help="Schema of one record: JSON, a JSON file or llm's concise syntax")
+    @click.option("-m", "--model", "model_id", default="ionet/llama-3.3-70b", show_default=True, help="Model to run")
+    @click.option("-s", "--system", help="System prompt")
+    def extract(prompt, schema_input, model_id, system):
+        """Extract records matching a schema, printing each as a JSON line as soon as it is generated
+
+        Piped standard input is added to the PROMPT, e.g.
+        cat article.txt | llm ionet extract "People mentioned" --schema "name, role"
+        """
+        try:
+            model = llm.get_model(model_id)
+        except llm.UnknownModelError as e:
+            raise click.ClickException(str(e))
+        if not isinstance(model, IOIntelligenceModel):
+            raise click.ClickException(f"{model_id} is not an IO Intelligence model")
+        if os.path.exists(schema_input):
+            with open(schema_input, encoding="utf-8") as f:
+                schema_input = f.read()
+        try:
+            record = json.loads(schema_input)
+        except ValueError:
+            record = llm.schema_dsl(schema_input) if hasattr(llm, "schema_dsl") else None
+            if not record:
+                raise click.ClickException("--schema must be a JSON schema")
+        schema = {"type": "object", "properties": {"items": {"type": "array", "items": record}}, "required": ["items"]}
+        parts = [] if sys.stdin.isatty() else [sys.stdin.read()]
+        if prompt:
+            parts.append(prompt)
+        text = "\n\n".join(part for part in parts if part)
+        if not text:
+            raise click.UsageError("No prompt given")
+
+        async def run():
+            try:
+                async for item in model.stream_records(text, schema, system=system):
+                    click.echo(json.dumps(item))
+            finally:
+                await close_sessions()
+
+        try:
+            asyncio.run(run())
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    @ionet.command()
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("-o", "--output", type=click.File("w", encoding="utf-8"), default="-", help="Output file")
+    @click.option("--trace-id", help="Only include this trace")
+    def trace(path, output, trace_id):
+        """Convert an IONET_TRACE_FILE to a Chrome trace for flame graph viewers
+
+        Open the output in https://ui.perfetto.dev, chrome://tracing or
+        https://www.speedscope.app.
+        """
+        spans = read_trace_spans(path)
+        if trace_id:
+            spans = [span for span in spans if span["traceId"] == trace_id.lower()]
+        json.dump(chrome_trace(spans), output)
+        output.write("\n")
+
+    @ionet.command()
+    @click.option("--host", default="127.0.0.1", show_default=True, help="Interface to listen on")
+    @click.option("--port", type=int, default=8080, show_default=True, help="Port to listen on")
+    @click.option("--token", envvar="IONET_GATEWAY_TOKEN", help="Require this bearer token from clients")
+    def serve(host, port, token):
+        "Run an OpenAI-compatible gateway sharing one connection pool and quota"
+        from aiohttp import web
+
+        models = [model for model in llm.get_models() if isinstance(model, (IOIntelligenceModel, IORouterModel))]
+        if not models:
+            raise click.ClickException("No IO Intelligence models are registered")
+        click.echo(f"Serving {len(models)} models on http://{host}:{port}/v1", err=True)
+        web.run_app(Gateway(models, token).app(), host=host, port=port, print=None)
+
+    @ionet.command()
+    @click.option("--socket", "socket_path", help="Socket path (default: IONET_DAEMON_SOCKET or the runtime directory)")
+    def daemon(socket_path):
+        "Keep models and connections warm and serve prompts over a Unix socket"
+        from aiohttp import web
+
+        socket_path = socket_path or ionet_client.default_socket_path()
+        try:
+            if os.path.dirname(socket_path) == ionet_client.fallback_socket_dir():
+                ionet_client.private_socket_dir(os.path.dirname(socket_path))
+            if os.path.exists(socket_path):
+                ionet_client.check_socket_owner(socket_path)
+        except ionet_client.UntrustedSocketError as e:
+            raise click.ClickException(str(e))
+        if os.path.exists(socket_path):
+            try:
+                ionet_client.list_models(socket_path, timeout=1)
+            except ionet_client.DaemonUnavailableError:
+                # Left behind by a daemon that did not shut down cleanly
+                os.unlink(socket_path)
+            else:
+                raise click.ClickException(f"A daemon is already running on {socket_path}")
+        models = [model for model in llm.get_models() if isinstance(model, (IOIntelligenceModel, IORouterModel))]
+        if not models:
+            raise click.ClickException("No IO Intelligence models are registered")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the current user may connect; the umask is restored so later files are unaffected
+        previous_umask = os.umask(0o177)
+        try:
+            sock.bind(socket_path)
+        finally:
+            os.umask(previous_umask)
+        click.echo(f"Serving {len(models)} models on {socket_path}", err=True)
+        try:
+            web.run_app(Gateway(models).app(), sock=sock, print=None)
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+class ToolCallStreamParser:
+    """Incrementally extract text-simulated tool calls from streamed output
+
+    Recognises ``<tool_call>{...}</tool_call>`` blocks (Qwen/Hermes style),
+    ``<|python_tag|>{...}`` invocations (Llama style) and bare
+    ``{"name": ..., "arguments": {...}}`` objects that start a line. Plain
+    text is released as soon as it cannot be part of a call, so only a
+    candidate invocation is ever held back and each character is scanned
+    once.
+    """
+
+    TEXT, MARKER, TAG_BODY, JSON = range(4)
+    OPEN_TAG = "<tool_call>"
+    CLOSE_TAG = "</tool_call>"
+    PYTHON_TAG = "<|python_tag|>"
+    MARKERS = (OPEN_TAG, PYTHON_TAG)
+
+    def __init__(self, tool_names: Optional[List[str]] = None, max_call_chars: int = 65536):
+        self.tool_names = set(tool_names) if tool_names else None
+        self.max_call_chars = max_call_chars
+        self._state = self.TEXT
+        self._held = ""
+        self._at_line_start = True
+        # The marker that started the candidate held in JSON state, given back if it is not a call
+        self._marker = ""
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> tuple:
+        """Consume a chunk, returning ``(text_to_emit, [llm.ToolCall, ...])``"""
+        out: List[str] = []
+        calls: List[llm.ToolCall] = []
+        i = 0
+        n = len(text)
+        while i < n:
+            if self._state == self.TEXT:
+                # Fast path: copy everything up to the next possible call start
+                j = i
+                while j < n:
+                    ch = text[j]
+                    if ch == "<" or (ch == "{" and self._at_line_start):
+                        break
+                    if ch == "\n":
+                        self._at_line_start = True
+                    elif not ch.isspace():
+                        self._at_line_start = False
+                    j += 1
+                if j > i:
+                    out.append(text[i:j])
+                if j == n:
+                    break
+                self._held = text[j]
+                if text[j] == "<":
+                    self._state = self.MARKER
+                else:
+                    self._start_json()
+                    self._scan_json("{")
+                i = j + 1
+            elif self._state == self.MARKER:
+                candidate = self._held + text[i]
+                if any(marker.startswith(candidate) for marker in self.MARKERS):
+                    self._held = candidate
+                    i += 1
+                    if candidate == self.OPEN_TAG:
+                        self._held = ""
+                        self._state = self.TAG_BODY
+                    elif candidate == self.PYTHON_TAG:
+                        self._held = ""
+                        self._start_json(self.PYTHON_TAG)
+                else:
+                    # Not a marker after all - release it and rescan this character
+                    out.append(self._held)
+                    self._held = ""
+                    self._at_line_start = False
+                    self._state = self.TEXT
+            elif self._state == self.TAG_BODY:
+                search_from = max(0, len(self._held) - len(self.CLOSE_TAG) + 1)
+                self._held += text[i:]
+                end = self._held.find(self.CLOSE_TAG, search_from)
+                if end == -1:
+                    if len(self._held) > self.max_call_chars:
+                        out.append(self.OPEN_TAG + self._held)
+                        self._reset()
+                    break
+                consumed = len(self._held) - (n - i)
+                i = i + (end - consumed) + len(self.CLOSE_TAG)
+                body = self._held[:end]
+                self._held = ""
+                self._state = self.TEXT
+                parsed = self._parse_calls(body)
+                if parsed is None:
+                    out.append(self.OPEN_TAG + body + self.CLOSE_TAG)
+                else:
+                    calls.extend(parsed)
+            else:
+                if self._marker and not self._held.strip():
+                    # Only JSON may follow <|python_tag|>; anything else is ordinary text
+                    j = i
+                    while j < n and text[j].isspace():
+                        j += 1
+                    self._held += text[i:j]
+                    i = j
+                    if i == n:
+                        break
+                    if text[i] not in "{[":
+                        out.append(self._marker + self._held)
+                        self._at_line_start = self._held.endswith("\n")
+                        self._marker = ""
+                        self._held = ""
+                        self._state = self.TEXT
+                        continue
+                j = i
+                complete = False
+                while j < n:
+                    if self._scan_json(text[j]):
+                        complete = True
+                        j += 1
+                        break
+                    j += 1
+                self._held += text[i:j]
+                i = j
+                if complete:
+                    parsed = self._parse_calls(self._held)
+                    if parsed is None:
+                        out.append(self._marker + self._held)
+                        self._at_line_start = False
+                    else:
+                        calls.extend(parsed)
+                    self._marker = ""
+                    self._held = ""
+                    self._state = self.TEXT
+                elif len(self._held) > self.max_call_chars:
+                    out.append(self._marker + self._held)
+                    self._reset()
+        return "".join(out), calls
+
+    def finish(self) -> tuple:
+        """Flush anything still held at end of stream"""
+        held = self._held
+        calls: List[llm.ToolCall] = []
+        if self._state == self.TAG_BODY:
+            # Tolerate a missing closing tag at the very end of the output
+            parsed = self._parse_calls(held)
+            if parsed is None:
+                held = self.OPEN_TAG + held
+            else:
+                calls, held = parsed, ""
+        elif self._state == self.JSON:
+            # An unfinished call goes out as it came in, marker included
+            held = self._marker + held
+        self._reset()
+        return held, calls
+
+    def _reset(self):
+        self._state = self.TEXT
+        self._held = ""
+        self._marker = ""
+        self._at_line_start = False
+
+    def _start_json(self, marker: str = ""):
+        self._state = self.JSON
+        self._marker = marker
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def _scan_json(self, ch: str) -> bool:
+        """Advance the brace matcher by one character, True once the object closes"""
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+        elif ch == '"':
+            self._in_string = True
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            return self._depth == 0
+        return False
+
+    def _parse_calls(self, body: str) -> Optional[List[llm.ToolCall]]:
+        """Turn a JSON invocation into tool calls, or None if it is not one"""
+        try:
+            data = json.loads(body.strip())
+        except json.JSONDecodeError:
+            return None
+        items = data if isinstance(data, list) else [data]
+        calls = []
+        for item in items:
+            if not isinstance(item, dict):
+                return None
+            if isinstance(item.get("function"), dict):
+                item = item["function"]
+            name = item.get("name")
+            if not isinstance(name, str) or (self.tool_names is not None and name not in self.tool_names):
+                return None
+            arguments = tool_arguments(item.get("arguments", item.get("parameters", {})))
+            if arguments is None:
+                return None
+            calls.append(llm.ToolCall(name=name, arguments=arguments))
+        return calls or None
+
+
+def tool_arguments(arguments: Any) -> Optional[Dict[str, Any]]:
+    """Decode tool call arguments, which APIs send as a JSON string, or None if they are not an object"""
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments) if arguments.strip() else {}
+        except json.JSONDecodeError:
+            return None
+    return arguments if isinstance(arguments, dict) else None
+
+
+def native_tool_call(name: str, arguments: Any, tool_call_id: Optional[str] = None) -> llm.ToolCall:
+    """An llm.ToolCall for a function call returned in the API's ``tool_calls`` field"""
+    decoded = tool_arguments(arguments)
+    if decoded is None:
+        # Hand the tool what was sent rather than dropping the call
+        logger.warning("Tool call %s has arguments that are not a JSON object: %r", name, arguments)
+        decoded = {}
+    return llm.ToolCall(name=name, arguments=decoded, tool_call_id=tool_call_id)
+
+
+def parse_tool_calls(text: str, tool_names: Optional[List[str]] = None) -> tuple:
+    """Parse a complete response, returning ``(remaining_text, tool_calls)``"""
+    parser = ToolCallStreamParser(tool_names)
+    remaining, calls = parser.feed(text)
+    tail, tail_calls = parser.finish()
+    return remaining + tail, calls + tail_calls
+
+
+class SchemaValidationError(ValueError):
+    """A value in a structured response does not match the requested schema"""
+
+
+_JSON_TYPES = {
+    "object": dict, "array": list, "string": str, "boolean": bool, "null": type(None),
+    "integer": int, "number": (int, float),
+}
+
+
+def _resolve_ref(schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    """Follow a local ``#/...`` $ref, as produced for nested pydantic models"""
+    while isinstance(schema, dict) and "$ref" in schema:
+        target = root
+        for part in schema["$ref"].lstrip("#/").split("/"):
+            target = target[part.replace("~1", "/").replace("~0", "~")]
+        schema = target
+    return schema
+
+
+def validate_json(value: Any, schema: Dict[str, Any], root: Optional[Dict[str, Any]] = None, path: str = "$") -> List[str]:
+    """Check a value against the parts of JSON Schema used for structured output
+
+    Supports $ref, type, enum, const, properties, required,
+    additionalProperties, items, min/maxItems, min/maxLength, minimum,
+    maximum, anyOf and oneOf. Returns a list of problems, empty when valid.
+    """
+    root = root if root is not None else schema
+    schema = _resolve_ref(schema, root)
+    if not isinstance(schema, dict):
+        return []
+    for combinator in ("anyOf", "oneOf"):
+        if combinator in schema:
+            if not any(not validate_json(value, option, root, path) for option in schema[combinator]):
+                return [f"{path}: does not match any allowed schema"]
+    types = schema.get("type")
+    if types:
+        types = types if isinstance(types, list) else [types]
+        # bool is an int in Python but not in JSON
+        if not any(
+            isinstance(value, _JSON_TYPES.get(name, object)) and not (isinstance(value, bool) and name in ("integer", "number"))
+            for name in types
+        ):
+            return [f"{path}: expected {' or '.join(types)}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r} is not one of {schema['enum']}"]
+    if "const" in schema and value != schema["const"]:
+        return [f"{path}: expected {schema['const']!r}"]
+    errors = []
+    if isinstance(value, dict):
+        properties = schema.get("properties") or {}
+        for name in schema.get("required") or []:
+            if name not in value:
+                errors.append(f"{path}: missing required property {name!r}")
+        for name, item in value.items():
+            if name in properties:
+                errors.extend(validate_json(item, properties[name], root, f"{path}.{name}"))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected property {name!r}")
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: expected at least {schema['minItems']} items")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append(f"{path}: expected at most {schema['maxItems']} items")
+        if isinstance(schema.get("items"), dict):
+            for index, item in enumerate(value):
+                errors.extend(validate_json(item, schema["items"], root, f"{path}[{index}]"))
+    elif isinstance(value, str):
+        if len(value) < schema.get("minLength", 0):
+            errors.append(f"{path}: shorter than {schema['minLength']} characters")
+        if "maxLength" in schema and len(value) > schema["maxLength"]:
+            errors.append(f"{path}: longer than {schema['maxLength']} characters")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: {value} is below the minimum {schema['minimum']}")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: {value} is above the maximum {schema['maximum']}")
+    return errors
+
+
+def record_schema(schema: Dict[str, Any]) -> tuple:
+    """Where the records of a structured response live: ``(item_schema, in_array)``
+
+    For an array schema the records are its items; for an object with an
+    array property (llm's ``--schema-multi`` wraps records in ``items``) they
+    are that array's items. Any other schema describes a single record.
+    """
+    resolved = _resolve_ref(schema, schema)
+    if resolved.get("type") == "array":
+        return resolved.get("items") or {}, True
+    if resolved.get("type") == "object":
+        for prop in (resolved.get("properties") or {}).values():
+            prop = _resolve_ref(prop, schema)
+            if isinstance(prop, dict) and prop.get("type") == "array":
+                return prop.get("items") or {}, True
+    return resolved, False
+
+
+class JSONRecordStreamParser:
+    """Incrementally extract records from streamed JSON output
+
+    Records are the elements of the top-level array, or of the first array
+    property when the top-level value is an object. Each one is decoded and
+    validated as soon as its closing character arrives, so a caller can
+    start on the first record while the rest are still being generated.
+    Only the record currently being read is buffered. With a schema that
+    has no array, the whole value is the single record.
+    """
+
+    def __init__(self, schema: Optional[Dict[str, Any]] = None):
+        self.schema = schema
+        self.item_schema, in_array = record_schema(schema) if schema else (None, True)
+        # Nesting depth at which records start; found when the array opens
+        self._record_depth = None if in_array else 0
+        self._root = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buffer: List[str] = []
+        self._capturing = False
+        self._scalar = False
+        self._closed = False
+        self.count = 0
+
+    def feed(self, text: str) -> List[Any]:
+        """Consume a chunk of output, returning the records it completed"""
+        records = []
+        for ch in text:
+            if self._closed:
+                break
+            if self._in_string:
+                if self._capturing:
+                    self._buffer.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._capturing and self._depth == self._record_depth:
+                        records.append(self._emit())
+                continue
+
+            at_records = self._depth == self._record_depth
+            if self._scalar and (ch in ",]}" or ch.isspace()):
+                records.append(self._emit())
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0 and self._root is None:
+                    self._root = ch
+                if self._record_depth is None and ch == "[" and (self._depth == 0 or (self._depth == 1 and self._root == "{")):
+                    self._depth += 1
+                    self._record_depth = self._depth
+                    continue
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._record_depth is not None and self._depth < self._record_depth:
+                    # The array holding the records is complete
+                    self._closed = True
+                    continue
+            elif at_records and not self._capturing and not ch.isspace() and ch != ",":
+                self._scalar = True
+
+            if at_records and not self._capturing and (ch == '"' or ch in "{[" or self._scalar):
+                self._capturing = True
+            if self._capturing:
+                self._buffer.append(ch)
+                if ch in "}]" and self._depth == self._record_depth:
+                    records.append(self._emit())
+        return records
+
+    def finish(self) -> List[Any]:
+        """Flush a top-level scalar record and check the output was complete"""
+        # A scalar inside an unterminated array may be cut short, so only a bare top-level one counts
+        records = [self._emit()] if self._scalar and self._record_depth == 0 else []
+        if not self._closed:
+            if self._record_depth is None:
+                raise ValueError("No JSON array found in the response")
+            raise ValueError(f"Response ended before the JSON was complete ({self.count} records read)")
+        return records
+
+    def _emit(self) -> Any:
+        raw = "".join(self._buffer)
+        self._buffer = []
+        self._capturing = self._scalar = False
+        try:
+            value = json.loads(raw)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON in record {self.count}: {e}")
+        if self.item_schema:
+            errors = validate_json(value, self.item_schema, self.schema, f"$[{self.count}]")
+            if errors:
+                raise SchemaValidationError("; ".join(errors))
+        self.count += 1
+        if self._record_depth == 0:
+            self._closed = True
+        return value
+
+
+class TokenUsage(dict):
+    """Token counts reported by the API for one request"""
+
+    COUNTS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+    def add(self, usage: Dict[str, Any]):
+        """Accumulate another usage report, e.g. from a resumed stream"""
+        for field in self.COUNTS:
+            if usage.get(field) is not None:
+                self[field] = self.get(field, 0) + usage[field]
+        for field in ("prompt_tokens_details", "completion_tokens_details"):
+            if usage.get(field):
+                self[field] = usage[field]
+
+    @property
+    def total(self) -> int:
+        if self.get("total_tokens") is not None:
+            return self["total_tokens"]
+        return (self.get("prompt_tokens") or 0) + (self.get("completion_tokens") or 0)
+
+
+class BudgetExceededError(Exception):
+    """Raised when a request is refused because a token budget is exhausted"""
+
+
+class UsageLedger:
+    """Running per-key and per-model token ledger kept in SQLite
+
+    Also performs admission control against the IONET_TOKENS_PER_MINUTE and
+    IONET_DAILY_TOKEN_BUDGET budgets, which apply per API key over rolling
+    windows. With IONET_BUDGET_ACTION=delay (the default) a request waits up to
+    IONET_BUDGET_MAX_WAIT seconds for budget to free up; with reject it fails
+    straight away.
+    """
+
+    WINDOWS = (("IONET_TOKENS_PER_MINUTE", 60), ("IONET_DAILY_TOKEN_BUDGET", 86400))
+
+    def __init__(self, path: Optional[Union[str, Path]] = None):
+        self.path = Path(path or os.environ.get("IONET_USAGE_DB") or llm.user_dir() / "ionet_usage.db")
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                "id INTEGER PRIMARY KEY, ts REAL NOT NULL, key_hash TEXT NOT NULL, model TEXT NOT NULL, "
+                "prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, total_tokens INTEGER NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS usage_key_ts ON usage (key_hash, ts)")
+
+    def _connect(self):
+        return sqlite3.connect(str(self.path), timeout=30)
+
+    @staticmethod
+    def key_hash(api_key: str) -> str:
+        """Identify a key in the ledger without storing the key itself"""
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    def record(self, api_key: str, model: str, usage: Dict[str, Any]):
+        """Add one response's usage to the ledger"""
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        total_tokens = usage.get("total_tokens") or prompt_tokens + completion_tokens
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT INTO usage (ts, key_hash, model, prompt_tokens, completion_tokens, total_tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), self.key_hash(api_key), model, prompt_tokens, completion_tokens, total_tokens),
+            )
+
+    def tokens_since(self, api_key: str, since: float, model: Optional[str] = None) -> int:
+        """Total tokens used by a key (optionally for one model) since a timestamp"""
+        sql = "SELECT COALESCE(SUM(total_tokens), 0) FROM usage WHERE key_hash = ? AND ts >= ?"
+        params: List[Any] = [self.key_hash(api_key), since]
+        if model:
+            sql += " AND model = ?"
+            params.append(model)
+        with self._connect() as db:
+            return db.execute(sql, params).fetchone()[0]
+
+    def summary(self, since: float = 0) -> List[Dict[str, Any]]:
+        """Usage grouped by key and model since a timestamp"""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT key_hash, model, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens) "
+                "FROM usage WHERE ts >= ? GROUP BY key_hash, model ORDER BY SUM(total_tokens) DESC",
+                (since,),
+            ).fetchall()
+        columns = ("key", "model", "requests", "prompt_tokens", "completion_tokens", "total_tokens")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def seconds_until_admitted(self, api_key: str) -> float:
+        """How long until the key is back under every configured budget (0 if it is now)"""
+        now = time.time()
+        wait = 0.0
+        for env_var, window in self.WINDOWS:
+            budget = _env_float(env_var, 0)
+            if not budget:
+                continue
+            with self._connect() as db:
+                rows = db.execute(
+                    "SELECT ts, total_tokens FROM usage WHERE key_hash = ? AND ts >= ? ORDER BY ts",
+                    (self.key_hash(api_key), now - window),
+                ).fetchall()
+            used = sum(tokens for _, tokens in rows)
+            # Walk forward through the window until enough old usage has expired
+            for ts, tokens in rows:
+                if used < budget:
+                    break
+                used -= tokens
+                wait = max(wait, ts + window - now)
+        return wait
+
+    async def admit(self, api_key: str):
+        """Wait for, or refuse, a request according to the configured budgets"""
+        action = os.environ.get("IONET_BUDGET_ACTION", "delay").strip().lower()
+        max_wait = _env_float("IONET_BUDGET_MAX_WAIT", 60.0)
+        waited = 0.0
+        while True:
+            wait = self.seconds_until_admitted(api_key)
+            if wait <= 0:
+                return
+            if action == "reject" or waited + wait > max_wait:
+                raise BudgetExceededError(f"Token budget exhausted for this key; retry in {wait:.0f}s")
+            logger.info("Token budget exhausted, delaying request by %.1fs", wait)
+            await asyncio.sleep(wait)
+            waited += wait
+
+
+_usage_ledger = None
+
+
+def get_usage_ledger() -> Optional[UsageLedger]:
+    """The shared usage ledger, or None when disabled with IONET_USAGE_LEDGER=0"""
+    global _usage_ledger
+    if os.environ.get("IONET_USAGE_LEDGER", "1").strip().lower() in ("0", "false", "no"):
+        return None
+    path = Path(os.environ.get("IONET_USAGE_DB") or llm.user_dir() / "ionet_usage.db")
+    if _usage_ledger is None or _usage_ledger.path != path:
+        _usage_ledger = UsageLedger(path)
+    return _usage_ledger
+
+
+def _set_response_usage(response, usage: TokenUsage):
+    """Copy API usage onto an llm response"""
+    details = {}
+    for field in ("prompt_tokens_details", "completion_tokens_details"):
+        if usage.get(field):
+            details[field] = usage[field]
+    response.set_usage(
+        input=usage.get("prompt_tokens"),
+        output=usage.get("completion_tokens"),
+        details=details or None,
+    )
+
+
+class RateLimiter:
+    """Thread-safe GCRA rate limiter allowing ``rate`` requests per ``period`` seconds"""
+
+    def __init__(self, rate: float, period: float = 60.0, burst: int = 1):
+        self.interval = period / rate if rate else 0.0
+        self.tolerance = self.interval * max(0, burst - 1)
+        self._tat = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _now() -> float:
+        return time.monotonic()
+
+    def delay(self) -> float:
+        """How long a request made now would have to wait"""
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = self._now()
+            return max(0.0, max(self._tat, now) - self.tolerance - now)
+
+    def reserve(self) -> float:
+        """Reserve the next slot and return how long to wait for it"""
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = self._now()
+            tat = max(self._tat, now)
+            self._tat = tat + self.interval
+            return max(0.0, tat - self.tolerance - now)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class SharedRateLimiter(RateLimiter):
+    """GCRA rate limiter whose state lives in shared memory, for use across processes
+
+    Create it in the parent and hand it to worker processes (for example as a
+    Pool initializer argument); every process then draws from the same budget.
+    """
+
+    def __init__(self, rate: float, period: float = 60.0, burst: int = 1, context=None):
+        super().__init__(rate, period, burst)
+        context = context or multiprocessing.get_context()
+        self._shared_tat = context.Value("d", 0.0)
+        self._lock = self._shared_tat.get_lock()
+
+    @staticmethod
+    def _now() -> float:
+        # Wall-clock time is comparable between processes
+        return time.time()
+
+    @property
+    def _tat(self) -> float:
+        return self._shared_tat.value
+
+    @_tat.setter
+    def _tat(self, value: float):
+        # Set by RateLimiter.__init__ before the shared value exists
+        if "_shared_tat" in self.__dict__:
+            self._shared_tat.value = value
+
+
+# Limiter every request in this process waits on, set in batch worker processes
+_process_rate_limiter: Optional[RateLimiter] = None
+
+
+class KeyState:
+    """Quota and health bookkeeping for one pooled API key"""
+
+    def __init__(self, key: str, rpm: float = 0, burst: int = 1):
+        self.key = key
+        self.limiter = RateLimiter(rpm, burst=burst)
+        self.remaining_requests: Optional[int] = None
+        self.remaining_tokens: Optional[int] = None
+        self.cooldown_until = 0.0
+        self.recent_429s = deque(maxlen=20)
+        self.in_flight = 0
+
+
+class KeyPool:
+    """Spread requests across several API keys
+
+    Keys are ranked by cooldown after a 429, recent 429s, remaining quota
+    reported in the x-ratelimit-remaining-* headers and requests in flight.
+    Each key has its own rate limiter (IONET_KEY_RPM requests per minute,
+    IONET_KEY_BURST burst) and its own connection pool.
+    """
+
+    def __init__(self, keys: List[str], rpm: float = 0, burst: int = 1):
+        self.states = [KeyState(key, rpm, burst) for key in keys]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.states)
+
+    def _rank(self, state: KeyState, now: float) -> tuple:
+        recent_429s = sum(1 for ts in state.recent_429s if now - ts < 60)
+        remaining = state.remaining_tokens if state.remaining_tokens is not None else state.remaining_requests
+        # Keys without quota information yet sort first so they get explored
+        return (
+            state.cooldown_until > now,
+            recent_429s,
+            -remaining if remaining is not None else float("-inf"),
+            state.in_flight,
+            state.limiter.delay(),
+        )
+
+    async def acquire(self) -> KeyState:
+        """Pick the best key and wait for its cooldown and rate limiter"""
+        with self._lock:
+            now = time.monotonic()
+            state = min(self.states, key=lambda candidate: self._rank(candidate, now))
+            state.in_flight += 1
+            cooldown = max(0.0, state.cooldown_until - now)
+        try:
+            if cooldown:
+                await asyncio.sleep(cooldown)
+            await state.limiter.acquire()
+        except BaseException:
+            self.release(state)
+            raise
+        return state
+
+    def release(self, state: KeyState, status: Optional[int] = None, headers=None):
+        """Return a key, updating its quota from the response status and headers"""
+        with self._lock:
+            state.in_flight -= 1
+            if headers:
+                for header, attr in (
+                    ("x-ratelimit-remaining-requests", "remaining_requests"),
+                    ("x-ratelimit-remaining-tokens", "remaining_tokens"),
+                ):
+                    try:
+                        setattr(state, attr, int(headers[header]))
+                    except (KeyError, TypeError, ValueError):
+                        pass
+            if status == 429:
+                now = time.monotonic()
+                state.recent_429s.append(now)
+                try:
+                    cooldown = float(headers["Retry-After"])
+                except (KeyError, TypeError, ValueError):
+                    recent = sum(1 for ts in state.recent_429s if now - ts < 60)
+                    cooldown = min(60.0, 2.0 ** recent)
+                state.cooldown_until = now + cooldown
+
+
+_key_pool = None
+
+
+def get_key_pool() -> Optional[KeyPool]:
+    """The shared key pool built from IONET_KEYS (or 'llm keys set ionet_keys'), if configured"""
+    global _key_pool
+    configured = os.environ.get("IONET_KEYS")
+    if not configured:
+        try:
+            configured = llm.get_key(None, "ionet_keys", None)
+        except Exception:
+            configured = None
+    keys = [key.strip() for key in (configured or "").split(",") if key.strip()]
+    if not keys:
+        return None
+    rpm = _env_float("IONET_KEY_RPM", 0)
+    burst = int(_env_float("IONET_KEY_BURST", 1))
+    if _key_pool is None or [state.key for state in _key_pool.states] != keys:
+        _key_pool = KeyPool(keys, rpm, burst)
+    return _key_pool
+
+
+def canonical_json(value: Any) -> bytes:
+    """Serialize a request body deterministically
+
+    Whitespace is fixed and the top-level keys are sorted, so the same
+    conversation always produces the same bytes - across turns, processes
+    and Python versions - and the provider can reuse its KV cache for the
+    repeated prefix. Nested objects keep their insertion order, which
+    build_payload already makes stable: JSON schemas in tools and
+    response_format must not be reordered, since guided decoding generates
+    fields in schema order.
+    """
+    if isinstance(value, dict):
+        value = dict(sorted(value.items()))
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def prompt_prefix(payload: Dict[str, Any]) -> bytes:
+    """The part of a request the provider renders into the prompt, in render order"""
+    return canonical_json([payload.get("model"), payload.get("tools") or [], payload.get("messages") or []])
+
+
+def shared_prefix_length(a: bytes, b: bytes) -> int:
+    """Length of the common prefix of two byte strings"""
+    low, high = 0, min(len(a), len(b))
+    # Binary search on slice equality keeps the comparisons in C
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class PrefixDiagnostics:
+    """Reports how much of each prompt repeats the previous prompt sent to the same model
+
+    Enabled with IONET_PREFIX_LOG=<path>; every request appends a JSON line
+    with the prompt size, the shared prefix length and a hash of the prompt,
+    so identical prompts can also be spotted across processes.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._previous: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = prompt_prefix(payload)
+        with self._lock:
+            previous = self._previous.get(model)
+            self._previous[model] = prompt
+        shared = shared_prefix_length(previous, prompt) if previous is not None else 0
+        record = {
+            "timestamp": time.time(),
+            "model": model,
+            "prompt_bytes": len(prompt),
+            "shared_prefix_bytes": shared,
+            "shared_ratio": round(shared / len(prompt), 4) if prompt else 0.0,
+            "prompt_sha256": hashlib.sha256(prompt).hexdigest(),
+        }
+        log_event(logging.DEBUG, "prefix.shared", "Prompt for {model} shares {shared_bytes} of {prompt_bytes} bytes "
+                  "with the previous request", model=model, shared_bytes=shared, prompt_bytes=len(prompt))
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        return record
+
+
+_prefix_diagnostics = None
+
+
+def get_prefix_diagnostics() -> Optional[PrefixDiagnostics]:
+    """The shared prefix diagnostics, or None unless IONET_PREFIX_LOG is set"""
+    global _prefix_diagnostics
+    path = os.environ.get("IONET_PREFIX_LOG")
+    if not path:
+        return None
+    if _prefix_diagnostics is None or _prefix_diagnostics.path != Path(path):
+        _prefix_diagnostics = PrefixDiagnostics(path)
+    return _prefix_diagnostics
+
+
+class CacheBackend:
+    """Byte-value cache with TTLs, compression of large values and stampede protection
+
+    Subclasses store raw entries; this class packs values (zlib-compressing
+    those of IONET_CACHE_COMPRESS_MIN bytes or more), skips values above
+    IONET_CACHE_MAX_VALUE, and implements get_or_compute, which lets only
+    one caller - across threads, processes and hosts sharing the backend -
+    compute a missing value while the others wait for it.
+    """
+
+    def __init__(self):
+        self.compress_min = int(_env_float("IONET_CACHE_COMPRESS_MIN", 1024))
+        self.max_value = int(_env_float("IONET_CACHE_MAX_VALUE", 8 * 1024 * 1024))
+
+    # Storage primitives implemented by each backend
+    def _get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: bytes, ttl: Optional[float]):
+        raise NotImplementedError
+
+    def _add(self, key: str, value: bytes, ttl: Optional[float]) -> bool:
+        """Store only if the key is missing, returning whether it was stored"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[bytes]:
+        packed = self._get(key)
+        if packed is None:
+            return None
+        if packed[:1] == b"z":
+            return zlib.decompress(packed[1:])
+        return packed[1:]
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if len(value) >= self.compress_min:
+            packed = b"z" + zlib.compress(value)
+        else:
+            packed = b"r" + value
+        if len(packed) > self.max_value:
+            log_event(logging.DEBUG, "cache.skip", "Not caching {cache_key}: {size} bytes is over IONET_CACHE_MAX_VALUE",
+                      cache_key=key, size=len(packed))
+            return
+        self._set(key, packed, ttl)
+
+    async def get_or_compute(self, key: str, compute, ttl: Optional[float] = None,
+                             lock_timeout: float = 60.0) -> Optional[bytes]:
+        """Return the cached value, computing it with ``await compute()`` on a miss
+
+        A None result is returned but not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        lock_key = f"{key}:lock"
+        if not self._add(lock_key, b"1", lock_timeout):
+            # Someone else is computing it - wait for their result rather than stampeding
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                value = self.get(key)
+                if value is not None:
+                    return value
+                if self._add(lock_key, b"1", lock_timeout):
+                    break
+            else:
+                return await compute()
+        try:
+            value = await compute()
+            if value is not None:
+                self.set(key, value, ttl)
+            return value
+        finally:
+            self.delete(lock_key)
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU cache bounded by entry count and total bytes"""
+
+    def __init__(self, max_items: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        super().__init__()
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            self._remove(key)
+            return None
+        return value
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def _get(self, key):
+        with self._lock:
+            value = self._live(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def _set_locked(self, key, value, ttl):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._bytes += len(value)
+        while self._entries and (len(self._entries) > self.max_items or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def _set(self, key, value, ttl):
+        with self._lock:
+            self._set_locked(key, value, ttl)
+
+    def _add(self, key, value, ttl):
+        # Check and insert under one lock hold so only one caller can win
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._set_locked(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+
+class SQLiteCache(CacheBackend):
+    """Cache in a local SQLite file, shared by every process on the host
+
+    The least recently used entries are evicted once the stored values pass
+    max_bytes.
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = 256 * 1024 * 1024):
+        super().__init__()
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "expires REAL, accessed REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    def _connect(self):
+        return sqlite3.connect(str(self.path), timeout=30)
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock, self._connect() as db:
+            row = db.execute(
+                "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        return bytes(row[0])
+
+    def _set(self, key, value, ttl):
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl if ttl else None, now),
+            )
+            self._evict(db, now)
+
+    def _add(self, key, value, ttl):
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM cache WHERE key = ? AND expires IS NOT NULL AND expires <= ?", (key, now))
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl if ttl else None, now),
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _evict(self, db, now: float):
+        db.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        for key, size in db.execute("SELECT key, LENGTH(value) FROM cache ORDER BY accessed").fetchall():
+            db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+
+
+class RedisCache(CacheBackend):
+    """Cache on a Redis (or Redis-protocol compatible) server, shared between hosts
+
+    Speaks RESP directly over a socket, so no client library is needed.
+    Size limits are left to the server's maxmemory policy.
+    """
+
+    def __init__(self, url: str, prefix: str = "ionet:", timeout: float = 5.0):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._socket = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._socket.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", str(self.db))
+
+    def close(self):
+        if self._socket is not None:
+            self._reader.close()
+            self._socket.close()
+            self._socket = self._reader = None
+
+    def _call(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._socket.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise Exception(f"Redis error: {rest.decode()}")
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected Redis reply: {line!r}")
+
+    def command(self, *args):
+        """Run a command, reconnecting once if the connection dropped"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._socket is None:
+                        self._connect()
+                    return self._call(*args)
+                except (OSError, ConnectionError):
+                    self.close()
+                    if attempt:
+                        raise
+
+    def _get(self, key):
+        return self.command("GET", self.prefix + key)
+
+    def _set(self, key, value, ttl):
+        if ttl:
+            self.command("SET", self.prefix + key, value, "PX", str(int(ttl * 1000)))
+        else:
+            self.command("SET", self.prefix + key, value)
+
+    def _add(self, key, value, ttl):
+        args = ["SET", self.prefix + key, value, "NX"]
+        if ttl:
+            args += ["PX", str(int(ttl * 1000))]
+        return self.command(*args) == "OK"
+
+    def delete(self, key):
+        self.command("DEL", self.prefix + key)
+
+
+_caches: Dict[str, CacheBackend] = {}
+
+
+def get_cache() -> CacheBackend:
+    """The cache backend named by IONET_CACHE
+
+    ``memory`` (the default) keeps an LRU in this process, ``sqlite`` or
+    ``sqlite:///path/to/file.db`` shares a file between local processes, and
+    ``redis://[:password@]host:port/db`` shares a Redis server between hosts.
+    IONET_CACHE_MAX_BYTES bounds the memory and SQLite backends.
+    """
+    spec = os.environ.get("IONET_CACHE", "memory").strip() or "memory"
+    cache = _caches.get(spec)
+    if cache is None:
+        max_bytes = _env_float("IONET_CACHE_MAX_BYTES", 0)
+        if spec == "memory":
+            cache = MemoryCache(max_bytes=int(max_bytes or 64 * 1024 * 1024))
+        elif spec == "sqlite" or spec.startswith("sqlite://"):
+            path = spec[len("sqlite://"):] or llm.user_dir() / "ionet_cache.db"
+            cache = SQLiteCache(path, max_bytes=int(max_bytes or 256 * 1024 * 1024))
+        elif spec.startswith(("redis://", "rediss://")):
+            if spec.startswith("rediss://"):
+                raise ValueError("TLS Redis connections (rediss://) are not supported")
+            cache = RedisCache(spec)
+        else:
+            raise ValueError(f"Unknown IONET_CACHE backend: {spec!r}")
+        _caches[spec] = cache
+    return cache
+
+
+DEFAULT_EMBEDDING_MODEL = "mixedbread-ai/mxbai-embed-large-v1"
+
+
+async def fetch_embeddings(texts: List[str], model: str = DEFAULT_EMBEDDING_MODEL,
+                           api_key: Optional[str] = None) -> List[List[float]]:
+    """Embed texts with an io.net embedding model, in input order
+
+    Without an explicit key the request goes through the key pool like chat
+    requests do. The tokens used are added to the usage ledger.
+    """
+    pool = None if api_key else get_key_pool()
+    lease = await pool.acquire() if pool else None
+    key = lease.key if lease else api_key or get_api_key()
+    status = headers = None
+    try:
+        if not key:
+            raise ValueError("IONET key is required. Set it with 'llm keys set ionet' or IONET environment variable.")
+        # Awaited rather than used as a context manager so HTTP2Session works too
+        response = await get_session(key).post(
+            f"{get_api_base()}/embeddings",
+            headers={"Authorization": f"Bearer {key}", "Content-Type": "application/json"},
+            data=canonical_json({"model": model, "input": texts}),
+            timeout=aiohttp.ClientTimeout(total=60),
+        )
+        try:
+            status, headers = response.status, response.headers
+            if response.status != 200:
+                raise Exception(f"Embedding request failed: {response.status} - {await response.text()}")
+            body = await response.json()
+        finally:
+            response.release()
+    finally:
+        if lease:
+            pool.release(lease, status, headers)
+    ledger = get_usage_ledger()
+    if ledger and body.get("usage"):
+        ledger.record(key, model, body["usage"])
+    return [item["embedding"] for item in sorted(body["data"], key=lambda item: item.get("index", 0))]
+
+
+# math.sumprod arrived in Python 3.12
+_dot = getattr(math, "sumprod", None) or (lambda a, b: sum(map(operator.mul, a, b)))
+
+
+class SemanticCache:
+    """Answers paraphrases of earlier prompts with the responses they got
+
+    The final user message of each request is embedded with an io.net
+    embedding model and compared with the prompts of earlier responses by
+    cosine similarity; the closest one at or above the threshold is replayed.
+    Everything else in the request - model, system prompt, history and
+    generation options - has to match exactly, as it selects the namespace
+    that is searched. Entries live in SQLite for ttl seconds, with at most
+    max_entries per namespace, and each namespace is scanned in full, which
+    is quick at that size. Every hit is written to an audit table, so answers
+    served for a different wording can be reviewed and forgotten.
+    """
+
+    def __init__(self, path: Union[str, Path], threshold: float = 0.95, ttl: float = 86400,
+                 model: str = DEFAULT_EMBEDDING_MODEL, max_entries: int = 2000, embed=None):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.model = model
+        self.max_entries = max(max_entries, 1)
+        self.embed = embed or self._embed_with_api
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, model TEXT NOT NULL, prompt TEXT NOT NULL, "
+                "embedding BLOB NOT NULL, response TEXT NOT NULL, created REAL NOT NULL, expires REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_namespace ON entries (namespace, expires)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS hits ("
+                "id INTEGER PRIMARY KEY, ts REAL NOT NULL, model TEXT NOT NULL, prompt TEXT NOT NULL, "
+                "entry_id INTEGER NOT NULL, matched_prompt TEXT NOT NULL, similarity REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(str(self.path), timeout=30)
+
+    async def _embed_with_api(self, text: str, api_key: Optional[str]) -> List[float]:
+        return (await fetch_embeddings([text], self.model, api_key))[0]
+
+    def namespace(self, model_id: str, payload: Dict[str, Any]) -> Optional[tuple]:
+        """``(namespace, prompt)`` for a request the cache can answer, or None
+
+        Requests with tools, attachments or several choices are never answered.
+        """
+        messages = payload.get("messages") or []
+        if not messages or payload.get("tools") or payload.get("attachments") or (payload.get("n") or 1) > 1:
+            return None
+        last = messages[-1]
+        if last.get("role") != "user" or not isinstance(last.get("content"), str) or not last["content"].strip():
+            return None
+        context = {key: value for key, value in payload.items() if key not in ("stream", "stream_options")}
+        context["messages"] = messages[:-1]
+        material = canonical_json([self.model, model_id, context])
+        return hashlib.sha256(material).hexdigest(), last["content"]
+
+    async def lookup(self, model_id: str, payload: Dict[str, Any], api_key: Optional[str] = None) -> tuple:
+        """Search for a request's answer, returning ``(query, answer)``
+
+        query is None when the request is not cacheable (or could not be
+        embedded); otherwise pass it to store() once a fresh response is in.
+        answer is the cached response text, or None on a miss.
+        """
+        key = self.namespace(model_id, payload)
+        if key is None:
+            return None, None
+        namespace, prompt = key
+        try:
+            vector = await self.embed(prompt, api_key)
+        except Exception as e:
+            logger.warning("Semantic cache skipped, the prompt could not be embedded: %s", e)
+            return None, None
+        norm = math.sqrt(_dot(vector, vector)) or 1.0
+        embedding = array("f", [value / norm for value in vector])
+        query = (namespace, prompt, embedding)
+        match = self.search(namespace, embedding)
+        if match is None:
+            return query, None
+        entry_id, matched_prompt, response, similarity = match
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT INTO hits (ts, model, prompt, entry_id, matched_prompt, similarity) VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), model_id, prompt, entry_id, matched_prompt, similarity),
+            )
+        log_event(logging.INFO, "semantic_cache.hit", "Answered from the semantic cache ({similarity:.3f} similar)",
+                  model=model_id, similarity=similarity, entry_id=entry_id)
+        return query, response
+
+    def search(self, namespace: str, embedding: array) -> Optional[tuple]:
+        """The live entry most similar to a normalized embedding, if it reaches the threshold
+
+        Returns ``(entry_id, prompt, response, similarity)``.
+        """
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT id, prompt, embedding, response FROM entries WHERE namespace = ? AND expires > ?",
+                (namespace, time.time()),
+            ).fetchall()
+        best = None
+        for entry_id, prompt, blob, response in rows:
+            candidate = array("f")
+            candidate.frombytes(blob)
+            similarity = _dot(candidate, embedding)
+            if best is None or similarity > best[3]:
+                best = (entry_id, prompt, response, similarity)
+        if best is None or best[3] < self.threshold:
+            return None
+        return best
+
+    def store(self, model_id: str, query: tuple, response: str):
+        """Keep a fresh response under the query lookup() returned for it"""
+        namespace, prompt, embedding = query
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT INTO entries (namespace, model, prompt, embedding, response, created, expires) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, model_id, prompt, embedding.tobytes(), response, now, now + self.ttl),
+            )
+            db.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+            db.execute(
+                "DELETE FROM entries WHERE namespace = ? AND id NOT IN "
+                "(SELECT id FROM entries WHERE namespace = ? ORDER BY id DESC LIMIT ?)",
+                (namespace, namespace, self.max_entries),
+            )
+
+    def hits(self, since: float = 0) -> List[Dict[str, Any]]:
+        """The audit log of semantic hits since a timestamp, newest first"""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT ts, model, similarity, entry_id, prompt, matched_prompt FROM hits WHERE ts >= ? ORDER BY ts DESC",
+                (since,),
+            ).fetchall()
+        columns = ("ts", "model", "similarity", "entry_id", "prompt", "matched_prompt")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def forget(self, entry_id: int) -> bool:
+        """Remove an entry so it is no longer served, returning whether it existed"""
+        with self._lock, self._connect() as db:
+            return db.execute("DELETE FROM entries WHERE id = ?", (entry_id,)).rowcount == 1
+
+
+_semantic_cache = None
+
+
+def semantic_cache_path() -> Path:
+    return Path(os.environ.get("IONET_SEMANTIC_CACHE_DB") or llm.user_dir() / "ionet_semantic_cache.db")
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """The shared semantic response cache, or None unless IONET_SEMANTIC_CACHE_TTL is set"""
+    global _semantic_cache
+    ttl = _env_float("IONET_SEMANTIC_CACHE_TTL", 0)
+    if ttl <= 0:
+        return None
+    path = semantic_cache_path()
+    model = os.environ.get("IONET_EMBEDDING_MODEL") or DEFAULT_EMBEDDING_MODEL
+    if _semantic_cache is None or (_semantic_cache.path, _semantic_cache.model) != (path, model):
+        _semantic_cache = SemanticCache(path, model=model)
+    _semantic_cache.ttl = ttl
+    _semantic_cache.threshold = _env_float("IONET_SEMANTIC_CACHE_THRESHOLD", 0.95)
+    _semantic_cache.max_entries = max(int(_env_float("IONET_SEMANTIC_CACHE_MAX_ENTRIES", 2000)), 1)
+    return _semantic_cache
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Rough token count for chat messages (about four characters per token)"""
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        total += len(content) // 4 + 4
+        if message.get("tool_calls"):
+            total += len(json.dumps(message["tool_calls"])) // 4
+    return total
+
+
+def _uses_tools(turn: List[Dict[str, Any]]) -> bool:
+    return any(message["role"] == "tool" or message.get("tool_calls") for message in turn)
+
+
+class ConversationCompactor:
+    """Replaces the older turns of long conversations with a summary from a cheap model
+
+    Once a conversation's history passes IONET_COMPACT_TOKENS, the turns before
+    the last IONET_COMPACT_KEEP_TURNS are summarized by IONET_COMPACT_MODEL in a
+    background thread. The request that crosses the threshold is still sent in
+    full; later requests send the summary plus any turns it does not cover yet.
+    Recent turns and turns with tool calls or tool results are always sent
+    verbatim. Summaries are stored in SQLite so they survive between
+    ``llm -c`` invocations.
+    """
+
+    SUMMARY_SYSTEM = (
+        "You compress chat transcripts. Summarize the conversation so far in a few short paragraphs, "
+        "keeping facts, decisions, names, numbers, code identifiers and open questions. "
+        "Do not add anything that was not said."
+    )
+
+    def __init__(self, path: Union[str, Path], threshold: int, keep_turns: int = 4,
+                 model_id: str = "ionet/llama-3.3-70b", summarize=None):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.keep_turns = max(keep_turns, 1)
+        self.model_id = model_id
+        self.summarize = summarize or self._summarize_with_model
+        self._running: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                "conversation_id TEXT NOT NULL, turns INTEGER NOT NULL, summary TEXT NOT NULL, "
+                "created REAL NOT NULL, PRIMARY KEY (conversation_id, turns))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(str(self.path), timeout=30)
+
+    def latest(self, conversation_id: str) -> tuple:
+        """``(turns_covered, summary)`` for the newest summary of a conversation"""
+        with self._lock, self._connect() as db:
+            row = db.execute(
+                "SELECT turns, summary FROM summaries WHERE conversation_id = ? ORDER BY turns DESC LIMIT 1",
+                (conversation_id,),
+            ).fetchone()
+        return row if row else (0, None)
+
+    def compact(self, conversation_id: str, system: Optional[str], turns: List[List[Dict[str, Any]]]) -> tuple:
+        """Return ``(system, history_messages)`` with older turns replaced by their summary"""
+        flat = [message for turn in turns for message in turn]
+        if len(turns) <= self.keep_turns or estimate_tokens(flat) < self.threshold:
+            return system, flat
+        old, recent = turns[:-self.keep_turns], turns[-self.keep_turns:]
+        covered, summary = self.latest(conversation_id)
+        covered = min(covered, len(old))
+        if covered < len(old):
+            self._schedule(conversation_id, summary, old, covered)
+        if not summary:
+            return system, flat
+
+        kept = [
+            message
+            for index, turn in enumerate(old)
+            if index >= covered or _uses_tools(turn)
+            for message in turn
+        ]
+        summary_text = f"Summary of the earlier conversation:\n{summary}"
+        system = f"{system}\n\n{summary_text}" if system else summary_text
+        return system, kept + [message for turn in recent for message in turn]
+
+    def _schedule(self, conversation_id: str, summary: Optional[str], old: List[List[Dict[str, Any]]], covered: int):
+        with self._lock:
+            running = self._running.get(conversation_id)
+            if running and running.is_alive():
+                return
+            # Not a daemon thread, so a one-shot `llm -c` process finishes the summary before exiting
+            thread = threading.Thread(
+                target=self._run, args=(conversation_id, summary, old, covered), name="ionet-compaction"
+            )
+            self._running[conversation_id] = thread
+        thread.start()
+
+    def _run(self, conversation_id: str, summary: Optional[str], old: List[List[Dict[str, Any]]], covered: int):
+        lines = []
+        if summary:
+            lines.append(f"Summary so far:\n{summary}\n")
+        for turn in old[covered:]:
+            if _uses_tools(turn):
+                continue
+            for message in turn:
+                lines.append(f"{message['role']}: {message.get('content') or ''}")
+        try:
+            new_summary = self.summarize("\n".join(lines)).strip()
+        except Exception as e:
+            logger.warning("Conversation compaction failed: %s", e)
+            return
+        if not new_summary:
+            return
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO summaries (conversation_id, turns, summary, created) VALUES (?, ?, ?, ?)",
+                (conversation_id, len(old), new_summary, time.time()),
+            )
+        logger.debug("Compacted %s turns of conversation %s", len(old), conversation_id)
+
+    def wait(self, timeout: Optional[float] = None):
+        """Wait for running summaries to finish"""
+        for thread in list(self._running.values()):
+            thread.join(timeout)
+
+    def _summarize_with_model(self, transcript: str) -> str:
+        return llm.get_model(self.model_id).prompt(transcript, system=self.SUMMARY_SYSTEM, stream=False).text()
+
+
+_compactor = None
+
+
+def get_compactor() -> Optional[ConversationCompactor]:
+    """The shared conversation compactor, or None unless IONET_COMPACT_TOKENS is set"""
+    global _compactor
+    threshold = int(_env_float("IONET_COMPACT_TOKENS", 0))
+    if threshold <= 0:
+        return None
+    path = Path(os.environ.get("IONET_COMPACT_DB") or llm.user_dir() / "ionet_compaction.db")
+    keep_turns = int(_env_float("IONET_COMPACT_KEEP_TURNS", 4))
+    model_id = os.environ.get("IONET_COMPACT_MODEL") or "ionet/llama-3.3-70b"
+    if _compactor is None or (_compactor.path, _compactor.model_id) != (path, model_id):
+        _compactor = ConversationCompactor(path, threshold, keep_turns, model_id)
+    _compactor.threshold = threshold
+    _compactor.keep_turns = max(keep_turns, 1)
+    return _compactor
+
+
+def chunk_document(text: str, max_tokens: int) -> List[str]:
+    """Split a document into chunks of at most about max_tokens tokens
+
+    Chunks are built from whole paragraphs (falling back to sentences, then to
+    hard cuts for oversized ones). Past half the budget a chunk also ends after
+    any paragraph whose hash picks it as a boundary, so boundaries depend on
+    content rather than position: an edit only changes the chunks around it
+    and the rest of the document re-chunks identically.
+    """
+    max_chars = max(max_tokens, 1) * 4
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        sentence_group = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            while len(sentence) > max_chars:
+                pieces.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if sentence_group and len(sentence_group) + len(sentence) + 1 > max_chars:
+                pieces.append(sentence_group)
+                sentence_group = ""
+            sentence_group = f"{sentence_group} {sentence}" if sentence_group else sentence
+        if sentence_group:
+            pieces.append(sentence_group)
+
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for piece in pieces:
+        if current and size + len(piece) > max_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 2
+        if size >= max_chars // 2 and int(hashlib.sha1(piece.encode("utf-8")).hexdigest()[:8], 16) % 4 == 0:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class DocumentSummarizer:
+    """Map-reduce summarization of documents larger than a model's context window
+
+    The document is chunked, every chunk is summarized concurrently (at most
+    ``concurrency`` requests in flight), and the summaries are then combined
+    in groups that fit the chunk budget, level by level, until one remains.
+    Every partial result is cached in SQLite under a hash of the model,
+    instructions and input text, so re-running on an edited document only
+    sends the chunks (and reduce groups) that changed.
+    """
+
+    MAP_SYSTEM = (
+        "Summarize this part of a longer document. Keep key facts, names, numbers, "
+        "arguments and conclusions. Reply with the summary only."
+    )
+    REDUCE_SYSTEM = (
+        "These are summaries of consecutive parts of one document. Combine them into a single "
+        "coherent summary, removing repetition but keeping every key point. Reply with the summary only."
+    )
+
+    def __init__(self, model: "IOIntelligenceModel", chunk_tokens: Optional[int] = None, concurrency: int = 4,
+                 cache_path: Optional[Union[str, Path]] = None, instructions: Optional[str] = None):
+        self.model = model
+        # Leave room in the context window for the instructions and the reply
+        self.chunk_tokens = chunk_tokens or max(1000, (model.context_length or 8000) // 2)
+        self.concurrency = max(concurrency, 1)
+        self.instructions = instructions
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.stats = {"chunks": 0, "cached": 0, "requests": 0, "levels": 0}
+        if self.cache_path:
+            with self._connect() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS partials (key TEXT PRIMARY KEY, summary TEXT NOT NULL, created REAL NOT NULL)"
+                )
+
+    def _connect(self):
+        return sqlite3.connect(str(self.cache_path), timeout=30)
+
+    def _cache_key(self, system: str, text: str) -> str:
+        material = json.dumps([self.model.model_id, system, self.instructions, text])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    async def summarize(self, text: str) -> str:
+        chunks = chunk_document(text, self.chunk_tokens)
+        if not chunks:
+            return ""
+        self.stats["chunks"] = len(chunks)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        parts = await asyncio.gather(*(self._summarize(self.MAP_SYSTEM, chunk, semaphore) for chunk in chunks))
+        while len(parts) > 1:
+            self.stats["levels"] += 1
+            groups = self._group(parts)
+            parts = await asyncio.gather(
+                *(self._summarize(self.REDUCE_SYSTEM, "\n\n---\n\n".join(group), semaphore) for group in groups)
+            )
+        return parts[0]
+
+    def _group(self, parts: List[str]) -> List[List[str]]:
+        """Pack consecutive summaries into groups that fit the chunk budget"""
+        max_chars = self.chunk_tokens * 4
+        groups: List[List[str]] = [[]]
+        size = 0
+        for part in parts:
+            # Always put at least two summaries in a group so every level shrinks
+            if len(groups[-1]) >= 2 and size + len(part) > max_chars:
+                groups.append([])
+                size = 0
+            groups[-1].append(part)
+            size += len(part)
+        return groups
+
+    async def _summarize(self, system: str, text: str, semaphore: asyncio.Semaphore) -> str:
+        key = self._cache_key(system, text)
+        if self.cache_path:
+            with self._connect() as db:
+                row = db.execute("SELECT summary FROM partials WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.stats["cached"] += 1
+                return row[0]
+        if self.instructions:
+            system = f"{system}\n\n{self.instructions}"
+        async with semaphore:
+            self.stats["requests"] += 1
+            summary = (await self.model.complete(text, system=system)).strip()
+        if self.cache_path:
+            with self._connect() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO partials (key, summary, created) VALUES (?, ?, ?)",
+                    (key, summary, time.time()),
+                )
+        return summary
+
+
+def load_callable(spec: str):
+    """Resolve a ``module:function`` reference"""
+    module_name, _, attribute = spec.partition(":")
+    if not module_name or not attribute:
+        raise ValueError(f"Expected module:function, got {spec!r}")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+_batch_worker = None
+
+
+def _init_batch_worker(model: "IOIntelligenceModel", limiter: Optional[RateLimiter], post_process: Optional[str]):
+    """Pool initializer: one model, event loop and post-processor per worker process"""
+    global _batch_worker, _process_rate_limiter
+    _process_rate_limiter = limiter
+    # A long-lived loop keeps the worker's pooled connections warm between items
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    _batch_worker = (model, loop, load_callable(post_process) if post_process else None)
+
+
+def _run_batch_item(item: tuple) -> Dict[str, Any]:
+    index, record = item
+    model, loop, post_process = _batch_worker
+    result = {"index": index}
+    if "id" in record:
+        result["id"] = record["id"]
+    try:
+        result["response"] = loop.run_until_complete(model.complete(record["prompt"], system=record.get("system")))
+        if post_process:
+            output = post_process(result["response"])
+            try:
+                json.dumps(output)
+            except TypeError:
+                output = str(output)
+            result["output"] = output
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def run_batch(model: "IOIntelligenceModel", records: List[Dict[str, Any]], workers: int = 1,
+              rpm: float = 0, burst: int = 1, post_process: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Run prompts across worker processes, yielding results in input order
+
+    Every worker waits on one SharedRateLimiter, so together they stay within
+    ``rpm`` requests per minute. post_process names a ``module:function`` run
+    on each response inside the worker, where CPU-heavy work does not block
+    the other requests.
+    """
+    context = multiprocessing.get_context("spawn")
+    limiter = SharedRateLimiter(rpm, 60.0, burst, context) if rpm else None
+    with context.Pool(max(workers, 1), _init_batch_worker, (model, limiter, post_process)) as pool:
+        yield from pool.imap(_run_batch_item, enumerate(records), chunksize=1)
+
+
+REQUEST_ENCODINGS = ("gzip", "zstd")
+
+# API bases that turned a compressed request body away; they get plain bodies from then on
+_uncompressed_api_bases = set()
+_warned_settings = set()
+
+
+def _warn_setting_once(message: str):
+    if message not in _warned_settings:
+        _warned_settings.add(message)
+        logger.warning(message)
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def request_encoding() -> Optional[str]:
+    """Content-Encoding for large request bodies, from IONET_REQUEST_COMPRESSION
+
+    ``gzip`` works everywhere; ``zstd`` needs the optional zstandard package
+    and falls back to gzip without it; ``auto`` picks the best one installed.
+    Unset or ``off`` sends bodies uncompressed.
+    """
+    mode = os.environ.get("IONET_REQUEST_COMPRESSION", "off").strip().lower()
+    if mode in ("", "0", "off", "false", "no", "none"):
+        return None
+    if mode == "auto":
+        return "zstd" if _zstandard() else "gzip"
+    if mode not in REQUEST_ENCODINGS:
+        _warn_setting_once(f"Ignoring invalid IONET_REQUEST_COMPRESSION={mode!r}, expected gzip, zstd or auto")
+        return None
+    if mode == "zstd" and not _zstandard():
+        _warn_setting_once("IONET_REQUEST_COMPRESSION=zstd needs the zstandard package, using gzip")
+        return "gzip"
+    return mode
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """Compress a request body for the given Content-Encoding (level from IONET_COMPRESS_LEVEL)"""
+    level = int(_env_float("IONET_COMPRESS_LEVEL", 0))
+    if encoding == "zstd":
+        return _zstandard().ZstdCompressor(level=level or 3).compress(body)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, compresslevel=level or 5, mtime=0)
+
+
+def http2_enabled() -> bool:
+    """Whether IONET_HTTP2 asks for the HTTP/2 transport and httpx can provide it"""
+    if os.environ.get("IONET_HTTP2", "0").strip().lower() not in ("1", "true", "yes", "on"):
+        return False
+    try:
+        import h2  # noqa: F401
+        import httpx  # noqa: F401
+    except ImportError:
+        _warn_setting_once("IONET_HTTP2 needs httpx with HTTP/2 support (pip install 'httpx[http2]'), using HTTP/1.1")
+        return False
+    return True
+
+
+class HTTP2Response:
+    """An httpx streaming response exposing the parts of aiohttp's ClientResponse the plugin uses"""
+
+    def __init__(self, response):
+        self._response = response
+        self._chunks = response.aiter_bytes()
+        self.status = response.status_code
+        self.headers = response.headers
+        self.content_type = response.headers.get("content-type", "").split(";")[0].strip()
+        # aiohttp reads the body through response.content
+        self.content = self
+
+    async def readany(self) -> bytes:
+        import httpx
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+        except httpx.HTTPError as e:
+            raise aiohttp.ClientPayloadError(str(e)) from e
+
+    async def iter_any(self):
+        while True:
+            chunk = await self.readany()
+            if not chunk:
+                return
+            yield chunk
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_any()])
+
+    async def text(self) -> str:
+        return (await self.read()).decode("utf-8", "replace")
+
+    async def json(self):
+        return json.loads(await self.read())
+
+    def release(self):
+        # Closing a stream frees its slot on the shared connection
+        asyncio.ensure_future(self._response.aclose())
+
+    close = release
+
+
+class HTTP2Session:
+    """Session multiplexing concurrent requests as streams over one HTTP/2 connection
+
+    Offers the ``post`` call _send makes on an aiohttp session, so either
+    transport can sit in the session pool. Streaming responses are read
+    incrementally just like aiohttp's.
+    """
+
+    def __init__(self):
+        import httpx
+        self._client = httpx.AsyncClient(http2=True, timeout=None)
+
+    @property
+    def closed(self) -> bool:
+        return self._client.is_closed
+
+    async def post(self, url: str, headers: Optional[Dict[str, str]] = None, data: bytes = b"",
+                   timeout: Optional[aiohttp.ClientTimeout] = None) -> HTTP2Response:
+        import httpx
+        total = timeout.total if timeout else None
+        connect = timeout.sock_connect if timeout and timeout.sock_connect else total
+        request = self._client.build_request("POST", url, headers=headers, content=data,
+                                             timeout=httpx.Timeout(total, connect=connect))
+        try:
+            return HTTP2Response(await self._client.send(request, stream=True))
+        except httpx.TimeoutException as e:
+            raise asyncio.TimeoutError(str(e)) from e
+        except httpx.HTTPError as e:
+            raise aiohttp.ClientConnectionError(str(e)) from e
+
+    async def close(self):
+        await self._client.aclose()
+
+
+_sessions: Dict[tuple, tuple] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(api_key: Optional[str] = None, socket_path: Optional[str] = None) -> aiohttp.ClientSession:
+    """Pooled session for a key (or the daemon socket) on the running event loop, keeping its connections warm
+
+    With IONET_HTTP2=1 the sessions for io.net are HTTP2Session instances, so
+    concurrent requests share one connection instead of opening one each.
+    """
+    loop = asyncio.get_running_loop()
+    http2 = not socket_path and http2_enabled()
+    if socket_path:
+        cache_key = (id(loop), f"unix:{socket_path}")
+    else:
+        cache_key = (id(loop), ("h2:" if http2 else "") + UsageLedger.key_hash(api_key))
+    with _sessions_lock:
+        for stale in [key for key, (owner, session) in _sessions.items() if owner.is_closed() or session.closed]:
+            del _sessions[stale]
+        entry = _sessions.get(cache_key)
+        if entry is None or entry[0] is not loop:
+            if http2:
+                entry = (loop, HTTP2Session())
+            else:
+                if socket_path:
+                    connector = aiohttp.UnixConnector(path=socket_path)
+                else:
+                    connector = aiohttp.TCPConnector(limit=int(_env_float("IONET_KEY_CONNECTIONS", 16)))
+                entry = (loop, aiohttp.ClientSession(connector=connector))
+            _sessions[cache_key] = entry
+        return entry[1]
+
+
+async def close_sessions():
+    """Close the pooled sessions belonging to the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _sessions_lock:
+        owned = [key for key, (owner, _) in _sessions.items() if owner is loop]
+        sessions = [_sessions.pop(key)[1] for key in owned]
+    for session in sessions:
+        await session.close()
+
+
+@atexit.register
+def _close_sessions_at_exit():
+    for loop, session in list(_sessions.values()):
+        if session.closed or loop.is_closed() or loop.is_running():
+            continue
+        try:
+            loop.run_until_complete(session.close())
+        except Exception:
+            pass
+    _sessions.clear()
+
+
+async def _replay(text: str):
+    """Async stream of a single cached chunk"""
+    yield text
+
+
+async def _merge_streams(streams: Dict[Any, Any]):
+    """Interleave async generators, yielding ``(key, item)`` in arrival order
+
+    The first error cancels the remaining streams and is raised.
+    """
+    merged = asyncio.Queue()
+    done = object()
+
+    async def pump(key, stream):
+        try:
+            async for item in stream:
+                await merged.put((key, item, None))
+            await merged.put((key, done, None))
+        except Exception as e:
+            await merged.put((key, done, e))
+
+    tasks = [asyncio.ensure_future(pump(key, stream)) for key, stream in streams.items()]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            key, item, error = await merged.get()
+            if error is not None:
+                raise error
+            if item is done:
+                remaining -= 1
+                continue
+            yield key, item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for stream in streams.values():
+            await stream.aclose()
+
+
+async def coalesce_stream(source, window: float, max_bytes: int = 1024):
+    """Merge consecutive text deltas arriving within ``window`` seconds
+
+    The first delta is passed on at once so time to first token is
+    unchanged. After that, deltas are held until the window since the
+    oldest held one has passed or ``max_bytes`` have built up. Deltas of
+    different choices are merged separately. Anything that is not content
+    (usage, tool calls, reasoning) flushes the held text and goes through
+    unchanged.
+    """
+    loop = asyncio.get_running_loop()
+    held: Dict[Optional[int], List[str]] = {}
+    held_bytes = 0
+    flush_at = None
+    first = True
+    pending = None
+
+    def flush():
+        nonlocal held, held_bytes, flush_at
+        chunks = [ChoiceChunk("".join(parts), index) if index is not None else "".join(parts)
+                  for index, parts in held.items()]
+        held, held_bytes, flush_at = {}, 0, None
+        return chunks
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(source.__anext__())
+            if held:
+                await asyncio.wait({pending}, timeout=max(0.0, flush_at - loop.time()))
+                if not pending.done():
+                    # The window is over and the next delta has not arrived
+                    for merged in flush():
+                        yield merged
+                    continue
+            try:
+                chunk = await pending
+            except StopAsyncIteration:
+                break
+            except BaseException:
+                pending = None
+                for merged in flush():
+                    yield merged
+                raise
+            pending = None
+            index = chunk.index if isinstance(chunk, ChoiceChunk) else None
+            if type(chunk) is not str and index is None:
+                for merged in flush():
+                    yield merged
+                yield chunk
+                continue
+            if first:
+                first = False
+                yield chunk
+                continue
+            if not held:
+                flush_at = loop.time() + window
+            held.setdefault(index, []).append(str(chunk))
+            held_bytes += len(chunk.encode("utf-8"))
+            if held_bytes >= max_bytes:
+                for merged in flush():
+                    yield merged
+        for merged in flush():
+            yield merged
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        await source.aclose()
+
+
+class RequestProfile:
+    """Where one request spends its time, written to IONET_PROFILE_DIR when it ends
+
+    Phases accumulate wall-clock seconds (payload building, encoding,
+    queueing, waiting for headers, reading the stream, the thread bridge to
+    llm, ...). With cProfile capture on, the threads working on the request
+    are profiled and their stats saved next to the JSON report. Event loop
+    callbacks that block for more than IONET_PROFILE_SLOW_MS are recorded
+    using asyncio's debug mode; they come from the whole loop, so concurrent
+    requests see each other's.
+    """
+
+    _ids = itertools.count(1)
+    _local = threading.local()
+    # Event loop -> [active profiles, saved debug flag, saved slow_callback_duration]
+    _watched_loops: Dict[asyncio.AbstractEventLoop, list] = {}
+    _watch_lock = threading.Lock()
+
+    def __init__(self, model_id: str, directory: Union[str, Path], cprofile: bool = True):
+        self.model_id = model_id
+        self.directory = Path(directory)
+        self.cprofile = cprofile
+        self.id = f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}-{next(self._ids)}"
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.marks: Dict[str, float] = {}
+        self.slow_callbacks: List[str] = []
+        self.error = None
+        self._stats = None
+        self._profilers: List[tuple] = []
+
+    @classmethod
+    def from_env(cls, model_id: str) -> Optional["RequestProfile"]:
+        """A profile for a new request when IONET_PROFILE_DIR is set (IONET_PROFILE_CPROFILE=0 keeps timers only)"""
+        directory = os.environ.get("IONET_PROFILE_DIR")
+        if not directory:
+            return None
+        cprofile = os.environ.get("IONET_PROFILE_CPROFILE", "1").strip().lower() not in ("0", "false", "no")
+        return cls(model_id, directory, cprofile)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def mark(self, name: str):
+        """Record when something first happened, in seconds since the request started"""
+        self.marks.setdefault(name, time.perf_counter() - self.started)
+
+    def start_cprofile(self):
+        """Profile the calling thread until stop_cprofile, unless it is already being profiled"""
+        if not self.cprofile or getattr(self._local, "active", False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+ allows one per interpreter)
+            return None
+        self._local.active = True
+        return profiler
+
+    def stop_cprofile(self, profiler):
+        if profiler is None:
+            return
+        profiler.disable()
+        self._local.active = False
+        if self._stats is None:
+            self._stats = pstats.Stats(profiler)
+        else:
+            self._stats.add(profiler)
+
+    @contextlib.contextmanager
+    def watch_loop(self, loop: asyncio.AbstractEventLoop):
+        """Collect asyncio's warnings about callbacks that block the loop
+
+        These cover everything running on the loop meanwhile, including
+        other requests, not just this one.
+        """
+        threshold = _env_float("IONET_PROFILE_SLOW_MS", 50.0) / 1000
+        profile = self
+
+        class SlowCallbackHandler(logging.Handler):
+            def emit(self, record):
+                message = record.getMessage()
+                if message.startswith("Executing") and " took " in message:
+                    profile.slow_callbacks.append(message)
+
+        handler = SlowCallbackHandler()
+        asyncio_logger = logging.getLogger("asyncio")
+        asyncio_logger.addHandler(handler)
+        with self._watch_lock:
+            # Profiles of overlapping requests share the loop's settings; the
+            # first one in saves them and the last one out restores them
+            watch = self._watched_loops.get(loop)
+            if watch is None:
+                watch = self._watched_loops[loop] = [0, loop.get_debug(), loop.slow_callback_duration]
+                loop.set_debug(True)
+                loop.slow_callback_duration = threshold
+            watch[0] += 1
+        try:
+            yield
+        finally:
+            with self._watch_lock:
+                watch[0] -= 1
+                if not watch[0]:
+                    del self._watched_loops[loop]
+                    loop.set_debug(watch[1])
+                    loop.slow_callback_duration = watch[2]
+            asyncio_logger.removeHandler(handler)
+
+    def write(self) -> Path:
+        """Save the report (and cProfile stats) and return the report's path"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        report = {
+            "id": self.id,
+            "model": self.model_id,
+            "total_seconds": round(time.perf_counter() - self.started, 6),
+            "phases": {name: round(seconds, 6) for name, seconds in sorted(self.phases.items())},
+            "counts": self.counts,
+            "marks": {name: round(seconds, 6) for name, seconds in self.marks.items()},
+            "slow_callbacks": self.slow_callbacks,
+            "slow_callbacks_scope": "event loop: any callback that blocked it while this request ran, from any task",
+            "error": self.error,
+        }
+        if self._stats is not None:
+            stats_path = self.directory / f"{self.id}.prof"
+            self._stats.dump_stats(str(stats_path))
+            report["cprofile"] = stats_path.name
+        path = self.directory / f"{self.id}.json"
+        path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        return path
+
+
+_current_profile: contextvars.ContextVar = contextvars.ContextVar("ionet_profile", default=None)
+
+
+def profile_phase(name: str):
+    """Time a phase of the current request when it is being profiled"""
+    profile = _current_profile.get()
+    return profile.phase(name) if profile is not None else contextlib.nullcontext()
+
+
+# Span kinds and status codes as numbered in OTLP
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+_STATUS_ERROR = 2
+
+
+class Span:
+    """One timed operation in a trace, following the OpenTelemetry data model
+
+    Spans are created with trace_span() or start_span() and exported when
+    they end. traceparent is the W3C header that lets a downstream service
+    continue the trace.
+    """
+
+    def __init__(self, name: str, exporter: "JSONTraceExporter", trace_id: str, parent_id: Optional[str] = None,
+                 kind: str = "internal", attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.exporter = exporter
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.events: List[Dict[str, Any]] = []
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_exception(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+        self.events.append({"name": "exception", "time_ns": time.time_ns(), "attributes": {
+            "exception.type": type(error).__name__, "exception.message": str(error),
+        }})
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.exporter.export(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS[self.kind],
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [{"name": event["name"], "timeUnixNano": str(event["time_ns"]),
+                        "attributes": _otlp_attributes(event["attributes"])} for event in self.events],
+            "status": {"code": _STATUS_ERROR, "message": self.error} if self.error else {},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    encoded = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            encoded.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            encoded.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            encoded.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            encoded.append({"key": key, "value": {"stringValue": str(value)}})
+    return encoded
+
+
+class JSONTraceExporter:
+    """Appends finished spans to a file as OTLP/JSON lines
+
+    Each line is an ExportTraceServiceRequest holding one span - the format
+    the OpenTelemetry Collector's file exporter writes and its otlpjsonfile
+    receiver reads. `llm ionet trace` turns the file into a flame graph.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": "llm-io-intelligence",
+                                                         "process.pid": os.getpid()})},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp()]}],
+        }]})
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as trace_file:
+                    trace_file.write(line + "\n")
+            except OSError as e:
+                logger.warning("Failed to write trace span to %s: %s", self.path, e)
+
+
+def read_trace_spans(path: Union[str, Path]) -> List[Dict[str, Any]]:
+    """The OTLP spans in a trace file written by JSONTraceExporter"""
+    spans = []
+    with open(path, encoding="utf-8") as trace_file:
+        for line in trace_file:
+            if not line.strip():
+                continue
+            for resource_spans in json.loads(line).get("resourceSpans", []):
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    spans.extend(scope_spans.get("spans", []))
+    return spans
+
+
+def chrome_trace(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Convert OTLP spans to the Chrome trace event format
+
+    The result opens as a flame graph in Perfetto, chrome://tracing or
+    speedscope. Each trace gets its own process row; spans that overlap
+    without nesting (concurrent fetches, samples) go to separate thread rows.
+    """
+    traces: Dict[str, int] = {}
+    lanes: Dict[str, List[List[int]]] = {}
+    lane_of: Dict[str, int] = {}
+    events = []
+    for span in sorted(spans, key=lambda span: (int(span["startTimeUnixNano"]), -int(span["endTimeUnixNano"]))):
+        start, end = int(span["startTimeUnixNano"]), int(span["endTimeUnixNano"])
+        pid = traces.setdefault(span["traceId"], len(traces) + 1)
+        stacks = lanes.setdefault(span["traceId"], [])
+        preferred = lane_of.get(span.get("parentSpanId"), 0)
+        for lane in [preferred] + [lane for lane in range(len(stacks)) if lane != preferred] + [len(stacks)]:
+            if lane == len(stacks):
+                stacks.append([])
+            stack = stacks[lane]
+            while stack and stack[-1] <= start:
+                stack.pop()
+            if not stack or stack[-1] >= end:
+                stack.append(end)
+                break
+        lane_of[span["spanId"]] = lane
+        args = {"trace_id": span["traceId"], "span_id": span["spanId"]}
+        for attribute in span.get("attributes", []):
+            args[attribute["key"]] = next(iter(attribute["value"].values()), None)
+        if span.get("status", {}).get("message"):
+            args["error"] = span["status"]["message"]
+        events.append({"name": span["name"], "cat": "ionet", "ph": "X", "ts": start / 1000,
+                       "dur": (end - start) / 1000, "pid": pid, "tid": lane, "args": args})
+    for trace_id, pid in traces.items():
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": f"trace {trace_id}"}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+_trace_exporters: Dict[str, JSONTraceExporter] = {}
+_current_span: contextvars.ContextVar = contextvars.ContextVar("ionet_span", default=None)
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def get_trace_exporter() -> Optional[JSONTraceExporter]:
+    """The exporter for IONET_TRACE_FILE, or None when tracing is off"""
+    path = os.environ.get("IONET_TRACE_FILE")
+    if not path:
+        return None
+    exporter = _trace_exporters.get(path)
+    if exporter is None:
+        exporter = _trace_exporters[path] = JSONTraceExporter(os.path.expanduser(path))
+    return exporter
+
+
+def start_span(name: str, kind: str = "internal", attributes: Optional[Dict[str, Any]] = None,
+               traceparent: Optional[str] = None) -> Optional[Span]:
+    """Start a span under the current one; the caller must end() it
+
+    A traceparent header received from a client takes precedence. Without
+    either, the trace continues the one in the TRACEPARENT environment
+    variable, if set, so a whole CLI invocation can join a trace started
+    elsewhere. Returns None when tracing is off.
+    """
+    exporter = get_trace_exporter()
+    if exporter is None:
+        return None
+    parent = _current_span.get()
+    if parent is not None and traceparent is None:
+        return Span(name, exporter, parent.trace_id, parent.span_id, kind, attributes)
+    match = _TRACEPARENT.match((traceparent or os.environ.get("TRACEPARENT", "")).strip().lower())
+    if match:
+        return Span(name, exporter, match.group(1), match.group(2), kind, attributes)
+    return Span(name, exporter, f"{random.getrandbits(128):032x}", None, kind, attributes)
+
+
+@contextlib.contextmanager
+def trace_span(name: str, kind: str = "internal", attributes: Optional[Dict[str, Any]] = None,
+               traceparent: Optional[str] = None):
+    """Run a block as a span, the current span inside it; yields None when tracing is off
+
+    Wrap an agent turn in one to see its model calls, tool calls and fetches
+    as a single trace:
+
+        with trace_span("agent turn"):
+            model.chain("...", tools=[...]).text()
+    """
+    span = start_span(name, kind, attributes, traceparent)
+    if span is None:
+        yield None
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.record_exception(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+def trace_tool(tool):
+    """Make an llm Tool record a span each time llm invokes it"""
+    implementation = getattr(tool, "implementation", None)
+    if implementation is None or getattr(implementation, "_ionet_traced", False):
+        return
+    attributes = {"gen_ai.operation.name": "execute_tool", "gen_ai.tool.name": tool.name}
+
+    if inspect.iscoroutinefunction(implementation):
+        @functools.wraps(implementation)
+        async def traced(*args, **kwargs):
+            with trace_span(f"execute_tool {tool.name}", attributes=attributes):
+                return await implementation(*args, **kwargs)
+    else:
+        @functools.wraps(implementation)
+        def traced(*args, **kwargs):
+            with trace_span(f"execute_tool {tool.name}", attributes=attributes):
+                return implementation(*args, **kwargs)
+    traced._ionet_traced = True
+    tool.implementation = traced
+
+
+class _TracedResponse:
+    """urlopen response that ends its span once it is closed, after the body is read"""
+
+    def __init__(self, response, span: Span):
+        self._response = response
+        self._span = span
+        span.set_attribute("http.response.status_code", response.status)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __iter__(self):
+        return iter(self._response)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._response.close()
+        self._span.end()
+
+
+def traced_urlopen(url, data=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, **kwargs):
+    """urllib.request.urlopen recording a client span and sending traceparent"""
+    import urllib.error
+    import urllib.request
+
+    request = url if isinstance(url, urllib.request.Request) else urllib.request.Request(url, data)
+    method = request.get_method()
+    span = start_span(method, "client", {
+        "http.request.method": method, "url.full": request.full_url, "server.address": request.host,
+    })
+    if span is None:
+        return urllib.request.urlopen(request, data, timeout, **kwargs)
+    request.add_header("Traceparent", span.traceparent)
     try:
-        if hasattr(llm, 'get_key'):
-            api_key = llm.get_key(None, "ionet", None)
-        # If no API key from LLM key system, try environment variable
-        if not api_key:
-            api_key = os.environ.get("IONET")
+        response = urllib.request.urlopen(request, data, timeout, **kwargs)
+    except urllib.error.HTTPError as e:
+        span.set_attribute("http.response.status_code", e.code)
+        span.record_exception(e)
+        span.end()
+        raise
     except Exception as e:
-        logger.warning(f"Error getting API key: {e}")
-        # Fall back to environment variable
-        api_key = os.environ.get("IONET")
-    
-    # Try to fetch models from API if API key is available
-    models = []
-    if api_key:
-        logger.debug("Attempting to fetch models from API")
-        try:
-            # Run the async function in a new event loop
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-            models = loop.run_until_complete(fetch_available_models(api_key))
-            logger.debug(f"Successfully fetched {len(models)} models from API")
-        except Exception as e:
-            logger.warning(f"Failed to fetch models from API: {e}")
-            # If API fetch fails, don't fall back to hardcoded models when API key is present
-            # This ensures we only use API models when API key is set
-            models = []
-    else:
-        logger.debug("No API key present, will use hardcoded models")
-    
-    # Fallback to hardcoded models only if no API key is present
-    if not api_key and not models:
-        logger.debug("Using hardcoded model list")
-        models = [
-            # Current models from API
-            ("ionet/llama-4-maverick-17b", "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8", 430000),
-            ("ionet/deepseek-r1-0528", "deepseek-ai/DeepSeek-R1-0528", 128000),
-            ("ionet/intel-qwen3-coder-480b", "Intel/Qwen3-Coder-480B-A35B-Instruct-int4-mixed-ar", 32000),
-            ("ionet/qwen3-235b", "Qwen/Qwen3-235B-A22B-FP8", 32000),
-            ("ionet/llama-3.2-90b-vision", "meta-llama/Llama-3.2-90B-Vision-Instruct", 16000),
-            ("ionet/qwen2.5-vl-32b", "Qwen/Qwen2.5-VL-32B-Instruct", 32000),
-            ("ionet/llama-3.3-70b", "meta-llama/Llama-3.3-70B-Instruct", 128000),
-            ("ionet/devstral-small-2505", "mistralai/Devstral-Small-2505", 32000),
-            ("ionet/magistral-small-2506", "mistralai/Magistral-Small-2506", 32000),
-            ("ionet/mistral-large-2411", "mistralai/Mistral-Large-Instruct-2411", 128000),
-            ("ionet/aya-expanse-32b", "CohereForAI/aya-expanse-32b", 8000),
-        ]
-    
-    logger.debug(f"Registering {len(models)} models")
-    for model_id, full_name, context_length in models:
-        logger.debug(f"Registering model: {model_id} ({full_name})")
-        model = IOIntelligenceModel(model_id, full_name, context_length)
-        register(model)
+        span.record_exception(e)
+        span.end()
+        raise
+    return _TracedResponse(response, span)
+
+
+# (api_base, model) pairs seen to return a single choice when asked for several
+_n_ignored = set()
+
 
 class IOIntelligenceModel(llm.Model):
     can_stream = True
     supports_tools = True
+    supports_schema = True
     attachment_types = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+
+    class Options(llm.Options):
+        max_tokens: Optional[int] = Field(
+            description="Maximum number of tokens to generate", default=None, ge=1
+        )
+        temperature: Optional[float] = Field(
+            description="Sampling temperature, higher is more random", default=None, ge=0, le=2
+        )
+        top_p: Optional[float] = Field(
+            description="Nucleus sampling: only consider tokens in the top_p probability mass", default=None, gt=0, le=1
+        )
+        stop: Optional[List[str]] = Field(
+            description="Stop generating at any of these sequences (a string or a JSON list)", default=None
+        )
+        seed: Optional[int] = Field(
+            description="Seed for reproducible sampling", default=None
+        )
+        presence_penalty: Optional[float] = Field(
+            description="Penalize tokens that already appeared, encouraging new topics", default=None, ge=-2, le=2
+        )
+        frequency_penalty: Optional[float] = Field(
+            description="Penalize tokens by how often they appeared, discouraging repetition", default=None, ge=-2, le=2
+        )
+        deadline: Optional[float] = Field(
+            description="Seconds the whole request may take before it is cancelled", default=None, gt=0
+        )
+        n: Optional[int] = Field(
+            description="Number of samples to generate for the prompt", default=None, ge=1, le=16
+        )
+
+        @field_validator("stop", mode="before")
+        @classmethod
+        def split_stop(cls, value):
+            # -o stop takes one string on the command line; a JSON list gives several
+            if isinstance(value, str):
+                if value.startswith("["):
+                    try:
+                        return json.loads(value)
+                    except ValueError:
+                        pass
+                return [value]
+            return value
+
+    # Options that are not request parameters
+    CLIENT_OPTIONS = ("deadline",)
     
     def __init__(self, model_id: str, full_model_name: str, context_length: Optional[int] = None):
         self.model_id = model_id
         self.full_model_name = full_model_name
         self.context_length = context_length
-        self.api_base = "https://api.intelligence.io.solutions/api/v1"
-        logger.debug(f"Initialized model {model_id} with context length {context_length}")
+        self.api_base = get_api_base()
+        logger.debug("Initialized model %s with context length %s", model_id, context_length)
 
         # Set the model ID for llm framework
         self.__dict__["model_id"] = model_id
@@ -132,40 +3262,263 @@ class IOIntelligenceModel(llm.Model):
     def __str__(self):
         return f"IOIntelligenceModel: {self.model_id}"
 
+    def build_tools(self, prompt) -> List[Dict[str, Any]]:
+        """Convert the prompt's llm tools into OpenAI-compatible tool definitions"""
+        tools = []
+        for tool in getattr(prompt, 'tools', None) or []:
+            if not hasattr(tool, 'input_schema'):
+                continue
+            tools.append({
+                "type": "function",
+                "function": {
+                    "name": tool.name,
+                    "description": tool.description or "",
+                    "parameters": tool.input_schema or {"type": "object", "properties": {}},
+                }
+            })
+        # Tool order must not depend on how the caller listed them, or the prompt prefix changes
+        tools.sort(key=lambda tool: tool["function"]["name"])
+        return tools
+
     def build_messages(self, prompt, conversation) -> List[Dict[str, Any]]:
         messages = []
+        # The system prompt goes first so it is part of the prefix every turn repeats
+        system = getattr(prompt, "system", None)
+        if not system and conversation:
+            system = next((r.prompt.system for r in reversed(conversation.responses) if r.prompt.system), None)
+        history = []
         if conversation:
-            for prev_response in conversation.responses:
-                messages.extend(prev_response.request.messages)
+            turns = [self._turn_messages(prev_response.prompt, prev_response) for prev_response in conversation.responses]
+            compactor = get_compactor()
+            if compactor and turns:
+                conversation_id = str(getattr(conversation, "id", None) or id(conversation))
+                system, history = compactor.compact(conversation_id, system, turns)
+            else:
+                history = [message for turn in turns for message in turn]
+        if system:
+            messages.append({"role": "system", "content": system})
+        messages.extend(history)
                 
         # Add the current prompt
-        messages.append({"role": "user", "content": prompt.prompt})
+        messages.extend(self._turn_messages(prompt))
+        return messages
+
+    def _turn_messages(self, prompt, response=None) -> List[Dict[str, Any]]:
+        """Messages for one exchange: tool results sent with the prompt, the prompt, and the reply"""
+        messages = []
+        for tool_result in getattr(prompt, "tool_results", None) or []:
+            message = {"role": "tool", "name": tool_result.name, "content": tool_result.output}
+            if tool_result.tool_call_id:
+                message["tool_call_id"] = tool_result.tool_call_id
+            messages.append(message)
+        if prompt.prompt or not messages:
+            messages.append({"role": "user", "content": prompt.prompt})
+        if response is not None:
+            message = {"role": "assistant", "content": response.text()}
+            tool_calls = response.tool_calls() if hasattr(response, "tool_calls") else []
+            if tool_calls:
+                message["tool_calls"] = []
+                for tool_call in tool_calls:
+                    call = {
+                        "type": "function",
+                        "function": {"name": tool_call.name, "arguments": json.dumps(tool_call.arguments, sort_keys=True)},
+                    }
+                    if tool_call.tool_call_id:
+                        call["id"] = tool_call.tool_call_id
+                    message["tool_calls"].append(call)
+            messages.append(message)
         return messages
 
-    async def execute_async_with_tools(self, prompt, tools=None, get_env_var=None, stream=False):
-        """Execute the model asynchronously with tool support"""
-        # Try to get API key
-        api_key = None
-        if get_env_var:
-            api_key = get_env_var("ionet")
+    def generation_params(self, prompt) -> Dict[str, Any]:
+        """Request parameters set through the prompt's options"""
+        options = getattr(prompt, "options", None)
+        if options is None:
+            return {}
+        return {
+            name: value for name, value in options.model_dump().items()
+            if value is not None and name not in self.CLIENT_OPTIONS
+        }
+
+    async def execute_async_with_tools(self, prompt, tools=None, get_env_var=None, stream=False, conversation=None):
+        """Execute the model asynchronously with tool support
+
+        With the deadline option set, the request is cancelled - closing its
+        connection - once it has taken that many seconds in total, and
+        DeadlineExceededError is raised. With n > 1 (and no tools) see
+        _sample for how the choices are produced.
+        """
+        options = getattr(prompt, "options", None)
+        if (getattr(options, "n", None) or 1) > 1 and not tools:
+            generator = self._sample(prompt, options.n, get_env_var, stream, conversation)
         else:
-            # Try to get API key from LLM key system
+            generator = self._execute_async_with_tools(prompt, tools, get_env_var, stream, conversation)
+        deadline = getattr(options, "deadline", None)
+        if deadline:
+            generator = self._with_deadline(generator, deadline)
+        # Requests made through execute() are already being profiled there
+        profile = RequestProfile.from_env(self.model_id) if _current_profile.get() is None else None
+        if profile is not None:
+            generator = self._profiled(generator, profile)
+        span = start_span(f"chat {self.model_id}", "client", {
+            "gen_ai.operation.name": "chat", "gen_ai.system": "io.net",
+            "gen_ai.request.model": self.full_model_name, "ionet.stream": stream,
+        })
+        if span is not None:
+            generator = self._traced(generator, span)
+        try:
+            async for item in generator:
+                yield item
+        finally:
+            await generator.aclose()
+
+    @staticmethod
+    async def _traced(generator, span: Span):
+        """Run a request generator as the current span, ending it when the generator ends
+
+        The span is only current while the generator runs, not in the caller
+        between chunks.
+        """
+        try:
+            while True:
+                token = _current_span.set(span)
+                try:
+                    item = await generator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    _current_span.reset(token)
+                usage = item.get("usage") if isinstance(item, dict) and not isinstance(item, TokenUsage) else item
+                if isinstance(usage, TokenUsage):
+                    span.set_attribute("gen_ai.usage.input_tokens", usage.get("prompt_tokens") or 0)
+                    span.set_attribute("gen_ai.usage.output_tokens", usage.get("completion_tokens") or 0)
+                yield item
+        except Exception as e:
+            span.record_exception(e)
+            raise
+        finally:
+            await generator.aclose()
+            span.end()
+
+    async def _with_deadline(self, generator, deadline: float):
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + deadline
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(generator.__anext__(), timeout=max(0.0, expires - loop.time()))
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    raise DeadlineExceededError(f"Request to {self.model_id} exceeded its {deadline:g}s deadline")
+                yield item
+        finally:
+            await generator.aclose()
+
+    @staticmethod
+    async def _profiled(generator, profile: RequestProfile, write: bool = True):
+        """Run a request generator under a RequestProfile and write the report when it ends"""
+        token = _current_profile.set(profile)
+        profiler = profile.start_cprofile()
+        try:
+            with profile.watch_loop(asyncio.get_running_loop()):
+                async for item in generator:
+                    profile.mark("first_chunk")
+                    yield item
+        except Exception as e:
+            profile.error = repr(e)
+            raise
+        finally:
+            await generator.aclose()
+            profile.stop_cprofile(profiler)
+            with contextlib.suppress(ValueError):
+                # Fails harmlessly when the generator is finalized from another context
+                _current_profile.reset(token)
+            if write:
+                profile.write()
+
+    async def _sample(self, prompt, n, get_env_var, stream, conversation):
+        """Generate n choices in one request, falling back to concurrent requests
+
+        Streams yield each choice's deltas as ChoiceChunk; the non-streaming
+        result has a "choices" list. Backends that ignore ``n`` and return a
+        single choice (judged by the choice indexes in the stream, including
+        ones that carry no content) get the remaining samples as separate
+        concurrent requests (each with its own seed when one is set), and
+        from then on the whole fan-out is done locally.
+        """
+        usage = TokenUsage()
+        first_index = 0
+        if (self.api_base, self.full_model_name) not in _n_ignored:
+            seen = set()
+            result = None
+            async for item in self._execute_async_with_tools(prompt, None, get_env_var, stream, conversation):
+                if isinstance(item, TokenUsage):
+                    usage.add(item)
+                    continue
+                if stream:
+                    if isinstance(item, ChoiceChunk):
+                        seen.add(item.index)
+                    yield item
+                else:
+                    result = item
+            if stream and len(seen) > 1:
+                if usage:
+                    yield usage
+                return
+            if result and len(result.get("choices") or []) > 1:
+                yield result
+                return
+            logger.info("%s returned one choice for n=%s, requesting the others separately", self.model_id, n)
+            _n_ignored.add((self.api_base, self.full_model_name))
+            first_index = 1
+
+        seed = getattr(prompt.options, "seed", None)
+        generators = {
+            index: self._execute_async_with_tools(
+                prompt, None, get_env_var, stream, conversation,
+                overrides={"n": None, "seed": None if seed is None else seed + index}
+            )
+            for index in range(first_index, n)
+        }
+        if stream:
+            async for index, item in _merge_streams(generators):
+                if isinstance(item, TokenUsage):
+                    usage.add(item)
+                elif isinstance(item, ReasoningChunk):
+                    if index == 0:
+                        yield item
+                elif isinstance(item, str):
+                    yield ChoiceChunk(item, index)
+            if usage:
+                yield usage
+            return
+
+        async def first_result(generator):
             try:
-                if hasattr(llm, 'get_key'):
-                    api_key = llm.get_key(None, "ionet", None)
-                # If no API key from LLM key system, try environment variable
-                if not api_key:
-                    api_key = os.environ.get("IONET")
-            except Exception as e:
-                logger.warning(f"Error getting API key: {e}")
-                # Fall back to environment variable
-                api_key = os.environ.get("IONET")
-        
-        if not api_key:
-            raise ValueError("IONET key is required. Set it with 'llm keys set ionet' or IONET environment variable.")
+                return await generator.__anext__()
+            finally:
+                await generator.aclose()
+
+        results = await asyncio.gather(*[first_result(generator) for generator in generators.values()])
+        if first_index:
+            results.insert(0, result)
+        for sample in results:
+            if sample.get("usage"):
+                usage.add(sample["usage"])
+        merged = dict(results[0], choices=[sample["content"] for sample in results])
+        merged.pop("usage", None)
+        if usage:
+            merged["usage"] = usage
+        yield merged
 
+    def build_payload(self, prompt, tools, stream: bool, conversation=None, overrides=None) -> Dict[str, Any]:
+        """The chat completions request body for a prompt
+
+        overrides replace payload entries after the options are applied; a
+        None value removes the entry.
+        """
         # Build messages
-        messages = self.build_messages(prompt, prompt.conversation if hasattr(prompt, 'conversation') else None)
+        messages = self.build_messages(prompt, conversation)
         
         # Prepare the request payload
         payload = {
@@ -174,98 +3527,544 @@ class IOIntelligenceModel(llm.Model):
             "stream": stream,
             "tools": tools if tools else [],
         }
+        payload.update(self.generation_params(prompt))
+        if tools:
+            # Tool calls can't be told apart between choices
+            payload.pop("n", None)
+        for name, value in (overrides or {}).items():
+            if value is None:
+                payload.pop(name, None)
+            else:
+                payload[name] = value
+        schema = getattr(prompt, "schema", None)
+        if schema:
+            # Constrained decoding keeps the output valid JSON for the schema
+            payload["response_format"] = {"type": "json_schema", "json_schema": {"name": "response", "schema": schema}}
+        if stream:
+            # Ask for a final usage event so streamed responses can be accounted for
+            payload["stream_options"] = {"include_usage": True}
 
         # Add attachments if present
         attachments = getattr(prompt, 'attachments', [])
         if attachments:
             payload["attachments"] = self._process_attachments(attachments)
+        return payload
 
-        logger.debug(f"Sending request to {self.api_base}/chat/completions with model {self.full_model_name}")
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+    async def _execute_async_with_tools(self, prompt, tools, get_env_var, stream, conversation, overrides=None):
+        # An explicit key bypasses the daemon and the key pool; otherwise _send picks the route
+        api_key = get_env_var("ionet") if get_env_var else None
+        if not api_key and (get_env_var or not (daemon_socket() or get_key_pool() or get_api_key())):
+            raise ValueError("IONET key is required. Set it with 'llm keys set ionet' or IONET environment variable.")
 
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(
-                    f"{self.api_base}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"API request failed with status {response.status}: {error_text}")
-                        raise Exception(f"API request failed: {response.status} - {error_text}")
-
-                    if stream:
-                        # Handle streaming response - parse SSE format
-                        buffer = ""
-                        async for chunk in response.content:
-                            if chunk:
-                                buffer += chunk.decode('utf-8')
-                                # Process complete lines
-                                while '\n' in buffer:
-                                    line, buffer = buffer.split('\n', 1)
-                                    line = line.strip()
-                                    
-                                    # Skip empty lines and non-data lines
-                                    if not line or not line.startswith('data:'):
-                                        continue
-                                        
-                                    # Extract the data part
-                                    data_str = line[5:].strip()  # Remove 'data:' prefix
-                                    
-                                    # Check for end of stream
-                                    if data_str == '[DONE]':
-                                        break
-                                        
-                                    try:
-                                        # Parse the JSON data
-                                        data = json.loads(data_str)
-                                        # Extract content from choices
-                                        if 'choices' in data and len(data['choices']) > 0:
-                                            choice = data['choices'][0]
-                                            if 'delta' in choice and 'content' in choice['delta']:
-                                                content = choice['delta']['content']
-                                                if content:
-                                                    yield content
-                                    except json.JSONDecodeError:
-                                        # Skip invalid JSON
-                                        continue
+        with profile_phase("build_payload"):
+            payload = self.build_payload(prompt, tools, stream, conversation, overrides)
+
+        log_event(logging.DEBUG, "request.start", "Sending request to {url} with model {model}",
+                  url=f"{self.api_base}/chat/completions", model=self.full_model_name, stream=stream, payload=payload)
+
+        reasoning_mode = _reasoning_mode()
+        reasoning_file = None
+
+        cache, cache_key, cache_ttl = self._response_cache(payload)
+        # Paraphrases of earlier prompts can be answered too when IONET_SEMANTIC_CACHE_TTL is set
+        semantic_cache = get_semantic_cache()
+        semantic_query = semantic_answer = None
+
+        try:
+            if stream:
+                # Models without native function calling print tool calls as text
+                tool_parser = None
+                if tools:
+                    tool_parser = ToolCallStreamParser([tool["function"]["name"] for tool in tools])
+
+                usage = TokenUsage()
+                cached_text = self._cached_text(cache, cache_key) if cache else None
+                if cached_text is None and semantic_cache:
+                    semantic_query, semantic_answer = await semantic_cache.lookup(self.model_id, payload, api_key)
+                    cached_text = semantic_answer
+                if cached_text is not None:
+                    source = _replay(cached_text)
+                else:
+                    source = self._stream_with_resume(payload, api_key, reasoning_mode != "drop")
+                streamed_text = []
+                streamed_tool_calls = 0
+                async for content in source:
+                    if isinstance(content, TokenUsage):
+                        usage.add(content)
+                    elif isinstance(content, llm.ToolCall):
+                        streamed_tool_calls += 1
+                        yield content
+                    elif isinstance(content, ReasoningChunk):
+                        if reasoning_mode == "file":
+                            if reasoning_file is None:
+                                reasoning_file = self._open_reasoning_file()
+                            reasoning_file.write(content)
+                        else:
+                            yield content
+                    elif tool_parser:
+                        streamed_text.append(content)
+                        text, tool_calls = tool_parser.feed(content)
+                        if text:
+                            yield text
+                        streamed_tool_calls += len(tool_calls)
+                        for tool_call in tool_calls:
+                            yield tool_call
                     else:
+                        streamed_text.append(content)
+                        yield content
+
+                if tool_parser:
+                    text, tool_calls = tool_parser.finish()
+                    if text:
+                        yield text
+                    streamed_tool_calls += len(tool_calls)
+                    for tool_call in tool_calls:
+                        yield tool_call
+
+                if cache and cached_text is None and not streamed_tool_calls:
+                    # Stored in the non-streaming response format so both modes share entries
+                    message = {"role": "assistant", "content": "".join(streamed_text)}
+                    cache.set(cache_key, json.dumps({"choices": [{"message": message}]}).encode("utf-8"), cache_ttl)
+                if semantic_query and cached_text is None and not streamed_tool_calls:
+                    semantic_cache.store(self.model_id, semantic_query, "".join(streamed_text))
+
+                if usage:
+                    yield usage
+            else:
+                fresh_usage = []
+
+                async def request():
+                    response, used_key = await self._send(
+                        payload,
+                        aiohttp.ClientTimeout(total=300, sock_connect=_env_float("IONET_CONNECT_TIMEOUT", 30.0) or None),
+                        api_key
+                    )
+                    try:
+                        if response.status != 200:
+                            error_text = await response.text()
+                            logger.error("API request failed with status %s: %s", response.status, error_text)
+                            raise Exception(f"API request failed: {response.status} - {error_text}")
+
                         # Handle non-streaming response
-                        result = await response.json()
-                        logger.debug(f"Received response: {result}")
+                        with profile_phase("read_body"):
+                            body = await response.read()
+                    finally:
+                        response.release()
+                    usage = json.loads(body).get("usage")
+                    if usage:
+                        # Only requests that reached the API count towards usage, not cache hits
+                        fresh_usage.append(TokenUsage(usage))
+                        self._record_usage(used_key, fresh_usage[0])
+                    return body
 
-                        # Extract the content and tool calls
-                        choice = result["choices"][0]
-                        message = choice["message"]
-                        
-                        # Handle tool calls if present
-                        if "tool_calls" in message and message["tool_calls"]:
-                            return_message = {
-                                "content": message.get("content", ""),
-                                "tool_calls": message["tool_calls"]
-                            }
-                        else:
-                            return_message = {
-                                "content": message.get("content", ""),
-                                "tool_calls": []
-                            }
-                        # Yield the result for non-streaming mode
-                        yield return_message
-                        
-            except aiohttp.ClientError as e:
-                logger.error(f"Network error during API request: {e}")
-                raise Exception(f"Network error: {e}")
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to decode JSON response: {e}")
-                raise Exception(f"Invalid JSON response: {e}")
-            except KeyError as e:
-                logger.error(f"Missing expected key in response: {e}")
-                raise Exception(f"Invalid response format: missing key {e}")
+                data = cache.get(cache_key) if cache else None
+                if data is None and semantic_cache:
+                    semantic_query, semantic_answer = await semantic_cache.lookup(self.model_id, payload, api_key)
+                    if semantic_answer is not None:
+                        message = {"role": "assistant", "content": semantic_answer}
+                        data = json.dumps({"choices": [{"message": message}]}).encode("utf-8")
+                if data is None:
+                    data = await cache.get_or_compute(cache_key, request, cache_ttl) if cache else await request()
+                with profile_phase("decode"):
+                    result = json.loads(data)
+                log_event(logging.DEBUG, "response.received", "Received response from {model}: {response}",
+                          model=self.full_model_name, response=result)
+
+                # Extract the content and tool calls
+                choice = result["choices"][0]
+                message = choice["message"]
+                
+                # Handle tool calls if present
+                if "tool_calls" in message and message["tool_calls"]:
+                    return_message = {
+                        "content": message.get("content", ""),
+                        "tool_calls": message["tool_calls"]
+                    }
+                else:
+                    return_message = {
+                        "content": message.get("content", ""),
+                        "tool_calls": []
+                    }
+
+                reasoning = message.get("reasoning_content") or message.get("reasoning")
+                if reasoning and reasoning_mode == "file":
+                    reasoning_file = self._open_reasoning_file()
+                    reasoning_file.write(reasoning)
+                elif reasoning and reasoning_mode == "stream":
+                    return_message["reasoning"] = reasoning
+
+                if len(result["choices"]) > 1:
+                    ordered = sorted(result["choices"], key=lambda choice: choice.get("index", 0))
+                    return_message["choices"] = [choice["message"].get("content") or "" for choice in ordered]
+
+                if semantic_query and semantic_answer is None and not return_message["tool_calls"]:
+                    semantic_cache.store(self.model_id, semantic_query, return_message["content"] or "")
+
+                if fresh_usage:
+                    return_message["usage"] = fresh_usage[0]
+                # Yield the result for non-streaming mode
+                yield return_message
+                    
+        except aiohttp.ClientError as e:
+            logger.error("Network error during API request: %s", e)
+            raise Exception(f"Network error: {e}")
+        except json.JSONDecodeError as e:
+            logger.error("Failed to decode JSON response: %s", e)
+            raise Exception(f"Invalid JSON response: {e}")
+        except KeyError as e:
+            logger.error("Missing expected key in response: %s", e)
+            raise Exception(f"Invalid response format: missing key {e}")
+        finally:
+            if reasoning_file is not None:
+                reasoning_file.close()
+
+    @staticmethod
+    def _response_cache(payload: Dict[str, Any]) -> tuple:
+        """``(cache, cache_key, ttl)`` for a request, the cache being None when responses are not cached
+
+        Identical requests can be answered from the shared cache when
+        IONET_RESPONSE_CACHE_TTL is set; streamed and non-streamed requests
+        share entries.
+        """
+        ttl = _env_float("IONET_RESPONSE_CACHE_TTL", 0)
+        # Several choices are asked for to get different samples, so never replay them
+        if ttl <= 0 or (payload.get("n") or 1) != 1:
+            return None, None, ttl
+        cacheable = {key: value for key, value in payload.items() if key not in ("stream", "stream_options")}
+        return get_cache(), f"response:{hashlib.sha256(canonical_json(cacheable)).hexdigest()}", ttl
+
+    @staticmethod
+    def _cached_text(cache: CacheBackend, cache_key: str) -> Optional[str]:
+        """Content of a cached response that can be replayed as a stream"""
+        data = cache.get(cache_key)
+        if data is None:
+            return None
+        message = json.loads(data)["choices"][0]["message"]
+        if message.get("tool_calls"):
+            return None
+        return message.get("content") or ""
+
+    async def _send(self, payload: Dict[str, Any], timeout: aiohttp.ClientTimeout,
+                    api_key: Optional[str] = None, headers_timeout: Optional[float] = None,
+                    use_daemon: bool = True):
+        """POST a chat completion request, returning ``(response, api_key_used)``
+
+        Without an explicit key the request goes through the key pool, which
+        picks a key and waits for its rate limiter; a 429 fails over to the
+        next key. headers_timeout bounds the wait for response headers only,
+        not the time spent queueing for quota.
+
+        Bodies of at least IONET_COMPRESS_MIN_BYTES are compressed when
+        IONET_REQUEST_COMPRESSION is set. If the API answers a compressed body
+        with 400 or 415 but accepts the same body uncompressed, compression is
+        switched off for that API base.
+
+        When an `llm ionet daemon` is running (and no explicit key is given)
+        the request goes to it instead; the daemon applies its own keys,
+        budgets and accounting, so the key returned is None. The gateway
+        itself passes use_daemon=False.
+        """
+        if _process_rate_limiter:
+            with profile_phase("queue"):
+                await _process_rate_limiter.acquire()
+        socket_path = daemon_socket() if use_daemon and not api_key else None
+        if socket_path:
+            headers = {"Content-Type": "application/json"}
+            span = _current_span.get()
+            if span is not None:
+                # The daemon continues the trace
+                headers["Traceparent"] = span.traceparent
+            try:
+                with profile_phase("headers"):
+                    response = await asyncio.wait_for(
+                        get_session(socket_path=socket_path).post(
+                            "http://ionet-daemon/v1/chat/completions",
+                            headers=headers,
+                            data=canonical_json(payload),
+                            timeout=timeout
+                        ),
+                        timeout=headers_timeout
+                    )
+                return response, None
+            except (aiohttp.ClientConnectionError, OSError) as e:
+                log_event(logging.DEBUG, "daemon.unavailable", "Daemon unavailable, connecting to io.net directly: {error}",
+                          socket=socket_path, error=e)
+        pool = None if api_key else get_key_pool()
+        if not api_key and not pool:
+            api_key = get_api_key()
+            if not api_key:
+                raise ValueError("IONET key is required. Set it with 'llm keys set ionet' or IONET environment variable.")
+        attempts = len(pool) if pool else 1
+        with profile_phase("encode"):
+            body = canonical_json(payload)
+            diagnostics = get_prefix_diagnostics()
+            if diagnostics:
+                diagnostics.observe(self.model_id, payload)
+            encoding = None
+            if len(body) >= _env_float("IONET_COMPRESS_MIN_BYTES", 65536) and self.api_base not in _uncompressed_api_bases:
+                encoding = request_encoding()
+            data = body
+            if encoding:
+                # Large bodies take a while to compress, keep the event loop free meanwhile
+                data = await asyncio.get_running_loop().run_in_executor(None, compress_body, body, encoding)
+
+        async def post(key, data, encoding):
+            headers = {
+                "Authorization": f"Bearer {key}",
+                "Content-Type": "application/json"
+            }
+            if encoding:
+                headers["Content-Encoding"] = encoding
+            span = _current_span.get()
+            if span is not None:
+                headers["Traceparent"] = span.traceparent
+            with profile_phase("headers"):
+                return await asyncio.wait_for(
+                    get_session(key).post(
+                        f"{self.api_base}/chat/completions",
+                        headers=headers,
+                        data=data,
+                        timeout=timeout
+                    ),
+                    timeout=headers_timeout
+                )
+
+        for attempt in range(attempts):
+            with profile_phase("queue"):
+                lease = await pool.acquire() if pool else None
+            key = lease.key if lease else api_key
+            try:
+                # Hold back requests once the key's token budgets are used up
+                ledger = get_usage_ledger()
+                if ledger:
+                    with profile_phase("queue"):
+                        await ledger.admit(key)
+                response = await post(key, data, encoding)
+                if encoding and response.status in (400, 415):
+                    # The server may not accept compressed bodies - find out by sending it plain
+                    rejected = response.status
+                    response.release()
+                    response = await post(key, body, None)
+                    if response.status != rejected:
+                        logger.warning("%s rejected a %s request body, sending bodies uncompressed", self.api_base, encoding)
+                        _uncompressed_api_bases.add(self.api_base)
+                        data, encoding = body, None
+            except BaseException:
+                if lease:
+                    pool.release(lease)
+                raise
+            if lease:
+                pool.release(lease, response.status, response.headers)
+            if response.status == 429 and attempt + 1 < attempts:
+                logger.warning("API key was rate limited (429), retrying with another key")
+                response.release()
+                continue
+            return response, key
+
+    def _record_usage(self, api_key: str, usage: TokenUsage):
+        """Add a response's usage to the shared ledger"""
+        ledger = get_usage_ledger()
+        if not ledger or not api_key:
+            # Requests forwarded to the daemon are accounted for by the daemon
+            return
+        try:
+            ledger.record(api_key, self.model_id, usage)
+        except sqlite3.Error as e:
+            logger.warning("Failed to record token usage: %s", e)
+
+    def _open_reasoning_file(self):
+        """Open the side file that collects reasoning when IONET_REASONING=file"""
+        path = Path(os.environ.get("IONET_REASONING_FILE") or llm.user_dir() / "ionet-reasoning.log")
+        reasoning_file = open(path, "a", encoding="utf-8")
+        reasoning_file.write(f"\n=== {self.model_id} {datetime.now().isoformat(timespec='seconds')} ===\n")
+        return reasoning_file
+
+    async def _stream_with_resume(self, payload, api_key=None, want_reasoning=False):
+        """Stream content deltas, re-issuing the request as a continuation when it stalls"""
+        max_resumes = int(_env_float("IONET_MAX_RESUMES", 2))
+        if (payload.get("n") or 1) > 1:
+            # A continuation can only extend a single choice
+            max_resumes = 0
+        received: List[str] = []
+        resumes = 0
+        while True:
+            request_payload = payload
+            if received:
+                request_payload = self._continuation_payload(payload, "".join(received))
+            try:
+                async for content in self._stream_completion(request_payload, api_key, want_reasoning):
+                    if isinstance(content, str) and not isinstance(content, ReasoningChunk):
+                        received.append(content)
+                    yield content
+                return
+            except StreamStalledError as e:
+                resumes += 1
+                if resumes > max_resumes:
+                    logger.error("Giving up after %s resumed streams: %s", max_resumes, e)
+                    raise
+                logger.warning("%s; resuming stream (%s/%s)", e, resumes, max_resumes)
+
+    def _continuation_payload(self, payload: Dict[str, Any], partial_text: str) -> Dict[str, Any]:
+        """Build a request that continues a partially received assistant message"""
+        resumed = dict(payload)
+        resumed["messages"] = list(payload["messages"]) + [{"role": "assistant", "content": partial_text}]
+        if payload.get("max_tokens"):
+            # The continuation shares the original token allowance
+            resumed["max_tokens"] = max(1, payload["max_tokens"] - len(partial_text) // 4)
+        # vLLM-style servers extend the final assistant message instead of starting a new turn
+        resumed["continue_final_message"] = True
+        resumed["add_generation_prompt"] = False
+        return resumed
+
+    async def _stream_completion(self, payload, api_key=None, want_reasoning=False):
+        """Issue one streaming request and yield its content deltas
+
+        Reasoning deltas are yielded as ReasoningChunk when want_reasoning is
+        set; otherwise reasoning-only events are skipped before JSON decoding.
+
+        Raises StreamStalledError when the first token or the next chunk does
+        not arrive within the configured IONET_FIRST_TOKEN_TIMEOUT and
+        IONET_IDLE_TIMEOUT windows (seconds, 0 disables).
+        """
+        connect_timeout = _env_float("IONET_CONNECT_TIMEOUT", 30.0)
+        first_token_timeout = _env_float("IONET_FIRST_TOKEN_TIMEOUT", 120.0)
+        idle_timeout = _env_float("IONET_IDLE_TIMEOUT", 60.0)
+
+        loop = asyncio.get_running_loop()
+        multiple_choices = (payload.get("n") or 1) > 1
+        try:
+            # The idle watchdog bounds long generations, so drop aiohttp's total timeout
+            response, used_key = await self._send(
+                payload,
+                aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout or None),
+                api_key,
+                headers_timeout=first_token_timeout or None
+            )
+        except asyncio.TimeoutError:
+            raise StreamStalledError(f"No response headers within {first_token_timeout}s")
+        first_token_deadline = loop.time() + first_token_timeout
+
+        try:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error("API request failed with status %s: %s", response.status, error_text)
+                raise Exception(f"API request failed: {response.status} - {error_text}")
+
+            # Handle streaming response - parse SSE format
+            finished = False
+            # Native tool calls arrive as fragments keyed by index until the choice finishes
+            tool_calls: Dict[int, Dict[str, Any]] = {}
+            choices_seen = set()
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            buffer = ""
+            got_first_token = False
+            while True:
+                if got_first_token:
+                    timeout = idle_timeout or None
+                elif first_token_timeout:
+                    timeout = max(0.0, first_token_deadline - loop.time())
+                else:
+                    timeout = None
+                try:
+                    with profile_phase("stream_read"):
+                        chunk = await asyncio.wait_for(response.content.readany(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    if got_first_token:
+                        raise StreamStalledError(f"No data for {idle_timeout}s mid-stream")
+                    raise StreamStalledError(f"No first token within {first_token_timeout}s")
+                if not chunk:
+                    finished = True
+                    break
+                log_event(logging.DEBUG, "stream.chunk", "Received {size} bytes from {model}", model=self.model_id, size=len(chunk))
+
+                buffer += decoder.decode(chunk)
+                # Process complete lines
+                while '\n' in buffer:
+                    line, buffer = buffer.split('\n', 1)
+                    line = line.strip()
+
+                    # Skip empty lines and non-data lines
+                    if not line or not line.startswith('data:'):
+                        continue
+                    if not got_first_token:
+                        profile = _current_profile.get()
+                        if profile is not None:
+                            profile.mark("first_token")
+                    got_first_token = True
+
+                    # Extract the data part
+                    data_str = line[5:].strip()  # Remove 'data:' prefix
+
+                    # Check for end of stream
+                    if data_str == '[DONE]':
+                        finished = True
+                        for tool_call in self._finish_tool_calls(tool_calls):
+                            yield tool_call
+                        return
+
+                    if not want_reasoning and '"reasoning' in data_str and not _OUTPUT_MARKERS.search(data_str):
+                        # Reasoning-only delta we have opted out of - don't decode it
+                        continue
+
+                    try:
+                        # Parse the JSON data
+                        data = json.loads(data_str)
+                    except json.JSONDecodeError:
+                        # Skip invalid JSON
+                        continue
+
+                    if data.get('usage'):
+                        usage = TokenUsage(data['usage'])
+                        self._record_usage(used_key, usage)
+                        yield usage
+
+                    # Extract content from choices
+                    # Several choices interleave their deltas when n > 1
+                    for choice in (data.get('choices') or [])[:None if multiple_choices else 1]:
+                        delta = choice.get('delta') or {}
+                        index = choice.get('index', 0)
+                        if want_reasoning and index == 0:
+                            reasoning = delta.get('reasoning_content') or delta.get('reasoning')
+                            if reasoning:
+                                yield ReasoningChunk(reasoning)
+                        content = delta.get('content')
+                        if content:
+                            yield ChoiceChunk(content, index) if multiple_choices else content
+                        elif multiple_choices and index not in choices_seen:
+                            # Announce choices that stream no content (say one finishing
+                            # at once) so callers can still tell how many came back
+                            yield ChoiceChunk("", index)
+                        if multiple_choices:
+                            choices_seen.add(index)
+                        for fragment in delta.get('tool_calls') or []:
+                            call = tool_calls.setdefault(fragment.get('index', 0), {"id": None, "name": "", "arguments": []})
+                            function = fragment.get('function') or {}
+                            call["id"] = fragment.get('id') or call["id"]
+                            call["name"] += function.get('name') or ""
+                            call["arguments"].append(function.get('arguments') or "")
+                        if choice.get('finish_reason'):
+                            for tool_call in self._finish_tool_calls(tool_calls):
+                                yield tool_call
+            # Some servers end the stream without [DONE]
+            for tool_call in self._finish_tool_calls(tool_calls):
+                yield tool_call
+        finally:
+            if finished:
+                # Hand the connection back to the key's pool for reuse
+                response.release()
+            else:
+                # Abandoned mid-stream: drop the connection instead of draining it
+                response.close()
+
+    @staticmethod
+    def _finish_tool_calls(tool_calls: Dict[int, Dict[str, Any]]) -> List[llm.ToolCall]:
+        """Assemble the buffered tool call fragments, in index order, and clear them"""
+        calls = [
+            native_tool_call(call["name"], "".join(call["arguments"]), call["id"])
+            for _, call in sorted(tool_calls.items()) if call["name"]
+        ]
+        tool_calls.clear()
+        return calls
 
     def _process_attachments(self, attachments) -> List[Dict[str, str]]:
         """Process attachments and convert them to base64 encoded strings"""
@@ -286,7 +4085,7 @@ class IOIntelligenceModel(llm.Model):
                     "data": encoded_content
                 })
             except Exception as e:
-                logger.warning(f"Failed to process attachment {attachment.path}: {e}")
+                logger.warning("Failed to process attachment %s: %s", attachment.path, e)
                 
         return processed_attachments
 
@@ -295,6 +4094,11 @@ class IOIntelligenceModel(llm.Model):
         # Store the prompt JSON for debugging
         messages = self.build_messages(prompt, conversation)
         response._prompt_json = {"messages": messages}
+        tools = self.build_tools(prompt)
+        if get_trace_exporter():
+            # llm runs the tools once the response is done; give each call a span
+            for tool in getattr(prompt, "tools", None) or []:
+                trace_tool(tool)
         
         # Run the async method in a new event loop
         try:
@@ -306,32 +4110,65 @@ class IOIntelligenceModel(llm.Model):
         if stream:
             # Handle streaming - yield chunks in real-time
             def sync_stream():
+                # With IONET_PROFILE_DIR set, chunks cross the thread bridge with a timestamp
+                profile = RequestProfile.from_env(self.model_id)
                 # Create queues to handle async-to-sync streaming
                 chunk_queue = queue.Queue()
                 exception_queue = queue.Queue()
-                done_queue = queue.Queue()
+                # Put on chunk_queue last, so the consumer stops without waiting for a poll timeout
+                finished = object()
+                cancelled = threading.Event()
+                producer_tasks = []
                 
                 # Producer function that runs in a separate thread
                 def producer():
                     async def async_producer():
+                        generator = self.execute_async_with_tools(prompt, tools=tools, stream=True, conversation=conversation)
+                        coalesce_ms = _env_float("IONET_COALESCE_MS", 0)
+                        if coalesce_ms > 0:
+                            # Fewer, larger chunks to hand across threads, print and log
+                            generator = coalesce_stream(
+                                generator, coalesce_ms / 1000, int(_env_float("IONET_COALESCE_BYTES", 1024))
+                            )
+                        if profile is not None:
+                            # The report is written once the consumer is done too
+                            generator = self._profiled(generator, profile, write=False)
                         try:
-                            async for chunk in self.execute_async_with_tools(prompt, stream=True):
-                                chunk_queue.put(chunk)
+                            async for chunk in generator:
+                                if cancelled.is_set():
+                                    break
+                                chunk_queue.put((chunk, time.perf_counter()) if profile is not None else chunk)
                         except Exception as e:
                             exception_queue.put(e)
                         finally:
-                            done_queue.put(True)
+                            # Closing the generator closes the HTTP response straight away
+                            await generator.aclose()
+                            chunk_queue.put(finished)
                     
                     # Run the async producer
-                    loop.run_until_complete(async_producer())
+                    task = loop.create_task(async_producer())
+                    producer_tasks.append(task)
+                    if cancelled.is_set():
+                        task.cancel()
+                    try:
+                        loop.run_until_complete(task)
+                    except asyncio.CancelledError:
+                        pass
+
+                def cancel_producer():
+                    cancelled.set()
+                    for task in producer_tasks:
+                        loop.call_soon_threadsafe(task.cancel)
                 
-                # Start the producer in a separate thread
-                producer_thread = threading.Thread(target=producer)
+                # Start the producer in a separate thread, in the caller's context so
+                # the request's span is a child of the caller's current span
+                producer_thread = threading.Thread(target=contextvars.copy_context().run, args=(producer,), daemon=True)
                 producer_thread.start()
                 
                 # Consumer - yield chunks as they arrive
-                while True:
-                    try:
+                profiler = profile.start_cprofile() if profile is not None else None
+                try:
+                    while True:
                         # Check for exceptions first
                         try:
                             exc = exception_queue.get_nowait()
@@ -342,44 +4179,172 @@ class IOIntelligenceModel(llm.Model):
                         # Try to get a chunk with timeout
                         try:
                             chunk = chunk_queue.get(timeout=0.1)
-                            yield chunk
-                        except queue.Empty:
-                            # Check if we're done
-                            try:
-                                done_queue.get_nowait()
-                                break
-                            except queue.Empty:
-                                # Still waiting, continue
+                            if chunk is finished:
+                                # The producer may have failed just before finishing
+                                try:
+                                    exc = exception_queue.get_nowait()
+                                    raise exc
+                                except queue.Empty:
+                                    break
+                            if profile is not None:
+                                chunk, queued = chunk
+                                profile.add("bridge", time.perf_counter() - queued)
+                            if isinstance(chunk, llm.ToolCall):
+                                response.add_tool_call(chunk)
                                 continue
-                                
-                    except Exception as e:
-                        # Make sure to join the thread before re-raising
-                        producer_thread.join()
-                        raise e
-                
-                # Wait for the producer thread to finish
-                producer_thread.join()
+                            if isinstance(chunk, TokenUsage):
+                                _set_response_usage(response, chunk)
+                                continue
+                            if isinstance(chunk, ReasoningChunk):
+                                event = _reasoning_event(chunk)
+                                if event is not None:
+                                    yield event
+                                continue
+                            if profile is not None:
+                                # Time spent in llm printing and logging the chunk
+                                with profile.phase("consumer"):
+                                    yield chunk
+                            else:
+                                yield chunk
+                        except queue.Empty:
+                            # Still waiting, continue
+                            continue
+                finally:
+                    if producer_thread.is_alive():
+                        # The consumer stopped early (generator closed, Ctrl-C or an
+                        # error), so abort the upstream request instead of draining it
+                        cancel_producer()
+                    # Wait for the producer thread to finish
+                    producer_thread.join()
+                    if profile is not None:
+                        profile.stop_cprofile(profiler)
+                        profile.write()
                     
+            if (getattr(getattr(prompt, "options", None), "n", None) or 1) > 1 and not tools:
+                return self._present_choices(sync_stream())
             return sync_stream()
         else:
             # Handle non-streaming
-            result_generator = self.execute_async_with_tools(prompt, stream=False)
+            result_generator = self.execute_async_with_tools(prompt, tools=tools, stream=False, conversation=conversation)
             # Get the first (and only) item from the generator
-            result = loop.run_until_complete(result_generator.__anext__())
+            next_result = loop.create_task(result_generator.__anext__())
+            try:
+                result = loop.run_until_complete(next_result)
+            except BaseException:
+                # Ctrl-C leaves the request pending - cancel it so the connection is closed
+                next_result.cancel()
+                loop.run_until_complete(asyncio.gather(next_result, return_exceptions=True))
+                raise
+            finally:
+                loop.run_until_complete(result_generator.aclose())
             content = result["content"]
+            if result.get("choices"):
+                content = "".join(
+                    (SAMPLE_SEPARATOR.format(number=number) if number > 1 else "") + text
+                    for number, text in enumerate(result["choices"], 1)
+                )
+            if result.get("usage"):
+                _set_response_usage(response, result["usage"])
             
             # Handle tool calls if present
             if result["tool_calls"]:
                 for tool_call in result["tool_calls"]:
                     response.add_tool_call(
-                        llm.ToolCall(
-                            name=tool_call["function"]["name"],
-                            arguments=tool_call["function"]["arguments"],
+                        native_tool_call(
+                            tool_call["function"]["name"], tool_call["function"].get("arguments"), tool_call.get("id")
                         )
                     )
+            elif tools and content:
+                # Fall back to tool calls the model wrote out as text
+                content, text_tool_calls = parse_tool_calls(content, [tool["function"]["name"] for tool in tools])
+                for tool_call in text_tool_calls:
+                    response.add_tool_call(tool_call)
             
             # Return the content as an iterator
-            return iter([content])
+            chunks = [content]
+            if result.get("reasoning"):
+                event = _reasoning_event(result["reasoning"])
+                if event is not None:
+                    chunks.insert(0, event)
+            return iter(chunks)
+
+    @staticmethod
+    def _present_choices(chunks):
+        """Stream the first sample as it arrives and the others after it, each under a separator"""
+        buffered: Dict[int, List[str]] = {}
+        for chunk in chunks:
+            if isinstance(chunk, ChoiceChunk):
+                if chunk.index:
+                    buffered.setdefault(chunk.index, []).append(str(chunk))
+                    continue
+                chunk = str(chunk)
+            yield chunk
+        for index in sorted(buffered):
+            yield SAMPLE_SEPARATOR.format(number=index + 1) + "".join(buffered[index])
+
+    async def sample(self, text: str, n: int, system: Optional[str] = None,
+                     options: Optional["IOIntelligenceModel.Options"] = None) -> List[str]:
+        """Generate n independent replies to one prompt, e.g. for best-of-n or voting"""
+        options = (options or self.Options()).model_copy(update={"n": n})
+        prompt = SimpleNamespace(prompt=text, system=system, attachments=[], tools=[], options=options)
+        generator = self.execute_async_with_tools(prompt, stream=False)
+        try:
+            result = await generator.__anext__()
+        finally:
+            await generator.aclose()
+        return result.get("choices") or [result["content"]]
+
+    async def probe(self, api_key: Optional[str] = None) -> float:
+        """Send a one-token request and return its latency, raising if the model is unavailable
+
+        Without an explicit key the probe leases a key from the key pool.
+        """
+        payload = {
+            "model": self.full_model_name,
+            "messages": [{"role": "user", "content": "ping"}],
+            "max_tokens": 1,
+        }
+        pool = None if api_key else get_key_pool()
+        lease = await pool.acquire() if pool else None
+        headers = {
+            "Authorization": f"Bearer {lease.key if lease else api_key or get_api_key()}",
+            "Content-Type": "application/json"
+        }
+        status = response_headers = None
+        start = time.monotonic()
+        timeout = aiohttp.ClientTimeout(total=_env_float("IONET_FIRST_TOKEN_TIMEOUT", 120.0) or None)
+        try:
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.post(f"{self.api_base}/chat/completions", headers=headers, json=payload) as response:
+                    status, response_headers = response.status, response.headers
+                    if response.status != 200:
+                        raise Exception(f"Probe failed: {response.status} - {await response.text()}")
+                    await response.read()
+        finally:
+            if lease:
+                pool.release(lease, status, response_headers)
+        return time.monotonic() - start
+
+    async def complete(self, text: str, system: Optional[str] = None) -> str:
+        """Run a one-off prompt without tools or history and return the reply text"""
+        prompt = SimpleNamespace(prompt=text, system=system, attachments=[], tools=[])
+        return await self.execute_async(prompt)
+
+    async def stream_records(self, text: str, schema: Dict[str, Any], system: Optional[str] = None,
+                             options: Optional["IOIntelligenceModel.Options"] = None):
+        """Stream a structured response, yielding each record once it is complete and valid
+
+        See JSONRecordStreamParser for which values count as records. Raises
+        SchemaValidationError for a record that does not match the schema.
+        """
+        prompt = SimpleNamespace(prompt=text, system=system, attachments=[], tools=[], schema=schema, options=options)
+        parser = JSONRecordStreamParser(schema)
+        async for chunk in self.execute_async_with_tools(prompt, stream=True):
+            if isinstance(chunk, str) and not isinstance(chunk, ReasoningChunk):
+                for record in parser.feed(chunk):
+                    yield record
+        for record in parser.finish():
+            yield record
 
     async def execute_async(self, prompt, get_env_var=None):
         """Async execution without tools for compatibility"""
@@ -387,3 +4352,464 @@ class IOIntelligenceModel(llm.Model):
         # Get the first (and only) item from the generator
         result = await result_generator.__anext__()
         return result["content"]
+
+
+# Backends io.net serves without native function calling (see TOOL_CALLING_IMPLEMENTATION.md)
+TOOLLESS_MODEL_MARKERS = ("deepseek-r1", "phi-4", "gemma-3", "mistral-large")
+VISION_MODEL_MARKERS = ("vision", "-vl-", "maverick")
+DEFAULT_ROUTER_MODELS = (
+    "meta-llama/Llama-3.3-70B-Instruct",
+    "mistralai/Mistral-Large-Instruct-2411",
+    "Qwen/Qwen3-235B-A22B-FP8",
+)
+
+
+def model_capabilities(model) -> Dict[str, bool]:
+    """Best-effort capability flags for an io.net model"""
+    names = f"{model.model_id} {model.full_model_name}".lower()
+    return {
+        "vision": any(marker in names for marker in VISION_MODEL_MARKERS),
+        "tools": not any(marker in names for marker in TOOLLESS_MODEL_MARKERS),
+    }
+
+
+def select_router_backends(models: List["IOIntelligenceModel"]) -> List["IOIntelligenceModel"]:
+    """Pick the router's backends from the registered models using IONET_ROUTER_MODELS"""
+    configured = os.environ.get("IONET_ROUTER_MODELS")
+    specs = [spec.strip() for spec in configured.split(",")] if configured else list(DEFAULT_ROUTER_MODELS)
+    backends = []
+    for spec in filter(None, specs):
+        for model in models:
+            if spec in (model.model_id, model.full_model_name, model.model_id[len("ionet/"):]):
+                if model not in backends:
+                    backends.append(model)
+                break
+    return backends
+
+
+class BackendStats:
+    """Rolling time-to-first-token and error-rate statistics for one backend"""
+
+    def __init__(self, window: int = 20):
+        self.ttfts = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self._lock = threading.Lock()
+
+    def record_success(self, ttft: float):
+        with self._lock:
+            self.ttfts.append(ttft)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+
+    @property
+    def ttft(self) -> float:
+        """Median TTFT over the window; 0 while unmeasured so new backends get tried"""
+        with self._lock:
+            if not self.ttfts:
+                return 0.0
+            ordered = sorted(self.ttfts)
+        return ordered[len(ordered) // 2]
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    @property
+    def healthy(self) -> bool:
+        max_error_rate = _env_float("IONET_ROUTER_MAX_ERROR_RATE", 0.5)
+        return self.consecutive_failures < 2 and (len(self.outcomes) < 4 or self.error_rate <= max_error_rate)
+
+
+class IORouterModel(llm.Model):
+    """Virtual model sending each prompt to the fastest healthy backend that can handle it
+
+    Backends are ranked by rolling TTFT; unhealthy ones are skipped and probed
+    in the background every IONET_ROUTER_PROBE_INTERVAL seconds until they
+    answer again.
+    """
+
+    model_id = "ionet/router"
+    can_stream = True
+    supports_tools = True
+    supports_schema = True
+    attachment_types = IOIntelligenceModel.attachment_types
+    Options = IOIntelligenceModel.Options
+
+    def __init__(self, backends: List[IOIntelligenceModel]):
+        self.backends = list(backends)
+        self.full_model_name = "router"
+        # Prompts may land on any backend, so only promise the smallest context
+        self.context_length = min((backend.context_length or 0 for backend in self.backends), default=None) or None
+        self.stats = {backend.model_id: BackendStats() for backend in self.backends}
+        self._probe_thread = None
+        self._probe_lock = threading.Lock()
+
+    def __str__(self):
+        return f"IORouterModel: {self.model_id} ({', '.join(backend.model_id for backend in self.backends)})"
+
+    def candidates(self, prompt) -> List[IOIntelligenceModel]:
+        """Backends able to serve the prompt, healthy and fastest first"""
+        needs_vision = bool(getattr(prompt, 'attachments', None))
+        needs_tools = bool(getattr(prompt, 'tools', None))
+        capable = []
+        for backend in self.backends:
+            capabilities = model_capabilities(backend)
+            if needs_vision and not capabilities["vision"]:
+                continue
+            if needs_tools and not capabilities["tools"]:
+                continue
+            capable.append(backend)
+        if not capable:
+            needs = " and ".join(name for name, needed in (("vision", needs_vision), ("tools", needs_tools)) if needed)
+            raise Exception(f"No router backend supports {needs}")
+        return sorted(capable, key=lambda backend: (not self.stats[backend.model_id].healthy, self.stats[backend.model_id].ttft))
+
+    def execute(self, prompt, stream: bool, response, conversation=None):
+        """Run the prompt on the best backend, failing over before the first chunk"""
+        last_error = None
+        for backend in self.candidates(prompt):
+            stats = self.stats[backend.model_id]
+            start = time.monotonic()
+            yielded = False
+            try:
+                chunks = backend.execute(prompt, stream, response, conversation)
+                for chunk in chunks:
+                    if not yielded:
+                        stats.record_success(time.monotonic() - start)
+                        yielded = True
+                        if hasattr(response, "set_resolved_model"):
+                            response.set_resolved_model(backend.model_id)
+                    yield chunk
+                if not yielded:
+                    stats.record_success(time.monotonic() - start)
+                return
+            except DeadlineExceededError:
+                # The time budget is spent, another backend would start from zero
+                stats.record_failure()
+                raise
+            except Exception as e:
+                if yielded:
+                    # Output has already reached the caller, so we can't switch backends
+                    raise
+                stats.record_failure()
+                last_error = e
+                logger.warning("Router backend %s failed, trying the next one: %s", backend.model_id, e)
+                if not stats.healthy:
+                    self._start_probing()
+        raise last_error
+
+    def _start_probing(self):
+        with self._probe_lock:
+            if self._probe_thread is None or not self._probe_thread.is_alive():
+                self._probe_thread = threading.Thread(target=self._probe_loop, daemon=True)
+                self._probe_thread.start()
+
+    def _probe_loop(self):
+        """Probe unhealthy backends until every one of them is healthy again"""
+        interval = _env_float("IONET_ROUTER_PROBE_INTERVAL", 30.0)
+        while True:
+            unhealthy = [backend for backend in self.backends if not self.stats[backend.model_id].healthy]
+            if not unhealthy:
+                return
+            time.sleep(interval)
+            # Each probe leases a key from the pool like any other request
+            pool = get_key_pool()
+            api_key = None if pool else get_api_key()
+            if not (pool or api_key):
+                continue
+            for backend in unhealthy:
+                try:
+                    latency = asyncio.run(backend.probe(api_key))
+                except Exception as e:
+                    logger.debug("Probe of %s failed: %s", backend.model_id, e)
+                    continue
+                logger.info("Router backend %s is healthy again", backend.model_id)
+                stats = self.stats[backend.model_id]
+                # A successful probe clears the failure history
+                stats.outcomes.clear()
+                stats.record_success(latency)
+
+
+_USAGE_EVENT = re.compile(rb'"usage":\s*\{')
+
+
+class Gateway:
+    """OpenAI-compatible HTTP front end for the plugin's models
+
+    Serves ``/v1/models`` and ``/v1/chat/completions`` so other processes can
+    share this process's warm per-key sessions, key pool, usage ledger and
+    budgets, response caches and router statistics. Requests are forwarded
+    to io.net as-is apart from the model name; streamed responses are
+    relayed chunk by chunk.
+    """
+
+    def __init__(self, models: List[llm.Model], token: Optional[str] = None):
+        self.models: Dict[str, llm.Model] = {}
+        for model in models:
+            self.models[model.model_id] = model
+        # Also accept the upstream names clients may already be configured with
+        for model in models:
+            self.models.setdefault(model.full_model_name, model)
+        self.token = token
+
+    def app(self):
+        from aiohttp import web
+
+        @web.middleware
+        async def auth(request, handler):
+            if self.token and request.headers.get("Authorization") != f"Bearer {self.token}":
+                return self._error(401, "Invalid or missing gateway token", "authentication_error")
+            return await handler(request)
+
+        app = web.Application(middlewares=[auth])
+        app.router.add_get("/v1/models", self.list_models)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+
+        async def close(app):
+            await close_sessions()
+
+        app.on_cleanup.append(close)
+        return app
+
+    @staticmethod
+    def _error(status: int, message: str, error_type: str = "invalid_request_error"):
+        from aiohttp import web
+
+        return web.json_response({"error": {"message": message, "type": error_type}}, status=status)
+
+    async def list_models(self, request):
+        from aiohttp import web
+
+        seen = set()
+        data = []
+        for model in self.models.values():
+            if model.model_id in seen:
+                continue
+            seen.add(model.model_id)
+            data.append({
+                "id": model.model_id,
+                "object": "model",
+                "owned_by": "io.net",
+                "root": model.full_model_name,
+                "context_length": model.context_length,
+            })
+        return web.json_response({"object": "list", "data": data})
+
+    async def chat_completions(self, request):
+        with trace_span("POST /v1/chat/completions", "server", {"http.request.method": "POST"},
+                        request.headers.get("Traceparent")) as span:
+            response = await self._chat_completions(request)
+            if span is not None and response is not None:
+                span.set_attribute("http.response.status_code", response.status)
+            return response
+
+    async def _chat_completions(self, request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            return self._error(400, "Request body is not valid JSON")
+        if not isinstance(body, dict) or not body.get("messages"):
+            return self._error(400, "'messages' is required")
+        model = self.models.get(body.get("model"))
+        if model is None:
+            return self._error(404, f"Unknown model: {body.get('model')}")
+
+        if not isinstance(model, IORouterModel):
+            return await self._forward(request, model, body)
+
+        needs = SimpleNamespace(
+            attachments=[part for message in body["messages"] if isinstance(message.get("content"), list)
+                         for part in message["content"] if part.get("type") == "image_url"],
+            tools=body.get("tools"),
+        )
+        try:
+            backends = model.candidates(needs)
+        except Exception as e:
+            return self._error(400, str(e))
+        last_error = None
+        for backend in backends:
+            stats = model.stats[backend.model_id]
+            start = time.monotonic()
+            try:
+                response = await self._forward(request, backend, body, retryable=True)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+            else:
+                if response is not None:
+                    stats.record_success(time.monotonic() - start)
+                    return response
+                last_error = "upstream server error"
+            stats.record_failure()
+            logger.warning("Gateway backend %s failed, trying the next one: %s", backend.model_id, last_error)
+            if not stats.healthy:
+                model._start_probing()
+        return self._error(502, f"All router backends failed: {last_error}", "upstream_error")
+
+    async def _replay(self, request, model: "IOIntelligenceModel", result: Dict[str, Any], stream: bool):
+        """Answer from a cached response, as a completion or as an event stream
+
+        Cache hits carry no usage, since nothing was sent to io.net.
+        """
+        from aiohttp import web
+
+        completion = {
+            "id": result.get("id") or f"chatcmpl-{os.urandom(12).hex()}",
+            "object": "chat.completion.chunk" if stream else "chat.completion",
+            "created": result.get("created") or int(time.time()),
+            "model": result.get("model") or model.full_model_name,
+        }
+        if not stream:
+            choices = [dict(choice, index=choice.get("index", index), finish_reason=choice.get("finish_reason") or "stop")
+                       for index, choice in enumerate(result["choices"])]
+            return web.json_response(dict(completion, choices=choices))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        content = result["choices"][0]["message"].get("content") or ""
+        for choice in (
+            {"index": 0, "delta": {"role": "assistant", "content": content}, "finish_reason": None},
+            {"index": 0, "delta": {}, "finish_reason": "stop"},
+        ):
+            event = json.dumps(dict(completion, choices=[choice]), ensure_ascii=False)
+            await response.write(f"data: {event}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _forward(self, request, model: "IOIntelligenceModel", body: Dict[str, Any], retryable: bool = False):
+        """Send the request upstream and relay the reply
+
+        With retryable set, server errors and connection failures return
+        None (or raise) before anything has been sent to the client, so the
+        router can try another backend.
+        """
+        from aiohttp import web
+
+        payload = dict(body)
+        payload["model"] = model.full_model_name
+        stream = bool(payload.get("stream"))
+
+        # Repeated requests are answered from the same caches as llm prompts
+        try:
+            cache, cache_key, cache_ttl = model._response_cache(payload)
+        except ValueError as e:
+            # IONET_CACHE is misconfigured
+            return self._error(500, str(e), "server_error")
+        cached = None
+        if cache:
+            if stream:
+                text = model._cached_text(cache, cache_key)
+                if text is not None:
+                    cached = {"choices": [{"message": {"role": "assistant", "content": text}}]}
+            else:
+                data = cache.get(cache_key)
+                cached = json.loads(data) if data is not None else None
+        semantic_cache = get_semantic_cache()
+        semantic_query = None
+        if cached is None and semantic_cache:
+            query, answer = await semantic_cache.lookup(model.model_id, payload)
+            if answer is not None:
+                cached = {"choices": [{"message": {"role": "assistant", "content": answer}}]}
+            else:
+                semantic_query = query
+        if cached is not None:
+            return await self._replay(request, model, cached, stream)
+
+        connect_timeout = _env_float("IONET_CONNECT_TIMEOUT", 30.0)
+        first_token_timeout = _env_float("IONET_FIRST_TOKEN_TIMEOUT", 120.0)
+        timeout = aiohttp.ClientTimeout(total=None if stream else 600, sock_connect=connect_timeout or None)
+        try:
+            upstream, used_key = await model._send(
+                payload, timeout, headers_timeout=first_token_timeout or None, use_daemon=False
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if retryable:
+                raise
+            return self._error(502, "Could not reach io.net", "upstream_error")
+        except BudgetExceededError as e:
+            return self._error(429, str(e), "rate_limit_error")
+        except ValueError as e:
+            # No API key configured for the gateway process
+            return self._error(500, str(e), "server_error")
+
+        try:
+            if retryable and upstream.status >= 500:
+                if logger.isEnabledFor(logging.DEBUG):
+                    log_event(logging.DEBUG, "gateway.upstream_error", "Upstream {model} returned {status}: {body}",
+                              model=model.model_id, status=upstream.status, body=await upstream.text())
+                return None
+            if not stream or upstream.status != 200:
+                data = await upstream.read()
+                if upstream.status == 200:
+                    try:
+                        result = json.loads(data)
+                        usage = result.get("usage")
+                        message = result["choices"][0]["message"]
+                    except (ValueError, AttributeError, KeyError, IndexError, TypeError):
+                        result = usage = message = None
+                    if usage:
+                        model._record_usage(used_key, TokenUsage(usage))
+                    if cache and result is not None:
+                        cache.set(cache_key, data, cache_ttl)
+                    if semantic_query and message is not None and not message.get("tool_calls"):
+                        semantic_cache.store(model.model_id, semantic_query, message.get("content") or "")
+                return web.Response(
+                    body=data,
+                    status=upstream.status,
+                    content_type=upstream.content_type or "application/json",
+                )
+
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+            await response.prepare(request)
+            # The streamed text is only collected when a cache will keep it
+            collect = bool(cache or semantic_query)
+            text = []
+            tool_calls = done = False
+            pending = b""
+            async for chunk in upstream.content.iter_any():
+                await response.write(chunk)
+                # Watch the relayed events for the usage summary without re-encoding them
+                pending += chunk
+                lines = pending.split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    if not line.startswith(b"data:") or not (collect or _USAGE_EVENT.search(line)):
+                        continue
+                    if line[5:].strip() == b"[DONE]":
+                        done = True
+                        continue
+                    try:
+                        event = json.loads(line[5:])
+                    except ValueError:
+                        continue
+                    if not isinstance(event, dict):
+                        continue
+                    if event.get("usage"):
+                        model._record_usage(used_key, TokenUsage(event["usage"]))
+                    if collect:
+                        for choice in event.get("choices") or []:
+                            choice_delta = choice.get("delta") or {}
+                            tool_calls = tool_calls or bool(choice_delta.get("tool_calls"))
+                            if choice_delta.get("content"):
+                                text.append(choice_delta["content"])
+            await response.write_eof()
+            # Only complete answers without tool calls are kept, in the format execute stores
+            if collect and done and not tool_calls:
+                content = "".join(text)
+                if cache:
+                    message = {"role": "assistant", "content": content}
+                    cache.set(cache_key, json.dumps({"choices": [{"message": message}]}).encode("utf-8"), cache_ttl)
+                if semantic_query:
+                    semantic_cache.store(model.model_id, semantic_query, content)
+            return response
+        finally:
+            upstream.release()
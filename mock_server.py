@@ -0,0 +1,111 @@
+"""
+Local aiohttp server standing in for the io.net API (and web pages) in tests and benchmarks
+
+Routes map "METHOD /path" to aiohttp handlers. Use it as an async context
+manager inside a running event loop, or as a plain context manager to run
+it on a background thread for code that makes requests synchronously:
+
+    async with MockServer({"POST /api/v1/chat/completions": chat}) as server:
+        model.api_base = server.api_base
+
+    with MockServer({"POST /api/v1/chat/completions": chat}) as server:
+        text = model.prompt("hi").text()
+"""
+import asyncio
+import json
+import threading
+
+from aiohttp import web
+
+
+def sse(data) -> bytes:
+    """One server-sent event: a JSON-encoded value, or a raw string such as "[DONE]" """
+    return f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode()
+
+
+def delta(content=None, index=0, **fields) -> bytes:
+    """A streamed chat completion chunk with one delta"""
+    if content is not None:
+        fields["content"] = content
+    return sse({"choices": [{"index": index, "delta": fields}]})
+
+
+async def stream_response(request, events, delay: float = 0) -> web.StreamResponse:
+    """Stream events (bytes, or values for sse()) followed by [DONE]"""
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for event in events:
+        await response.write(event if isinstance(event, bytes) else sse(event))
+        if delay:
+            await asyncio.sleep(delay)
+    await response.write(sse("[DONE]"))
+    return response
+
+
+class MockServer:
+    """aiohttp application on a free port of 127.0.0.1, or on a Unix socket
+
+    routes is a dict of "METHOD /path" to handler, or a ready-made
+    web.Application; app_options are passed to web.Application.
+    """
+
+    def __init__(self, routes, socket_path=None, **app_options):
+        self.routes = routes
+        self.socket_path = socket_path
+        self.app_options = app_options
+        self.url = None
+        self.loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def api_base(self) -> str:
+        return f"{self.url}/api/v1"
+
+    async def start(self):
+        if isinstance(self.routes, web.Application):
+            app = self.routes
+        else:
+            app = web.Application(**self.app_options)
+            for route, handler in self.routes.items():
+                method, path = route.split(" ", 1)
+                app.router.add_route(method, path, handler)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        if self.socket_path:
+            await web.UnixSite(self._runner, self.socket_path).start()
+            self.url = "http://localhost"
+        else:
+            await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+            self.url = f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+        self.loop = asyncio.get_running_loop()
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def start_thread(self):
+        """Serve from an event loop on a daemon thread"""
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(self.start())
+        self._thread = threading.Thread(target=loop.run_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(10)
+        self.loop.close()
+
+    def __enter__(self):
+        return self.start_thread()
+
+    def __exit__(self, *exc_info):
+        self.stop_thread()
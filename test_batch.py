@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script for multi-process batch execution with a shared rate limiter
+"""
+import os
+import sys
+import time
+import asyncio
+import multiprocessing
+from unittest.mock import patch
+
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_io_intelligence import IOIntelligenceModel, SharedRateLimiter, run_batch
+from mock_server import MockServer
+
+
+def word_count(text):
+    """Post-processor used by the batch workers"""
+    return {"words": len(text.split()), "pid": os.getpid()}
+
+
+def _reserve_many(limiter, count, slots):
+    for _ in range(count):
+        slots.append(time.time() + limiter.reserve())
+
+
+class EchoServer(MockServer):
+    """Local chat completions server recording when each request arrived"""
+
+    def __init__(self):
+        super().__init__({"POST /api/v1/chat/completions": self.handler})
+        self.arrivals = []
+
+    async def handler(self, request):
+        body = await request.json()
+        self.arrivals.append(time.time())
+        prompt = body["messages"][-1]["content"]
+        if prompt == "fail":
+            return web.json_response({"error": "bad prompt"}, status=400)
+        # Finish out of order so ordering has to be restored by the batch runner
+        await asyncio.sleep(0.05 if int(prompt.split()[-1]) % 2 else 0.0)
+        return web.json_response({"choices": [{"message": {"content": f"echo {prompt}"}}]})
+
+
+
+def test_shared_limiter_across_processes():
+    """Test that reservations made in different processes share one schedule"""
+    print("=== Testing SharedRateLimiter ===")
+    context = multiprocessing.get_context("spawn")
+    limiter = SharedRateLimiter(600, period=60.0, burst=1, context=context)
+    manager = context.Manager()
+    slots = manager.list()
+    processes = [context.Process(target=_reserve_many, args=(limiter, 3, slots)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+    ordered = sorted(slots)
+    manager.shutdown()
+    gaps = [later - earlier for earlier, later in zip(ordered, ordered[1:])]
+    print(f"Gaps between slots: {gaps}")
+    # Six slots at least 0.1s apart, no matter which process took them
+    assert len(ordered) == 6
+    assert all(gap > 0.09 for gap in gaps)
+    print("✅ SharedRateLimiter test passed")
+
+
+def test_batch_ordered_and_rate_limited():
+    """Test sharding across workers, ordered output, errors, post-processing and the shared rate limit"""
+    print("=== Testing run_batch ===")
+    server = EchoServer()
+    server.start_thread()
+    try:
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = server.api_base
+        records = [{"prompt": f"item {i}", "id": f"r{i}"} for i in range(6)]
+        records.insert(3, {"prompt": "fail"})
+        env = {"IONET": "test-key", "IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}
+        with patch.dict(os.environ, env):
+            start = time.time()
+            results = list(run_batch(model, records, workers=3, rpm=1200, post_process="test_batch:word_count"))
+            elapsed = time.time() - start
+    finally:
+        server.stop_thread()
+
+    print(f"Finished in {elapsed:.2f}s")
+    assert [result["index"] for result in results] == list(range(7))
+    assert results[0] == {"index": 0, "id": "r0", "response": "echo item 0",
+                          "output": {"words": 3, "pid": results[0]["output"]["pid"]}}
+    assert "error" in results[3] and "400" in results[3]["error"]
+    assert len({result["output"]["pid"] for result in results if "output" in result}) > 1
+    # 7 requests at 20 per second across all workers
+    arrivals = sorted(server.arrivals)
+    assert arrivals[-1] - arrivals[0] >= 0.25
+    print("✅ run_batch test passed")
+
+
+if __name__ == "__main__":
+    test_shared_limiter_across_processes()
+    test_batch_ordered_and_rate_limited()
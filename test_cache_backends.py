@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Test script for the pluggable cache backends and the response and catalog caches
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import IOIntelligenceModel, MemoryCache, RedisCache, SQLiteCache, close_sessions
+from mock_server import MockServer
+
+
+class FakeRedis:
+    """Minimal Redis stand-in speaking RESP: PING, AUTH, SELECT, GET, SET (NX/PX) and DEL"""
+
+    def __init__(self):
+        self.data = {}
+        self.port = None
+        self.commands = []
+        self._ready = threading.Event()
+        self._loop = None
+        self._server = None
+        self._clients = []
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        assert self._ready.wait(5)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._client, "127.0.0.1", 0))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        async def shutdown():
+            self._server.close()
+            for task in self._clients:
+                task.cancel()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _client(self, reader, writer):
+        self._clients.append(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:-2])):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self._execute(args))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _execute(self, args):
+        command = args[0].decode().upper()
+        self.commands.append(command)
+        if command in ("PING", "AUTH", "SELECT"):
+            return b"+OK\r\n"
+        key = args[1]
+        entry = self.data.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            entry = None
+        if command == "GET":
+            return b"$-1\r\n" if entry is None else b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0])
+        if command == "DEL":
+            return b":%d\r\n" % (1 if self.data.pop(key, None) else 0)
+        if command == "SET":
+            options = [arg.decode().upper() for arg in args[3:]]
+            if "NX" in options and entry is not None:
+                return b"$-1\r\n"
+            expires = None
+            if "PX" in options:
+                expires = time.monotonic() + int(options[options.index("PX") + 1]) / 1000
+            self.data[key] = (args[2], expires)
+            return b"+OK\r\n"
+        return b"-ERR unknown command\r\n"
+
+
+def test_memory_cache():
+    """Test LRU eviction, TTL expiry and compression of large values"""
+    print("=== Testing MemoryCache ===")
+    cache = MemoryCache(max_items=2)
+    cache.set("a", b"1")
+    cache.set("b", b"2")
+    assert cache.get("a") == b"1"
+    cache.set("c", b"3")
+    # "b" was least recently used
+    assert cache.get("b") is None and cache.get("a") == b"1" and cache.get("c") == b"3"
+
+    cache.set("short", b"x", ttl=0.05)
+    time.sleep(0.1)
+    assert cache.get("short") is None
+
+    large = b"repetitive " * 1000
+    cache.set("large", large)
+    assert cache._get("large")[:1] == b"z" and len(cache._get("large")) < len(large) / 10
+    assert cache.get("large") == large
+
+    # _add is the stampede lock: of several racing threads exactly one may win
+    class SlowCheck(MemoryCache):
+        def _live(self, key):
+            time.sleep(0.001)
+            return super()._live(key)
+
+    racing = SlowCheck()
+    barrier = threading.Barrier(8)
+    wins = []
+
+    def claim():
+        barrier.wait()
+        wins.extend(key for key in ("k1", "k2", "k3") if racing._add(key, b"1", 10))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(wins) == ["k1", "k2", "k3"], wins
+    print("✅ MemoryCache test passed")
+
+
+def test_sqlite_cache():
+    """Test sharing through a file, size-based eviction and TTLs"""
+    print("=== Testing SQLiteCache ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.db")
+        with patch.dict(os.environ, {"IONET_CACHE_COMPRESS_MIN": "100000"}):
+            writer = SQLiteCache(path, max_bytes=2500)
+            reader = SQLiteCache(path, max_bytes=2500)
+            writer.set("first", b"a" * 1000)
+            time.sleep(0.01)
+            writer.set("second", b"b" * 1000)
+            assert reader.get("first") == b"a" * 1000
+            time.sleep(0.01)
+            writer.set("third", b"c" * 1000)
+            # "second" was least recently used once the file went over 2500 bytes
+            assert reader.get("second") is None
+            assert reader.get("first") and reader.get("third")
+
+            writer.set("expiring", b"x", ttl=0.05)
+            time.sleep(0.1)
+            assert reader.get("expiring") is None
+            assert writer._add("lock", b"1", 10) and not reader._add("lock", b"1", 10)
+    print("✅ SQLiteCache test passed")
+
+
+def test_redis_cache_and_stampede():
+    """Test the RESP client against a stand-in server and stampede protection across clients"""
+    print("=== Testing RedisCache ===")
+    server = FakeRedis()
+    server.start()
+    try:
+        url = f"redis://:secret@127.0.0.1:{server.port}/2"
+        host_a, host_b = RedisCache(url), RedisCache(url)
+        host_a.set("greeting", b"hello", ttl=30)
+        assert host_b.get("greeting") == b"hello"
+        assert b"ionet:greeting" in server.data
+        host_b.delete("greeting")
+        assert host_a.get("greeting") is None
+        assert server.commands[:2] == ["AUTH", "SELECT"]
+
+        computed = []
+
+        async def compute():
+            computed.append(1)
+            await asyncio.sleep(0.2)
+            return b"expensive"
+
+        async def many():
+            return await asyncio.gather(*[
+                cache.get_or_compute("slow", compute, ttl=30) for cache in (host_a, host_b) * 3
+            ])
+
+        results = asyncio.run(many())
+        host_a.close()
+        host_b.close()
+        assert results == [b"expensive"] * 6
+        assert len(computed) == 1
+        assert b"ionet:slow:lock" not in server.data
+    finally:
+        server.stop()
+    print("✅ RedisCache test passed")
+
+
+def test_response_and_catalog_caches():
+    """Test that identical requests are answered from the cache in both modes and catalogs are cached"""
+    print("=== Testing response and catalog caches ===")
+    requests = []
+
+    async def handler(request):
+        requests.append(await request.json())
+        usage = {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}
+        return web.json_response({"choices": [{"message": {"content": "cached answer"}}], "usage": usage})
+
+    async def run():
+        async with MockServer({"POST /api/v1/chat/completions": handler}) as server:
+            try:
+                model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+                model.api_base = server.api_base
+                prompt = SimpleNamespace(prompt="Hello", attachments=[], tools=[])
+                first = [r async for r in model.execute_async_with_tools(prompt, get_env_var=lambda n: "k", stream=False)]
+                second = [r async for r in model.execute_async_with_tools(prompt, get_env_var=lambda n: "k", stream=False)]
+                streamed = [c async for c in model.execute_async_with_tools(prompt, get_env_var=lambda n: "k", stream=True)]
+                return first[0], second[0], streamed
+            finally:
+                await close_sessions()
+
+    env = {"IONET_RESPONSE_CACHE_TTL": "60", "IONET_CACHE": "memory", "IONET_USAGE_LEDGER": "0"}
+    with patch.dict(os.environ, env):
+        llm_io_intelligence._caches.clear()
+        first, second, streamed = asyncio.run(run())
+
+        fetches = []
+
+        async def fake_catalog(api_key):
+            fetches.append(api_key)
+            return [("ionet/a", "org/a", 32000)]
+
+        with patch.object(llm_io_intelligence, "_fetch_model_catalog", fake_catalog):
+            catalogs = [asyncio.run(llm_io_intelligence.fetch_available_models("key")) for _ in range(2)]
+            # Another API base has its own catalog
+            with patch.dict(os.environ, {"IONET_API_BASE": "http://127.0.0.1:9/api/v1/"}):
+                api_base = llm_io_intelligence.get_api_base()
+                asyncio.run(llm_io_intelligence.fetch_available_models("key"))
+        llm_io_intelligence._caches.clear()
+
+    assert len(requests) == 1
+    assert first["content"] == second["content"] == "cached answer"
+    # Cache hits cost no tokens
+    assert first["usage"].total == 4 and "usage" not in second
+    assert streamed == ["cached answer"]
+    assert catalogs == [[("ionet/a", "org/a", 32000)]] * 2
+    assert fetches == ["key", "key"] and api_base == "http://127.0.0.1:9/api/v1"
+    print("✅ response and catalog cache test passed")
+
+
+if __name__ == "__main__":
+    test_memory_cache()
+    test_sqlite_cache()
+    test_redis_cache_and_stampede()
+    test_response_and_catalog_caches()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test script for coalescing streamed deltas into fewer, larger chunks
+"""
+import os
+import sys
+import time
+import asyncio
+from unittest.mock import patch
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_io_intelligence import ChoiceChunk, IOIntelligenceModel, TokenUsage, coalesce_stream
+from mock_server import MockServer, delta, stream_response
+
+
+async def timed_source(events):
+    """Yield (delay, item) pairs after sleeping for each delay"""
+    for delay, item in events:
+        await asyncio.sleep(delay)
+        yield item
+
+
+async def collect(events, window=0.05, max_bytes=1024):
+    start = time.monotonic()
+    received = []
+    async for chunk in coalesce_stream(timed_source(events), window, max_bytes):
+        received.append((chunk, time.monotonic() - start))
+    return received
+
+
+def test_first_token_and_window():
+    """Test that the first delta is immediate and the rest are merged per window"""
+    print("=== Testing coalescing window ===")
+    events = [(0.0, "Hel")] + [(0.005, c) for c in "lo world"] + [(0.15, "!")] + [(0.0, TokenUsage(total_tokens=3))]
+    received = asyncio.run(collect(events))
+    chunks = [chunk for chunk, _ in received]
+    print(f"Chunks: {chunks}")
+    assert chunks[0] == "Hel" and received[0][1] < 0.03
+    assert "".join(c for c in chunks if isinstance(c, str)) == "Hello world!"
+    # "lo world" arrives within one window and is flushed when the pause starts, before "!"
+    assert chunks[1] == "lo world"
+    assert received[1][1] < 0.15
+    assert chunks[2] == "!" and isinstance(chunks[3], TokenUsage)
+    print("✅ coalescing window test passed")
+
+
+def test_byte_budget_and_choices():
+    """Test the byte budget and that different choices and non-text items are kept apart"""
+    print("=== Testing byte budget and choices ===")
+    events = [(0.0, "a")] + [(0.0, "x" * 10)] * 5 + [(0.0, ChoiceChunk("p", 1)), (0.0, "b"), (0.0, ChoiceChunk("q", 1))]
+    chunks = [chunk for chunk, _ in asyncio.run(collect(events, window=10, max_bytes=25))]
+    print(f"Chunks: {chunks}")
+    # 30 bytes went over the 25 byte budget; the rest is flushed at the end, one chunk per choice
+    assert chunks == ["a", "x" * 30, "x" * 20 + "b", "pq"]
+    assert chunks[3].index == 1 and not isinstance(chunks[2], ChoiceChunk)
+    print("✅ byte budget and choices test passed")
+
+
+def test_llm_stream_is_coalesced():
+    """Test that an llm response receives fewer chunks with the same text"""
+    print("=== Testing coalesced llm stream ===")
+    words = [f"w{i} " for i in range(40)]
+
+    async def handler(request):
+        return await stream_response(request, [delta(word) for word in words], delay=0.002)
+
+    with MockServer({"POST /api/v1/chat/completions": handler}) as server:
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = server.api_base
+        env = {"IONET": "test-key", "IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}
+        with patch.dict(os.environ, env):
+            plain = list(model.prompt("hi", stream=True))
+        with patch.dict(os.environ, dict(env, IONET_COALESCE_MS="50")):
+            coalesced = list(model.prompt("hi", stream=True))
+
+    print(f"{len(plain)} chunks without coalescing, {len(coalesced)} with")
+    assert "".join(plain) == "".join(coalesced) == "".join(words)
+    assert coalesced[0] == "w0 "
+    assert len(coalesced) < len(plain) / 4
+    print("✅ coalesced llm stream test passed")
+
+
+if __name__ == "__main__":
+    test_first_token_and_window()
+    test_byte_budget_and_choices()
+    test_llm_stream_is_coalesced()
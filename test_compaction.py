@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Test script for automatic conversation compaction
+"""
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import llm
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import ConversationCompactor, IOIntelligenceModel, estimate_tokens
+
+
+def make_response(prompt, text, tool_calls=None, tool_results=None):
+    return SimpleNamespace(
+        prompt=SimpleNamespace(prompt=prompt, system=None, tool_results=tool_results or []),
+        text=lambda: text,
+        tool_calls=lambda: tool_calls or [],
+    )
+
+
+def make_conversation(turns):
+    responses = [make_response(f"question {i} " + "x" * 400, f"answer {i} " + "y" * 400) for i in range(turns)]
+    return SimpleNamespace(id="conv-1", responses=responses)
+
+
+def test_short_history_is_untouched():
+    """Test that conversations under the threshold are sent verbatim"""
+    print("=== Testing below-threshold history ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        compactor = ConversationCompactor(os.path.join(tmp, "c.db"), threshold=100000, summarize=lambda text: "S")
+        turns = [[{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]]
+        system, history = compactor.compact("conv", "sys", turns)
+        assert system == "sys"
+        assert history == turns[0]
+        assert compactor.latest("conv") == (0, None)
+    print("✅ below-threshold test passed")
+
+
+def test_background_compaction():
+    """Test that older turns are summarized in the background and replaced on later turns"""
+    print("=== Testing background compaction ===")
+    transcripts = []
+
+    def summarize(text):
+        transcripts.append(text)
+        return "The user asked numbered questions."
+
+    model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+    conversation = make_conversation(8)
+    full_size = estimate_tokens(model.build_messages(SimpleNamespace(prompt="next", system="Be brief"), conversation))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {"IONET_COMPACT_TOKENS": "500", "IONET_COMPACT_KEEP_TURNS": "2", "IONET_COMPACT_DB": os.path.join(tmp, "c.db")}
+        with patch.dict(os.environ, env):
+            llm_io_intelligence._compactor = None
+            compactor = llm_io_intelligence.get_compactor()
+            compactor.summarize = summarize
+
+            # The turn that crosses the threshold is sent in full while the summary is produced
+            first = model.build_messages(SimpleNamespace(prompt="next", system="Be brief"), conversation)
+            assert estimate_tokens(first) == full_size
+            compactor.wait(5)
+            assert compactor.latest("conv-1")[0] == 6
+            assert "question 0" in transcripts[0] and "question 6" not in transcripts[0]
+
+            second = model.build_messages(SimpleNamespace(prompt="next", system="Be brief"), conversation)
+        llm_io_intelligence._compactor = None
+
+    print(f"Tokens before: {full_size}, after: {estimate_tokens(second)}")
+    assert second[0]["role"] == "system"
+    assert second[0]["content"].startswith("Be brief\n\nSummary of the earlier conversation:")
+    # Only the two most recent turns and the new prompt follow the summary
+    assert [message["content"][:10] for message in second[1:]] == [
+        "question 6", "answer 6 y", "question 7", "answer 7 y", "next",
+    ]
+    assert estimate_tokens(second) < full_size / 2
+    print("✅ background compaction test passed")
+
+
+def test_tool_turns_stay_verbatim():
+    """Test that turns with tool calls and results are never summarized away"""
+    print("=== Testing tool turns are kept ===")
+    model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+    conversation = make_conversation(6)
+    conversation.responses[1] = make_response(
+        "what is 2+2", "", tool_calls=[llm.ToolCall(name="calc", arguments={"expr": "2+2"}, tool_call_id="call-1")],
+    )
+    conversation.responses[2] = make_response(
+        "", "It is 4 " + "z" * 400, tool_results=[llm.ToolResult(name="calc", output="4", tool_call_id="call-1")],
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        compactor = ConversationCompactor(os.path.join(tmp, "c.db"), threshold=200, keep_turns=2,
+                                          summarize=lambda text: "Summary.")
+        with patch.object(llm_io_intelligence, "get_compactor", return_value=compactor):
+            model.build_messages(SimpleNamespace(prompt="next"), conversation)
+            compactor.wait(5)
+            messages = model.build_messages(SimpleNamespace(prompt="next"), conversation)
+
+    roles = [message["role"] for message in messages]
+    print(f"Roles: {roles}")
+    assert roles[0] == "system" and messages[0]["content"].endswith("Summary.")
+    assert {"role": "tool", "name": "calc", "content": "4", "tool_call_id": "call-1"} in messages
+    call_message = next(message for message in messages if message.get("tool_calls"))
+    assert call_message["tool_calls"][0]["function"] == {"name": "calc", "arguments": '{"expr": "2+2"}'}
+    assert not any("question 0" in (message["content"] or "") for message in messages)
+    print("✅ tool turns test passed")
+
+
+if __name__ == "__main__":
+    test_short_history_is_untouched()
+    test_background_compaction()
+    test_tool_turns_stay_verbatim()
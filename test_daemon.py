@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Test script for the warm daemon and its thin Unix socket client
+"""
+import io
+import os
+import sys
+import socket
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import click
+from click.testing import CliRunner
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ionet_client
+import llm_io_intelligence
+from llm_io_intelligence import Gateway, IOIntelligenceModel, close_sessions
+from mock_server import MockServer, delta, stream_response
+
+
+def cli():
+    @click.group()
+    def group():
+        pass
+
+    llm_io_intelligence.register_commands(group)
+    return group
+
+
+class DaemonFixture:
+    """Runs a fake io.net API and a gateway on a Unix socket in background loops"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.upstream_requests = []
+        self._upstream = MockServer({"POST /api/v1/chat/completions": self.upstream})
+        self._daemon = None
+
+    async def upstream(self, request):
+        self.upstream_requests.append(await request.json())
+        return await stream_response(request, [delta("warm "), delta("reply")])
+
+    def start(self):
+        self._upstream.start_thread()
+        model = IOIntelligenceModel("ionet/llama-3.3-70b", "meta-llama/Llama-3.3-70B-Instruct", 128000)
+        model.api_base = self._upstream.api_base
+        self._daemon = MockServer(Gateway([model]).app(), socket_path=self.socket_path).start_thread()
+
+    def stop(self):
+        self._daemon.stop_thread()
+        self._upstream.stop_thread()
+
+
+def test_daemon_round_trip():
+    """Test the thin client, request forwarding from the plugin and model listing via the daemon"""
+    print("=== Testing daemon round trip ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "ionet.sock")
+        daemon = DaemonFixture(socket_path)
+        env = {"IONET_DAEMON_SOCKET": socket_path, "IONET": "daemon-key", "IONET_USAGE_LEDGER": "0"}
+        with patch.dict(os.environ, env):
+            daemon.start()
+            try:
+                # The thin client needs neither llm nor an API key
+                assert ionet_client.list_models()[0]["id"] == "ionet/llama-3.3-70b"
+                messages = [{"role": "user", "content": "hi"}]
+                assert "".join(ionet_client.stream_chat(messages, "ionet/llama-3.3-70b")) == "warm reply"
+
+                # Without an explicit key the plugin forwards to the daemon instead of io.net
+                async def run_plugin():
+                    model = IOIntelligenceModel("ionet/llama-3.3-70b", "meta-llama/Llama-3.3-70B-Instruct", 128000)
+                    model.api_base = "http://127.0.0.1:9/unreachable"
+                    prompt = SimpleNamespace(prompt="hello", attachments=[], tools=[])
+                    try:
+                        return [chunk async for chunk in model.execute_async_with_tools(prompt, stream=True)]
+                    finally:
+                        await close_sessions()
+
+                chunks = asyncio.run(run_plugin())
+
+                # Registration asks the daemon instead of fetching from io.net
+                registered = []
+                with patch.object(llm_io_intelligence, "fetch_available_models", side_effect=AssertionError):
+                    llm_io_intelligence.register_models(registered.append)
+            finally:
+                daemon.stop()
+
+    assert chunks == ["warm ", "reply"]
+    assert [request["messages"][-1]["content"] for request in daemon.upstream_requests] == ["hi", "hello"]
+    assert [model.model_id for model in registered][:1] == ["ionet/llama-3.3-70b"]
+    print("✅ daemon round trip test passed")
+
+
+def test_client_without_daemon():
+    """Test that the thin client fails cleanly and the plugin ignores a missing daemon"""
+    print("=== Testing missing daemon ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "missing.sock")
+        with patch.dict(os.environ, {"IONET_DAEMON_SOCKET": socket_path}):
+            assert llm_io_intelligence.daemon_socket() is None
+            stderr = io.StringIO()
+            with patch.object(sys, "stderr", stderr), patch.object(sys, "stdin", io.StringIO("")):
+                assert ionet_client.main(["hello"]) == 1
+    assert "llm ionet daemon" in stderr.getvalue()
+    print("✅ missing daemon test passed")
+
+
+def test_socket_location_and_ownership():
+    """Test the private fallback directory and that other users' sockets are refused"""
+    print("=== Testing socket location and ownership ===")
+    env = {key: value for key, value in os.environ.items() if key not in ("XDG_RUNTIME_DIR", "IONET_DAEMON_SOCKET")}
+    with tempfile.TemporaryDirectory() as tmp:
+        with patch.dict(os.environ, env, clear=True), patch.object(tempfile, "tempdir", tmp):
+            default = ionet_client.default_socket_path()
+            private = ionet_client.private_socket_dir(os.path.dirname(default))
+            mode = os.stat(private).st_mode & 0o777
+        shared = os.path.join(tmp, "shared")
+        os.mkdir(shared, 0o755)
+        os.chmod(shared, 0o755)
+        try:
+            ionet_client.private_socket_dir(shared)
+        except ionet_client.UntrustedSocketError:
+            pass
+        else:
+            raise AssertionError("Expected a group/world accessible directory to be refused")
+
+        # A socket another user created in our place
+        socket_path = os.path.join(tmp, "squatted.sock")
+        squatter = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        squatter.bind(socket_path)
+        squatter.listen()
+        try:
+            with patch.dict(os.environ, {"IONET_DAEMON_SOCKET": socket_path}):
+                assert llm_io_intelligence.daemon_socket() == socket_path
+                with patch.object(ionet_client, "_uid", return_value=os.getuid() + 1):
+                    assert llm_io_intelligence.daemon_socket() is None
+                    try:
+                        ionet_client.list_models()
+                    except ionet_client.UntrustedSocketError:
+                        pass
+                    else:
+                        raise AssertionError("Expected the squatted socket to be refused")
+                    result = CliRunner().invoke(cli(), ["ionet", "daemon"])
+        finally:
+            squatter.close()
+
+    assert default == os.path.join(tmp, f"ionet-{os.getuid()}", "daemon.sock")
+    assert mode == 0o700
+    assert result.exit_code != 0 and "not a socket owned by you" in result.output
+    print("✅ socket location and ownership test passed")
+
+
+def test_daemon_socket_permissions():
+    """Test that the daemon's socket is 0600 without changing the process umask"""
+    print("=== Testing daemon socket permissions ===")
+    seen = {}
+
+    def run_app(app, sock, print=None):
+        seen["mode"] = os.stat(sock.getsockname()).st_mode & 0o777
+        seen["umask"] = os.umask(0o022)
+        os.umask(seen["umask"])
+        sock.close()
+
+    model = IOIntelligenceModel("ionet/llama-3.3-70b", "meta-llama/Llama-3.3-70B-Instruct", 128000)
+    previous = os.umask(0o022)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            socket_path = os.path.join(tmp, "ionet.sock")
+            with patch("aiohttp.web.run_app", run_app), patch.object(llm_io_intelligence.llm, "get_models", return_value=[model]):
+                result = CliRunner().invoke(cli(), ["ionet", "daemon", "--socket", socket_path])
+            left_behind = os.path.exists(socket_path)
+    finally:
+        os.umask(previous)
+
+    assert result.exit_code == 0, result.output
+    assert seen == {"mode": 0o600, "umask": 0o022}
+    assert not left_behind
+    print("✅ daemon socket permissions test passed")
+
+
+if __name__ == "__main__":
+    test_daemon_round_trip()
+    test_client_without_daemon()
+    test_socket_location_and_ownership()
+    test_daemon_socket_permissions()
@@ -4,6 +4,12 @@ import urllib.parse
 import urllib.error
 from datetime import datetime
 
+try:
+    # Fetches show up as spans in the plugin's traces (IONET_TRACE_FILE)
+    from llm_io_intelligence import traced_urlopen as _urlopen
+except ImportError:
+    from urllib.request import urlopen as _urlopen
+
 def api_request(url: str, operation: str = "get", **kwargs) -> str:
     """
     Advanced API interaction tools for REST APIs and web services.
@@ -83,7 +89,7 @@ def _api_get(url: str, **kwargs) -> str:
     try:
         req = urllib.request.Request(url, headers=headers, method='GET')
         
-        with urllib.request.urlopen(req, timeout=timeout) as response:
+        with _urlopen(req, timeout=timeout) as response:
             status_code = response.getcode()
             response_headers = dict(response.headers)
             content = response.read().decode('utf-8')
@@ -149,7 +155,7 @@ def _api_post(url: str, **kwargs) -> str:
     try:
         req = urllib.request.Request(url, data=post_data, headers=headers, method='POST')
         
-        with urllib.request.urlopen(req, timeout=timeout) as response:
+        with _urlopen(req, timeout=timeout) as response:
             status_code = response.getcode()
             response_headers = dict(response.headers)
             content = response.read().decode('utf-8')
@@ -207,7 +213,7 @@ def _api_delete(url: str, **kwargs) -> str:
     try:
         req = urllib.request.Request(url, headers=headers, method='DELETE')
         
-        with urllib.request.urlopen(req, timeout=timeout) as response:
+        with _urlopen(req, timeout=timeout) as response:
             status_code = response.getcode()
             response_headers = dict(response.headers)
             content = response.read().decode('utf-8')
@@ -343,7 +349,7 @@ def _headers_analyze(url: str, **kwargs) -> str:
         req = urllib.request.Request(url, method='HEAD')
         req.add_header('User-Agent', 'LLM-Agent/1.0 (Header Analyzer)')
         
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with _urlopen(req, timeout=10) as response:
             headers = dict(response.headers)
             
             # Analyze security headers
@@ -400,7 +406,7 @@ def _api_test(url: str, **kwargs) -> str:
             req = urllib.request.Request(test_url, method='GET')
             req.add_header('User-Agent', 'LLM-Agent/1.0 (API Tester)')
             
-            with urllib.request.urlopen(req, timeout=5) as response:
+            with _urlopen(req, timeout=5) as response:
                 status_code = response.getcode()
                 content_type = response.headers.get('Content-Type', 'unknown')
                 content = response.read(1000).decode('utf-8', errors='ignore')
@@ -4,6 +4,12 @@ import urllib.parse
 import urllib.error
 import re
 
+try:
+    # Fetches show up as spans in the plugin's traces (IONET_TRACE_FILE)
+    from llm_io_intelligence import traced_urlopen as _urlopen
+except ImportError:
+    from urllib.request import urlopen as _urlopen
+
 def ddg_search(query: str, num_results: int = 10) -> str:
     """
     Search DuckDuckGo HTML directly for real search results.
@@ -29,7 +35,7 @@ def ddg_search(query: str, num_results: int = 10) -> str:
         req.add_header('Connection', 'keep-alive')
         req.add_header('Upgrade-Insecure-Requests', '1')
         
-        with urllib.request.urlopen(req, timeout=15) as response:
+        with _urlopen(req, timeout=15) as response:
             content = response.read()
             
             # Handle gzip encoding if present
@@ -182,7 +188,7 @@ def curl_get(url: str, headers: dict = None) -> str:
         for key, value in default_headers.items():
             req.add_header(key, value)
         
-        with urllib.request.urlopen(req, timeout=15) as response:
+        with _urlopen(req, timeout=15) as response:
             status_code = response.getcode()
             response_headers = dict(response.headers)
             content = response.read()
@@ -11,6 +11,12 @@ import re
 import time
 import html
 
+try:
+    # Fetches show up as spans in the plugin's traces (IONET_TRACE_FILE)
+    from llm_io_intelligence import traced_urlopen as _urlopen
+except ImportError:
+    from urllib.request import urlopen as _urlopen
+
 def mega_research(topic: str, max_operations: int = 55, research_depth: str = "comprehensive") -> str:
     """
     Performs 55+ research operations in a single function call for any topic
@@ -231,7 +237,7 @@ def _ddg_search_improved(query: str, num_results: int = 5) -> dict:
         }
         
         req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with _urlopen(req, timeout=10) as response:
             html_content = response.read().decode('utf-8', errors='ignore')
         
         # Extract results from lite version
@@ -375,7 +381,7 @@ def _extract_with_readability(url: str) -> str:
     }
     
     req = urllib.request.Request(url, headers=headers)
-    with urllib.request.urlopen(req, timeout=15) as response:
+    with _urlopen(req, timeout=15) as response:
         html_content = response.read().decode('utf-8', errors='ignore')
     
     # Extract main content areas
@@ -414,7 +420,7 @@ def _extract_with_newspaper(url: str) -> str:
     }
     
     req = urllib.request.Request(url, headers=headers)
-    with urllib.request.urlopen(req, timeout=10) as response:
+    with _urlopen(req, timeout=10) as response:
         html_content = response.read().decode('utf-8', errors='ignore')
     
     # Look for common news article structures
@@ -446,7 +452,7 @@ def _extract_basic_content(url: str) -> str:
     }
     
     req = urllib.request.Request(url, headers=headers)
-    with urllib.request.urlopen(req, timeout=8) as response:
+    with _urlopen(req, timeout=8) as response:
         content = response.read().decode('utf-8', errors='ignore')
         
     # Extract all paragraphs
@@ -466,7 +472,7 @@ def _extract_basic_content(url: str) -> str:
 def _extract_text_content(url: str) -> str:
     """Simple text extraction"""
     req = urllib.request.Request(url)
-    with urllib.request.urlopen(req, timeout=5) as response:
+    with _urlopen(req, timeout=5) as response:
         content = response.read().decode('utf-8', errors='ignore')
         
     # Remove script and style elements
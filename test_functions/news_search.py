@@ -4,6 +4,12 @@ import urllib.parse
 import urllib.error
 import re
 
+try:
+    # Fetches show up as spans in the plugin's traces (IONET_TRACE_FILE)
+    from llm_io_intelligence import traced_urlopen as _urlopen
+except ImportError:
+    from urllib.request import urlopen as _urlopen
+
 def search_news(query: str, source: str = "all") -> str:
     """
     Search for current news by fetching content from major news websites.
@@ -61,7 +67,7 @@ def _fetch_news_from_source(source_info, query):
         req = urllib.request.Request(source_info["url"])
         req.add_header('User-Agent', 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36')
         
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with _urlopen(req, timeout=10) as response:
             content = response.read(1024 * 512).decode('utf-8', errors='ignore')  # 512KB limit
             
             # Extract headlines and links
@@ -157,7 +163,7 @@ def fetch_article(url: str) -> str:
         req = urllib.request.Request(url)
         req.add_header('User-Agent', 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36')
         
-        with urllib.request.urlopen(req, timeout=15) as response:
+        with _urlopen(req, timeout=15) as response:
             content = response.read(1024 * 1024).decode('utf-8', errors='ignore')  # 1MB limit
             
             # Extract title
@@ -232,7 +238,7 @@ def get_trending_topics() -> str:
         req = urllib.request.Request(trending_url)
         req.add_header('User-Agent', 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36')
         
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with _urlopen(req, timeout=10) as response:
             content = response.read().decode('utf-8', errors='ignore')
             
             # Extract trending topics from RSS
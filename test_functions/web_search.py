@@ -4,6 +4,12 @@ import urllib.parse
 import urllib.error
 import re
 
+try:
+    # Fetches show up as spans in the plugin's traces (IONET_TRACE_FILE)
+    from llm_io_intelligence import traced_urlopen as _urlopen
+except ImportError:
+    from urllib.request import urlopen as _urlopen
+
 def web_search(query: str, num_results: int = 5) -> str:
     """
     Search the web for current information using DuckDuckGo Instant Answer API.
@@ -23,7 +29,7 @@ def web_search(query: str, num_results: int = 5) -> str:
         req = urllib.request.Request(url)
         req.add_header('User-Agent', 'LLM-Agent/1.0 (Web Search)')
         
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with _urlopen(req, timeout=10) as response:
             content = response.read().decode('utf-8')
             data = json.loads(content)
             
@@ -98,7 +104,7 @@ def fetch_url(url: str, extract_text: bool = True) -> str:
         req = urllib.request.Request(url)
         req.add_header('User-Agent', 'LLM-Agent/1.0 (URL Fetcher)')
         
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with _urlopen(req, timeout=10) as response:
             status_code = response.getcode()
             content_type = response.headers.get('Content-Type', 'unknown')
             content = response.read(1024 * 1024).decode('utf-8', errors='ignore')  # 1MB limit
@@ -159,7 +165,7 @@ def check_url_status(url: str) -> str:
         import time
         start_time = time.time()
         
-        with urllib.request.urlopen(req, timeout=5) as response:
+        with _urlopen(req, timeout=5) as response:
             end_time = time.time()
             response_time = end_time - start_time
             
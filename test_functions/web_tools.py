@@ -4,6 +4,12 @@ import urllib.parse
 import urllib.error
 import re
 
+try:
+    # Fetches show up as spans in the plugin's traces (IONET_TRACE_FILE)
+    from llm_io_intelligence import traced_urlopen as _urlopen
+except ImportError:
+    from urllib.request import urlopen as _urlopen
+
 
 def web_request(url: str, method: str = "GET", **kwargs) -> str:
     """
@@ -67,7 +73,7 @@ def _http_request(url: str, method: str = "GET", **kwargs) -> str:
         req = urllib.request.Request(url, data=data, headers=headers, method=method.upper())
         
         # Make request
-        with urllib.request.urlopen(req, timeout=timeout) as response:
+        with _urlopen(req, timeout=timeout) as response:
             # Get response info
             status_code = response.getcode()
             response_headers = dict(response.headers)
@@ -246,7 +252,7 @@ def _check_status(url: str, **kwargs) -> str:
         req = urllib.request.Request(url, method='HEAD')
         req.add_header('User-Agent', 'LLM-Agent/1.0 (Status Checker)')
         
-        with urllib.request.urlopen(req, timeout=timeout) as response:
+        with _urlopen(req, timeout=timeout) as response:
             return json.dumps({
                 "url": url,
                 "status": "accessible",
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Test script for the OpenAI-compatible local gateway
+"""
+import os
+import sys
+import asyncio
+import tempfile
+from unittest.mock import patch
+
+import aiohttp
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import Gateway, IOIntelligenceModel, IORouterModel, SemanticCache, UsageLedger
+from mock_server import MockServer, delta, stream_response
+
+
+class Upstream:
+    """Stand-in for the io.net chat completions API"""
+
+    def __init__(self, failing_models=()):
+        self.failing_models = set(failing_models)
+        self.requests = []
+
+    async def handler(self, request):
+        body = await request.json()
+        self.requests.append(body)
+        if body["model"] in self.failing_models:
+            return web.json_response({"error": "overloaded"}, status=503)
+        usage = {"prompt_tokens": 7, "completion_tokens": 2, "total_tokens": 9}
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": f"reply from {body['model']}"}
+            return web.json_response({"model": body["model"], "choices": [{"message": message}], "usage": usage})
+        return await stream_response(request, [delta("Hel"), delta("lo"), {"choices": [], "usage": usage}])
+
+
+async def with_gateway(upstream, models, check, token=None):
+    async with MockServer({"POST /api/v1/chat/completions": upstream.handler}) as upstream_server:
+        for model in models:
+            for backend in getattr(model, "backends", [model]):
+                backend.api_base = upstream_server.api_base
+        async with MockServer(Gateway(models, token).app()) as gateway:
+            async with aiohttp.ClientSession() as client:
+                return await check(client, gateway.url)
+
+
+def test_models_and_completions():
+    """Test model listing, plain and streamed completions, and usage accounting"""
+    print("=== Testing gateway completions ===")
+    upstream = Upstream()
+    model = IOIntelligenceModel("ionet/llama-3.3-70b", "meta-llama/Llama-3.3-70B-Instruct", 128000)
+
+    async def check(client, url):
+        async with client.get(f"{url}/v1/models") as response:
+            models = await response.json()
+        async with client.post(f"{url}/v1/chat/completions", json={
+            "model": "ionet/llama-3.3-70b", "messages": [{"role": "user", "content": "hi"}],
+        }) as response:
+            completion = await response.json()
+        async with client.post(f"{url}/v1/chat/completions", json={
+            "model": "meta-llama/Llama-3.3-70B-Instruct", "stream": True,
+            "messages": [{"role": "user", "content": "hi"}],
+        }) as response:
+            assert response.headers["Content-Type"].startswith("text/event-stream")
+            streamed = (await response.read()).decode()
+        async with client.post(f"{url}/v1/chat/completions", json={
+            "model": "ionet/unknown", "messages": [{"role": "user", "content": "hi"}],
+        }) as response:
+            unknown_status = response.status
+        return models, completion, streamed, unknown_status
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "usage.db")
+        with patch.dict(os.environ, {"IONET": "test-key", "IONET_USAGE_DB": db}):
+            models, completion, streamed, unknown_status = asyncio.run(with_gateway(upstream, [model], check))
+        summary = UsageLedger(db).summary()
+
+    assert models["data"][0]["id"] == "ionet/llama-3.3-70b"
+    assert completion["choices"][0]["message"]["content"] == "reply from meta-llama/Llama-3.3-70B-Instruct"
+    assert '"Hel"' in streamed and streamed.rstrip().endswith("data: [DONE]")
+    assert unknown_status == 404
+    assert all(request["model"] == "meta-llama/Llama-3.3-70B-Instruct" for request in upstream.requests)
+    assert summary[0]["requests"] == 2 and summary[0]["total_tokens"] == 18
+    print("✅ gateway completions test passed")
+
+
+def test_router_failover_and_auth():
+    """Test that the router fails over to a healthy backend and the gateway token is enforced"""
+    print("=== Testing gateway router and auth ===")
+    broken = IOIntelligenceModel("ionet/llama-3.3-70b", "meta-llama/Llama-3.3-70B-Instruct", 128000)
+    working = IOIntelligenceModel("ionet/qwen3-235b", "Qwen/Qwen3-235B-A22B-FP8", 32000)
+    router = IORouterModel([broken, working])
+    upstream = Upstream(failing_models={broken.full_model_name})
+    body = {"model": "ionet/router", "messages": [{"role": "user", "content": "hi"}]}
+
+    async def check(client, url):
+        async with client.post(f"{url}/v1/chat/completions", json=body) as response:
+            unauthorized = response.status
+        headers = {"Authorization": "Bearer secret"}
+        async with client.post(f"{url}/v1/chat/completions", json=body, headers=headers) as response:
+            return unauthorized, await response.json()
+
+    with patch.dict(os.environ, {"IONET": "test-key", "IONET_USAGE_LEDGER": "0"}):
+        unauthorized, completion = asyncio.run(with_gateway(upstream, [router], check, token="secret"))
+
+    assert unauthorized == 401
+    assert completion["choices"][0]["message"]["content"] == "reply from Qwen/Qwen3-235B-A22B-FP8"
+    assert router.stats[broken.model_id].consecutive_failures == 1
+    assert list(router.stats[working.model_id].ttfts)
+    print("✅ gateway router and auth test passed")
+
+
+def test_caches():
+    """Test that repeated and reworded requests are answered from the response and semantic caches"""
+    print("=== Testing gateway caches ===")
+    upstream = Upstream()
+    model = IOIntelligenceModel("ionet/llama-3.3-70b", "meta-llama/Llama-3.3-70B-Instruct", 128000)
+
+    def request(content, stream=False):
+        return {"model": "ionet/llama-3.3-70b", "stream": stream, "messages": [{"role": "user", "content": content}]}
+
+    async def check(client, url):
+        replies = []
+        for body in (request("hi"), request("hi"), request("hi", stream=True),
+                     request("hello", stream=True), request("hello", stream=True), request("hello")):
+            async with client.post(f"{url}/v1/chat/completions", json=body) as response:
+                replies.append(await response.text() if body["stream"] else await response.json())
+        return replies
+
+    env = {"IONET": "test-key", "IONET_USAGE_LEDGER": "0", "IONET_RESPONSE_CACHE_TTL": "60", "IONET_CACHE": "memory"}
+    with patch.dict(os.environ, env):
+        llm_io_intelligence._caches.clear()
+        replies = asyncio.run(with_gateway(upstream, [model], check))
+        llm_io_intelligence._caches.clear()
+
+    # Only the first request of each prompt reaches io.net, whether or not it was streamed
+    assert [body["messages"][0]["content"] for body in upstream.requests] == ["hi", "hello"]
+    first, cached, replayed, streamed, streamed_again, cached_stream = replies
+    assert cached["choices"][0]["message"]["content"] == first["choices"][0]["message"]["content"]
+    assert cached["choices"][0]["finish_reason"] == "stop" and "usage" not in cached
+    assert '"reply from meta-llama/Llama-3.3-70B-Instruct"' in replayed and replayed.rstrip().endswith("data: [DONE]")
+    assert '"Hel"' in streamed and '"Hello"' in streamed_again
+    assert cached_stream["choices"][0]["message"]["content"] == "Hello"
+
+    async def embed(text, api_key):
+        # Every prompt is a paraphrase of every other
+        return [1.0, 0.0]
+
+    upstream = Upstream()
+    with tempfile.TemporaryDirectory() as tmp:
+        semantic_cache = SemanticCache(os.path.join(tmp, "semantic.db"), ttl=60, embed=embed)
+        with patch.dict(os.environ, {"IONET": "test-key", "IONET_USAGE_LEDGER": "0"}), \
+                patch.object(llm_io_intelligence, "get_semantic_cache", lambda: semantic_cache):
+            replies = asyncio.run(with_gateway(upstream, [model], check))
+        hits = semantic_cache.hits()
+
+    assert len(upstream.requests) == 1
+    assert replies[1]["choices"][0]["message"]["content"] == "reply from meta-llama/Llama-3.3-70B-Instruct"
+    assert all('"reply from' in reply for reply in replies[2:5]) and replies[5]["choices"] == replies[1]["choices"]
+    assert len(hits) == 5
+    print("✅ gateway caches test passed")
+
+
+if __name__ == "__main__":
+    test_models_and_completions()
+    test_router_failover_and_auth()
+    test_caches()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Test script for generation options and the end-to-end request deadline
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_io_intelligence import DeadlineExceededError, IOIntelligenceModel, close_sessions
+from mock_server import MockServer, delta, sse
+
+
+class SlowUpstream(MockServer):
+    """Chat completions server that streams one chunk every `interval` seconds"""
+
+    def __init__(self, interval=0.0):
+        super().__init__({"POST /api/v1/chat/completions": self.handler})
+        self.interval = interval
+        self.requests = []
+        self.disconnected = threading.Event()
+
+    async def handler(self, request):
+        body = await request.json()
+        self.requests.append(body)
+        if not body.get("stream"):
+            await asyncio.sleep(self.interval * 10)
+            return web.json_response({"choices": [{"message": {"content": "done"}}]})
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            for i in range(10):
+                await response.write(delta(f"{i} "))
+                await asyncio.sleep(self.interval)
+            await response.write(sse("[DONE]"))
+        except ConnectionResetError:
+            self.disconnected.set()
+        except asyncio.CancelledError:
+            self.disconnected.set()
+            raise
+        return response
+
+
+
+def make_model(upstream):
+    model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+    model.api_base = upstream.api_base
+    return model
+
+
+def test_options_validation():
+    """Test option parsing and ranges"""
+    print("=== Testing Options validation ===")
+    Options = IOIntelligenceModel.Options
+    assert Options(stop="END").stop == ["END"]
+    assert Options(stop='["END", "STOP"]').stop == ["END", "STOP"]
+    assert Options(max_tokens="64").max_tokens == 64
+    for invalid in ({"temperature": 3}, {"top_p": 0}, {"max_tokens": 0}, {"deadline": -1}, {"unknown": 1}):
+        try:
+            Options(**invalid)
+        except ValueError:
+            continue
+        raise AssertionError(f"{invalid} should have been rejected")
+    print("✅ Options validation test passed")
+
+
+def test_options_reach_the_request():
+    """Test that options set with llm end up in the payload, and the deadline does not"""
+    print("=== Testing options in the request ===")
+    upstream = SlowUpstream()
+    upstream.start_thread()
+    env = {"IONET": "test-key", "IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}
+    try:
+        with patch.dict(os.environ, env):
+            model = make_model(upstream)
+            response = model.prompt("hi", stream=True, max_tokens=32, temperature=0.2, top_p=0.9,
+                                    stop='["\\n\\n"]', seed=7, presence_penalty=0.5, frequency_penalty=-0.5,
+                                    deadline=30)
+            text = response.text()
+    finally:
+        upstream.stop_thread()
+
+    body = upstream.requests[0]
+    assert text.startswith("0 1 2")
+    assert {key: body[key] for key in ("max_tokens", "temperature", "top_p", "stop", "seed")} == {
+        "max_tokens": 32, "temperature": 0.2, "top_p": 0.9, "stop": ["\n\n"], "seed": 7,
+    }
+    assert body["presence_penalty"] == 0.5 and body["frequency_penalty"] == -0.5
+    assert "deadline" not in body
+    print("✅ options in the request test passed")
+
+
+def test_deadline_cancels_requests():
+    """Test that streamed and non-streamed requests are cut off at the deadline"""
+    print("=== Testing request deadline ===")
+    upstream = SlowUpstream(interval=0.2)
+    upstream.start_thread()
+    env = {"IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}
+
+    async def run(stream):
+        model = make_model(upstream)
+        prompt = SimpleNamespace(prompt="hi", attachments=[], tools=[],
+                                 options=IOIntelligenceModel.Options(deadline=0.5))
+        received = []
+        start = time.monotonic()
+        try:
+            async for chunk in model.execute_async_with_tools(prompt, get_env_var=lambda n: "k", stream=stream):
+                received.append(chunk)
+        except DeadlineExceededError as e:
+            return received, time.monotonic() - start, str(e)
+        finally:
+            await close_sessions()
+        raise AssertionError("the deadline did not expire")
+
+    try:
+        with patch.dict(os.environ, env):
+            streamed, stream_elapsed, message = asyncio.run(run(True))
+            plain, plain_elapsed, _ = asyncio.run(run(False))
+        # The server notices the connection going away
+        time.sleep(0.3)
+        disconnected = upstream.disconnected.is_set()
+    finally:
+        upstream.stop_thread()
+
+    print(f"Stream stopped after {stream_elapsed:.2f}s with {len(streamed)} chunks, request after {plain_elapsed:.2f}s")
+    assert 0 < len(streamed) < 10 and stream_elapsed < 1.0
+    assert plain == [] and plain_elapsed < 1.0
+    assert "0.5s deadline" in message
+    assert disconnected
+    print("✅ request deadline test passed")
+
+
+if __name__ == "__main__":
+    test_options_validation()
+    test_options_reach_the_request()
+    test_deadline_cancels_requests()
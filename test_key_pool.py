@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test script for load balancing requests across a pool of API keys
+"""
+import os
+import sys
+import time
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import IOIntelligenceModel, KeyPool, RateLimiter, close_sessions
+from mock_server import MockServer
+
+
+def test_rate_limiter_spacing():
+    """Test that the limiter spaces requests after the allowed burst"""
+    print("=== Testing RateLimiter ===")
+    limiter = RateLimiter(600, period=60.0, burst=2)
+    waits = [limiter.reserve() for _ in range(4)]
+    print(f"Waits: {waits}")
+    assert waits[0] == 0 and waits[1] == 0
+    assert 0.05 < waits[2] <= 0.1
+    assert 0.15 < waits[3] <= 0.2
+    assert RateLimiter(0).reserve() == 0
+    print("✅ RateLimiter test passed")
+
+
+def test_pool_prefers_remaining_quota():
+    """Test key selection by remaining quota and recent 429s"""
+    print("=== Testing key ranking ===")
+    pool = KeyPool(["key-a", "key-b", "key-c"])
+
+    async def pick():
+        state = await pool.acquire()
+        pool.release(state)
+        return state.key
+
+    a, b, c = pool.states
+    pool.release(_lease(pool, a), 200, {"x-ratelimit-remaining-tokens": "100"})
+    pool.release(_lease(pool, b), 200, {"x-ratelimit-remaining-tokens": "5000"})
+    # key-c has not reported quota yet, so it is explored first
+    assert asyncio.run(pick()) == "key-c"
+    pool.release(_lease(pool, c), 429, {"Retry-After": "30"})
+    assert asyncio.run(pick()) == "key-b"
+    pool.release(_lease(pool, b), 200, {"x-ratelimit-remaining-tokens": "10"})
+    assert asyncio.run(pick()) == "key-a"
+    print("✅ key ranking test passed")
+
+
+def _lease(pool, state):
+    """Mark a key as in flight, as acquire() would"""
+    state.in_flight += 1
+    return state
+
+
+def test_failover_on_429():
+    """Test that a rate-limited key fails over to another key and is then avoided"""
+    print("=== Testing 429 failover ===")
+    seen_keys = []
+
+    async def handler(request):
+        key = request.headers["Authorization"].split()[-1]
+        seen_keys.append(key)
+        if key == "key-a":
+            return web.json_response({"error": "rate limited"}, status=429, headers={"Retry-After": "60"})
+        body = {"choices": [{"message": {"content": f"hello via {key}"}}]}
+        return web.json_response(body, headers={"x-ratelimit-remaining-requests": "99"})
+
+    async def run():
+        async with MockServer({"POST /api/v1/chat/completions": handler}) as server:
+            try:
+                model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+                model.api_base = server.api_base
+                prompt = SimpleNamespace(prompt="Hello", attachments=[], tools=[])
+                results = []
+                for _ in range(3):
+                    async for result in model.execute_async_with_tools(prompt, stream=False):
+                        results.append(result["content"])
+                sessions = {llm_io_intelligence.get_session(key) for key in ("key-a", "key-b")}
+                return results, sessions
+            finally:
+                await close_sessions()
+
+    env = {"IONET_KEYS": "key-a, key-b", "IONET_USAGE_LEDGER": "0"}
+    with patch.dict(os.environ, env):
+        llm_io_intelligence._key_pool = None
+        results, sessions = asyncio.run(run())
+        pool = llm_io_intelligence.get_key_pool()
+
+    print(f"Keys used: {seen_keys}")
+    assert results == ["hello via key-b"] * 3
+    # key-a is tried once (unexplored keys go first), then left alone while cooling down
+    assert seen_keys.count("key-a") == 1
+    assert pool.states[0].cooldown_until > time.monotonic() + 50
+    assert pool.states[1].remaining_requests == 99
+    # Each key gets its own connection pool
+    assert len(sessions) == 2
+    print("✅ 429 failover test passed")
+
+
+def test_probes_and_listing_lease_keys():
+    """Test that model listing and health probes lease keys from the pool and report 429s"""
+    print("=== Testing probe and listing leases ===")
+    seen_keys = []
+
+    async def models(request):
+        key = request.headers["Authorization"].split()[-1]
+        seen_keys.append(key)
+        if key == "key-a":
+            return web.json_response({"error": "rate limited"}, status=429, headers={"Retry-After": "60"})
+        return web.json_response({"data": [{"id": "test/model"}]})
+
+    async def chat(request):
+        seen_keys.append(request.headers["Authorization"].split()[-1])
+        return web.json_response({"choices": [{"message": {"content": "pong"}}]})
+
+    async def run(server):
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = server.api_base
+        listings = [await llm_io_intelligence.fetch_available_models() for _ in range(2)]
+        await model.probe()
+        return listings
+
+    routes = {"GET /api/v1/models": models, "POST /api/v1/chat/completions": chat}
+    with MockServer(routes) as server:
+        env = {"IONET_KEYS": "key-a, key-b", "IONET_API_BASE": server.api_base, "IONET_CATALOG_TTL": "0"}
+        with patch.dict(os.environ, env):
+            llm_io_intelligence._key_pool = None
+            listings = asyncio.run(run(server))
+            pool = llm_io_intelligence.get_key_pool()
+
+    print(f"Keys used: {seen_keys}")
+    assert listings == [[], [("ionet/test/model", "test/model", 32000)]]
+    # The 429 cools key-a down, so the retry and the probe move on to key-b
+    assert seen_keys == ["key-a", "key-b", "key-b"]
+    assert pool.states[0].cooldown_until > time.monotonic() + 50
+    assert [state.in_flight for state in pool.states] == [0, 0]
+    print("✅ probe and listing lease test passed")
+
+
+if __name__ == "__main__":
+    test_rate_limiter_spacing()
+    test_pool_prefers_remaining_quota()
+    test_failover_on_429()
+    test_probes_and_listing_lease_keys()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Test script for generating several samples per prompt with the n option
+"""
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import ChoiceChunk, IOIntelligenceModel, close_sessions
+from mock_server import MockServer, delta, sse, stream_response
+
+
+class SamplingUpstream(MockServer):
+    """Chat completions server that either honours n or always returns one choice"""
+
+    def __init__(self, honours_n):
+        super().__init__({"POST /api/v1/chat/completions": self.handler})
+        self.honours_n = honours_n
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handler(self, request):
+        body = await request.json()
+        self.requests.append(body)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.1)
+            count = body.get("n", 1) if self.honours_n else 1
+            # Tell the samples apart by seed when one is sent
+            labels = [f"sample{index}" if "seed" not in body else f"seed{body['seed']}" for index in range(count)]
+            usage = {"prompt_tokens": 5, "completion_tokens": 2 * count, "total_tokens": 5 + 2 * count}
+            if not body.get("stream"):
+                choices = [{"index": index, "message": {"content": f"{label} done"}} for index, label in enumerate(labels)]
+                return web.json_response({"choices": choices, "usage": usage})
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for word in ("{}", " done"):
+                # Deltas of different choices arrive interleaved
+                for index, label in enumerate(labels):
+                    event = {"choices": [{"index": index, "delta": {"content": word.format(label)}}]}
+                    await response.write(sse(event))
+            await response.write(sse({"choices": [], "usage": usage}))
+            await response.write(sse("[DONE]"))
+            return response
+        finally:
+            self.in_flight -= 1
+
+
+
+ENV = {"IONET": "test-key", "IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}
+
+
+def run_with(upstream, coroutine_factory):
+    async def run():
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = upstream.api_base
+        try:
+            return await coroutine_factory(model)
+        finally:
+            await close_sessions()
+
+    with patch.dict(os.environ, ENV), patch.object(llm_io_intelligence, "_n_ignored", set()):
+        return asyncio.run(run())
+
+
+async def collect_stream(model, n, seed=None):
+    options = IOIntelligenceModel.Options(n=n, seed=seed)
+    prompt = SimpleNamespace(prompt="hi", attachments=[], tools=[], options=options)
+    texts, usage = {}, None
+    async for chunk in model.execute_async_with_tools(prompt, stream=True):
+        if isinstance(chunk, ChoiceChunk):
+            texts[chunk.index] = texts.get(chunk.index, "") + chunk
+        elif isinstance(chunk, llm_io_intelligence.TokenUsage):
+            usage = chunk
+    return [texts[index] for index in sorted(texts)], usage
+
+
+def test_single_request_with_n():
+    """Test that a backend honouring n gets one request whose choices are demultiplexed"""
+    print("=== Testing n in one request ===")
+    upstream = SamplingUpstream(honours_n=True)
+    upstream.start_thread()
+    try:
+        streamed, usage = run_with(upstream, lambda model: collect_stream(model, 3))
+        sampled = run_with(upstream, lambda model: model.sample("hi", 2))
+    finally:
+        upstream.stop_thread()
+
+    assert streamed == ["sample0 done", "sample1 done", "sample2 done"]
+    assert usage.total == 11
+    assert sampled == ["sample0 done", "sample1 done"]
+    assert [request.get("n") for request in upstream.requests] == [3, 2]
+    print("✅ n in one request test passed")
+
+
+def test_choice_without_content_counts():
+    """Test that a choice seen only in its finish_reason event shows n was honoured"""
+    print("=== Testing a choice without content ===")
+    requests = []
+
+    async def handler(request):
+        requests.append(await request.json())
+        return await stream_response(request, [
+            delta("only", index=0),
+            {"choices": [{"index": 1, "delta": {}, "finish_reason": "length"}]},
+            {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+        ])
+
+    with MockServer({"POST /api/v1/chat/completions": handler}) as upstream:
+        streamed, _ = run_with(upstream, lambda model: collect_stream(model, 2))
+
+    assert streamed == ["only", ""]
+    # No fallback request for the "missing" second sample
+    assert len(requests) == 1
+    print("✅ choice without content test passed")
+
+
+def test_fallback_to_concurrent_requests():
+    """Test that a backend ignoring n gets the other samples as concurrent requests with distinct seeds"""
+    print("=== Testing concurrent fallback ===")
+    upstream = SamplingUpstream(honours_n=False)
+    upstream.start_thread()
+
+    async def twice(model):
+        first = await collect_stream(model, 3, seed=10)
+        # The backend is now known to ignore n, so every sample is requested up front
+        second = await model.sample("hi", 3, options=IOIntelligenceModel.Options(seed=20))
+        return first, second
+
+    try:
+        (streamed, usage), sampled = run_with(upstream, twice)
+    finally:
+        upstream.stop_thread()
+
+    assert streamed == ["seed10 done", "seed11 done", "seed12 done"]
+    assert usage.total == 21
+    assert sampled == ["seed20 done", "seed21 done", "seed22 done"]
+    # 1 + 2 for the first call, then 3 at once
+    assert len(upstream.requests) == 6
+    assert [request.get("n") for request in upstream.requests[3:]] == [None] * 3
+    assert upstream.max_in_flight == 3
+    print("✅ concurrent fallback test passed")
+
+
+def test_llm_response_shows_every_sample():
+    """Test that an llm response lists the samples one after another"""
+    print("=== Testing samples in an llm response ===")
+    upstream = SamplingUpstream(honours_n=True)
+    upstream.start_thread()
+    try:
+        with patch.dict(os.environ, ENV):
+            model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+            model.api_base = upstream.api_base
+            streamed = model.prompt("hi", stream=True, n=2).text()
+            plain = model.prompt("hi", stream=False, n=2).text()
+    finally:
+        upstream.stop_thread()
+
+    expected = "sample0 done\n\n--- sample 2 ---\n\nsample1 done"
+    assert streamed == expected, streamed
+    assert plain == expected, plain
+    print("✅ samples in an llm response test passed")
+
+
+if __name__ == "__main__":
+    test_single_request_with_n()
+    test_choice_without_content_counts()
+    test_fallback_to_concurrent_requests()
+    test_llm_response_shows_every_sample()
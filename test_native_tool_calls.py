@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test script for tool calls returned in the API's tool_calls field
+"""
+import os
+import sys
+import json
+from unittest.mock import patch
+
+import llm
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_io_intelligence import IOIntelligenceModel, native_tool_call
+from mock_server import MockServer, delta, stream_response
+
+ENV = {"IONET": "test-key", "IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}
+
+# Two calls streamed as interleaved fragments, the arguments split mid-value
+STREAMED_CALLS = [
+    delta(tool_calls=[{"index": 0, "id": "call_1", "type": "function", "function": {"name": "lookup", "arguments": ""}}]),
+    delta(tool_calls=[{"index": 0, "function": {"arguments": '{"city": '}}]),
+    delta(tool_calls=[{"index": 1, "id": "call_2", "type": "function", "function": {"name": "lookup", "arguments": '{"city"'}}]),
+    delta(tool_calls=[{"index": 0, "function": {"arguments": '"Paris"}'}}]),
+    delta(tool_calls=[{"index": 1, "function": {"arguments": ': "Oslo"}'}}]),
+    {"choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]},
+]
+
+
+def lookup(city: str) -> str:
+    """Look up a city"""
+    return city
+
+
+async def handler(request):
+    body = await request.json()
+    if body["stream"]:
+        return await stream_response(request, STREAMED_CALLS)
+    call = {"id": "call_9", "type": "function", "function": {"name": "lookup", "arguments": json.dumps({"city": "Rome"})}}
+    return web.json_response({"choices": [{"message": {"content": "", "tool_calls": [call]}, "finish_reason": "tool_calls"}]})
+
+
+def test_native_tool_call_arguments():
+    """Test that JSON-string arguments are decoded and bad ones fall back to an empty object"""
+    print("=== Testing native tool call arguments ===")
+    call = native_tool_call("lookup", '{"city": "Paris"}', "call_1")
+    assert call.name == "lookup" and call.arguments == {"city": "Paris"} and call.tool_call_id == "call_1"
+    assert native_tool_call("lookup", {"city": "Oslo"}).arguments == {"city": "Oslo"}
+    assert native_tool_call("lookup", "").arguments == {}
+    assert native_tool_call("lookup", "[1, 2]").arguments == {}
+    assert native_tool_call("lookup", "{not json").arguments == {}
+    print("✅ native tool call arguments test passed")
+
+
+def test_tool_calls_through_llm():
+    """Test streamed tool call fragments and non-streamed tool_calls both reach the llm response"""
+    print("=== Testing native tool calls ===")
+    with MockServer({"POST /api/v1/chat/completions": handler}) as server:
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = server.api_base
+        with patch.dict(os.environ, ENV):
+            streamed = model.prompt("Where?", tools=[llm.Tool.function(lookup)], stream=True)
+            streamed.text()
+            whole = model.prompt("Where?", tools=[llm.Tool.function(lookup)], stream=False)
+            whole.text()
+
+    assert [(call.name, call.arguments, call.tool_call_id) for call in streamed.tool_calls()] == [
+        ("lookup", {"city": "Paris"}, "call_1"),
+        ("lookup", {"city": "Oslo"}, "call_2"),
+    ]
+    assert [(call.name, call.arguments, call.tool_call_id) for call in whole.tool_calls()] == [
+        ("lookup", {"city": "Rome"}, "call_9"),
+    ]
+    print("✅ native tool calls test passed")
+
+
+if __name__ == "__main__":
+    test_native_tool_call_arguments()
+    test_tool_calls_through_llm()
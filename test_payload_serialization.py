@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Test script for prefix-stable payload serialization and the shared-prefix diagnostic
+"""
+import os
+import sys
+import json
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_io_intelligence import IOIntelligenceModel, canonical_json, close_sessions, shared_prefix_length
+from mock_server import MockServer
+
+
+def make_tool(name, properties):
+    return SimpleNamespace(
+        name=name,
+        description=f"{name} tool",
+        input_schema={"type": "object", "properties": properties},
+    )
+
+
+def make_response(prompt, text, system=None):
+    return SimpleNamespace(prompt=SimpleNamespace(prompt=prompt, system=system), text=lambda: text)
+
+
+def test_canonical_json_is_order_independent():
+    """Test that top-level key and tool ordering do not change the bytes, while schemas keep their field order"""
+    print("=== Testing canonical serialization ===")
+    model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+    first = SimpleNamespace(tools=[
+        make_tool("search", {"query": {"type": "string"}, "limit": {"type": "integer"}}),
+        make_tool("calculate", {"expression": {"type": "string"}}),
+    ])
+    second = SimpleNamespace(tools=[
+        make_tool("calculate", {"expression": {"type": "string"}}),
+        make_tool("search", {"query": {"type": "string"}, "limit": {"type": "integer"}}),
+    ])
+    tools_a, tools_b = model.build_tools(first), model.build_tools(second)
+    assert [tool["function"]["name"] for tool in tools_a] == ["calculate", "search"]
+    assert canonical_json({"tools": tools_a, "model": "m"}) == canonical_json({"model": "m", "tools": tools_b})
+    assert canonical_json({"text": "héllo"}) == '{"text":"héllo"}'.encode("utf-8")
+
+    # Guided decoding generates fields in schema order, so schemas are never sorted
+    schema = {"type": "object", "properties": {"reasoning": {"type": "string"}, "answer": {"type": "string"}}}
+    body = canonical_json({"response_format": {"type": "json_schema", "json_schema": {"schema": schema}}, "tools": tools_a})
+    assert b'"properties":{"reasoning":{"type":"string"},"answer"' in body
+    assert b'"properties":{"query":{"type":"string"},"limit"' in body
+    print("✅ canonical serialization test passed")
+
+
+def test_history_extends_previous_prompt():
+    """Test that each turn's messages start with the previous turn's messages"""
+    print("=== Testing history stability ===")
+    model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+    turn1 = model.build_messages(SimpleNamespace(prompt="Hi", system="Be brief"), None)
+    conversation = SimpleNamespace(responses=[make_response("Hi", "Hello!", system="Be brief")])
+    turn2 = model.build_messages(SimpleNamespace(prompt="How are you?", system=None), conversation)
+    assert turn1 == [{"role": "system", "content": "Be brief"}, {"role": "user", "content": "Hi"}]
+    assert turn2[:2] == turn1
+    assert turn2[2:] == [
+        {"role": "assistant", "content": "Hello!"},
+        {"role": "user", "content": "How are you?"},
+    ]
+
+    # The previous request's bytes, minus the closing brackets, prefix the next request's
+    before = canonical_json(turn1)
+    after = canonical_json(turn2)
+    assert shared_prefix_length(before, after) == len(before) - 1
+    assert shared_prefix_length(b"abc", b"abd") == 2
+    assert shared_prefix_length(b"", b"abc") == 0
+    print("✅ history stability test passed")
+
+
+def test_prefix_diagnostics_log():
+    """Test that requests are sent canonically and the shared prefix is logged"""
+    print("=== Testing prefix diagnostics ===")
+    bodies = []
+
+    async def handler(request):
+        bodies.append(await request.read())
+        return web.json_response({"choices": [{"message": {"content": "ok"}}]})
+
+    async def run():
+        async with MockServer({"POST /api/v1/chat/completions": handler}) as server:
+            try:
+                model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+                model.api_base = server.api_base
+                conversation = SimpleNamespace(responses=[])
+                for text in ("First question", "Second question"):
+                    prompt = SimpleNamespace(prompt=text, system="Be brief", attachments=[], tools=[])
+                    async for result in model.execute_async_with_tools(
+                        prompt, get_env_var=lambda name: "key", stream=False, conversation=conversation
+                    ):
+                        conversation.responses.append(make_response(text, result["content"]))
+            finally:
+                await close_sessions()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "prefix.jsonl")
+        with patch.dict(os.environ, {"IONET_PREFIX_LOG": path, "IONET_USAGE_LEDGER": "0"}):
+            asyncio.run(run())
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+
+    print(f"Records: {records}")
+    assert bodies[0] == canonical_json(json.loads(bodies[0]))
+    assert len(records) == 2
+    assert records[0]["shared_prefix_bytes"] == 0
+    # Everything but the closing brackets of the first prompt is reused
+    assert records[1]["shared_prefix_bytes"] == records[0]["prompt_bytes"] - 2
+    assert records[1]["shared_ratio"] > 0.5
+    print("✅ prefix diagnostics test passed")
+
+
+if __name__ == "__main__":
+    test_canonical_json_is_order_independent()
+    test_history_extends_previous_prompt()
+    test_prefix_diagnostics_log()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test script for per-request profiling reports
+"""
+import os
+import sys
+import json
+import time
+import pstats
+import asyncio
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_io_intelligence import IOIntelligenceModel, RequestProfile, close_sessions, profile_phase
+from mock_server import MockServer, delta, stream_response
+
+ENV = {"IONET": "test-key", "IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}
+
+
+async def handler(request):
+    body = await request.json()
+    if not body.get("stream"):
+        return web.json_response({"choices": [{"message": {"content": "whole reply"}}]})
+    return await stream_response(request, [delta("profiled "), delta("reply")], delay=0.01)
+
+
+ROUTES = {"POST /api/v1/chat/completions": handler}
+
+
+def reports(directory):
+    return [json.loads(path.read_text()) for path in sorted(Path(directory).glob("*.json"))]
+
+
+def test_phases_outside_a_profile():
+    """Test that phase timers cost nothing without a profile and accumulate with one"""
+    print("=== Testing profile phases ===")
+    with profile_phase("anything"):
+        pass
+    with tempfile.TemporaryDirectory() as tmp:
+        assert RequestProfile.from_env("ionet/test") is None
+        with patch.dict(os.environ, {"IONET_PROFILE_DIR": tmp, "IONET_PROFILE_CPROFILE": "0"}):
+            profile = RequestProfile.from_env("ionet/test")
+        for _ in range(2):
+            with profile.phase("encode"):
+                time.sleep(0.01)
+        profile.mark("first_token")
+        profile.mark("first_token")
+        path = profile.write()
+        report = json.loads(path.read_text())
+    assert report["phases"]["encode"] >= 0.02 and report["counts"]["encode"] == 2
+    assert list(report["marks"]) == ["first_token"]
+    assert "cprofile" not in report and report["model"] == "ionet/test"
+    print("✅ profile phases test passed")
+
+
+def test_overlapping_loop_watches():
+    """Test that overlapping profiles leave the loop's debug settings alone until the last one ends"""
+    print("=== Testing overlapping loop watches ===")
+    loop = asyncio.new_event_loop()
+    loop.slow_callback_duration = 0.5
+    first, second = (RequestProfile("ionet/test", "unused", cprofile=False) for _ in range(2))
+    try:
+        with patch.dict(os.environ, {"IONET_PROFILE_SLOW_MS": "40"}):
+            watch_first = first.watch_loop(loop)
+            watch_first.__enter__()
+            with second.watch_loop(loop):
+                watch_first.__exit__(None, None, None)
+                # The second request is still running
+                still_watched = loop.get_debug(), loop.slow_callback_duration
+        restored = loop.get_debug(), loop.slow_callback_duration
+    finally:
+        loop.close()
+    assert still_watched == (True, 0.04) and restored == (False, 0.5)
+    assert not RequestProfile._watched_loops
+    print("✅ overlapping loop watches test passed")
+
+
+def test_async_request_report():
+    """Test the report of a streamed request: phases, marks, cProfile stats and slow callbacks"""
+    print("=== Testing async request profile ===")
+
+    async def run(api_base):
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = api_base
+        prompt = SimpleNamespace(prompt="hi", attachments=[], tools=[])
+        chunks = []
+        try:
+            async for chunk in model.execute_async_with_tools(prompt, stream=True):
+                chunks.append(chunk)
+                # Block the loop so the slow callback detector has something to report
+                asyncio.get_running_loop().call_soon(time.sleep, 0.06)
+                await asyncio.sleep(0)
+            return chunks
+        finally:
+            await close_sessions()
+
+    async def main(directory):
+        async with MockServer(ROUTES) as server:
+            with patch.dict(os.environ, dict(ENV, IONET_PROFILE_DIR=directory, IONET_PROFILE_SLOW_MS="40")):
+                return await run(server.api_base)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        chunks = asyncio.run(main(tmp))
+        [report] = reports(tmp)
+        stats = pstats.Stats(str(Path(tmp) / report["cprofile"]))
+
+    assert chunks == ["profiled ", "reply"]
+    for phase in ("build_payload", "encode", "headers", "stream_read"):
+        assert phase in report["phases"], phase
+    assert report["marks"]["first_token"] <= report["marks"]["first_chunk"] <= report["total_seconds"]
+    assert report["slow_callbacks"] and "took" in report["slow_callbacks"][0]
+    assert report["slow_callbacks_scope"].startswith("event loop")
+    assert stats.total_calls > 0 and report["error"] is None
+    print("✅ async request profile test passed")
+
+
+def test_llm_stream_report():
+    """Test that a response streamed through llm gets one report including the thread bridge"""
+    print("=== Testing llm stream profile ===")
+    with MockServer(ROUTES) as server:
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = server.api_base
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch.dict(os.environ, dict(ENV, IONET_PROFILE_DIR=tmp)):
+                streamed = "".join(model.prompt("hi", stream=True))
+                whole = model.prompt("hi", stream=False).text()
+            # The streamed request is the one that crossed the thread bridge
+            plain_report, stream_report = sorted(reports(tmp), key=lambda report: "bridge" in report["counts"])
+
+    assert streamed == "profiled reply" and whole == "whole reply"
+    assert stream_report["counts"]["bridge"] == 2 and stream_report["counts"]["consumer"] == 2
+    assert "stream_read" in stream_report["phases"] and "cprofile" in stream_report
+    assert "read_body" in plain_report["phases"] and "decode" in plain_report["phases"]
+    print("✅ llm stream profile test passed")
+
+
+if __name__ == "__main__":
+    test_phases_outside_a_profile()
+    test_overlapping_loop_watches()
+    test_async_request_report()
+    test_llm_stream_report()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test script for handling reasoning_content deltas from reasoning models
+"""
+import os
+import sys
+import json
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import IOIntelligenceModel, ReasoningChunk, close_sessions
+from mock_server import MockServer, stream_response
+
+EVENTS = [
+    {"choices": [{"delta": {"role": "assistant", "reasoning_content": "Let me think. ", "content": None}}]},
+    # Some servers send every field on every event, null when unset
+    {"choices": [{"delta": {"reasoning_content": "Two plus two is four.", "tool_calls": None}}], "usage": None},
+    {"choices": [{"delta": {"content": "The answer"}}]},
+    {"choices": [{"delta": {"content": " is 4."}, "finish_reason": "stop"}]},
+]
+
+
+async def handler(request):
+    return await stream_response(request, EVENTS)
+
+
+async def collect(env):
+    async with MockServer({"POST /api/v1/chat/completions": handler}) as server:
+        model = IOIntelligenceModel("ionet/deepseek-r1-0528", "deepseek-ai/DeepSeek-R1-0528", 128000)
+        model.api_base = server.api_base
+        prompt = SimpleNamespace(prompt="What is 2+2?", attachments=[], tools=[])
+        try:
+            with patch.dict(os.environ, dict(env, IONET_USAGE_LEDGER="0")):
+                return [
+                    chunk
+                    async for chunk in model.execute_async_with_tools(prompt, get_env_var=lambda name: "key", stream=True)
+                ]
+        finally:
+            await close_sessions()
+
+
+def test_reasoning_dropped_without_decoding():
+    """Test that reasoning-only events are skipped before JSON decoding by default"""
+    print("=== Testing default drop mode ===")
+    decoded = []
+    real_loads = json.loads
+
+    def counting_loads(text, *args, **kwargs):
+        decoded.append(text)
+        return real_loads(text, *args, **kwargs)
+
+    with patch.object(llm_io_intelligence.json, "loads", counting_loads):
+        chunks = asyncio.run(collect({"IONET_REASONING": "drop"}))
+
+    assert chunks == ["The answer", " is 4."]
+    assert not any("reasoning_content" in text for text in decoded), decoded
+    print("✅ drop mode test passed")
+
+
+def test_reasoning_streamed_separately():
+    """Test that reasoning deltas are yielded on their own channel"""
+    print("=== Testing stream mode ===")
+    chunks = asyncio.run(collect({"IONET_REASONING": "stream"}))
+    reasoning = [chunk for chunk in chunks if isinstance(chunk, ReasoningChunk)]
+    content = [chunk for chunk in chunks if not isinstance(chunk, ReasoningChunk)]
+    assert "".join(reasoning) == "Let me think. Two plus two is four."
+    assert "".join(content) == "The answer is 4."
+
+    event = llm_io_intelligence._reasoning_event(reasoning[0])
+    if event is not None:
+        assert event.type == "reasoning"
+    print("✅ stream mode test passed")
+
+
+def test_reasoning_saved_to_file():
+    """Test that reasoning deltas go to the side file"""
+    print("=== Testing file mode ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "reasoning.log")
+        chunks = asyncio.run(collect({"IONET_REASONING": "file", "IONET_REASONING_FILE": path}))
+        with open(path, encoding="utf-8") as f:
+            saved = f.read()
+    assert chunks == ["The answer", " is 4."]
+    assert "=== ionet/deepseek-r1-0528" in saved
+    assert saved.endswith("Let me think. Two plus two is four.")
+    print("✅ file mode test passed")
+
+
+if __name__ == "__main__":
+    test_reasoning_dropped_without_decoding()
+    test_reasoning_streamed_separately()
+    test_reasoning_saved_to_file()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test script for compressed request bodies and the HTTP/2 transport switch
+"""
+import os
+import sys
+import gzip
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import IOIntelligenceModel, close_sessions, compress_body, request_encoding
+from mock_server import MockServer
+
+
+class Upstream:
+    """Chat completions server recording the encoding and size of each body it receives"""
+
+    def __init__(self, accept_gzip=True):
+        self.accept_gzip = accept_gzip
+        self.received = []
+
+    async def handler(self, request):
+        encoding = request.headers.get("Content-Encoding")
+        raw = await request.content.read()
+        self.received.append((encoding, len(raw)))
+        if encoding and not self.accept_gzip:
+            return web.json_response({"error": "unsupported content encoding"}, status=415)
+        body = gzip.decompress(raw) if encoding == "gzip" else raw
+        reply = f"got {len(body)} bytes"
+        return web.json_response({"choices": [{"message": {"content": reply}}]})
+
+
+async def ask(upstream, prompt, times=1):
+    # Read the raw body ourselves so the test sees what actually went over the wire
+    async with MockServer({"POST /api/v1/chat/completions": upstream.handler}, handler_args={"auto_decompress": False}) as server:
+        try:
+            model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+            model.api_base = server.api_base
+            request = SimpleNamespace(prompt=prompt, attachments=[], tools=[])
+            replies = []
+            for _ in range(times):
+                result = [r async for r in model.execute_async_with_tools(request, get_env_var=lambda n: "k", stream=False)]
+                replies.append(result[0]["content"])
+            return replies
+        finally:
+            await close_sessions()
+
+
+def test_encoding_settings():
+    """Test IONET_REQUEST_COMPRESSION parsing and the zstd fallback"""
+    print("=== Testing compression settings ===")
+    with patch.dict(os.environ, {"IONET_REQUEST_COMPRESSION": "off"}):
+        assert request_encoding() is None
+    with patch.dict(os.environ, {"IONET_REQUEST_COMPRESSION": "gzip"}):
+        assert request_encoding() == "gzip"
+    with patch.dict(os.environ, {"IONET_REQUEST_COMPRESSION": "brotli"}):
+        assert request_encoding() is None
+    with patch.object(llm_io_intelligence, "_zstandard", return_value=None):
+        with patch.dict(os.environ, {"IONET_REQUEST_COMPRESSION": "zstd"}):
+            assert request_encoding() == "gzip"
+        with patch.dict(os.environ, {"IONET_REQUEST_COMPRESSION": "auto"}):
+            assert request_encoding() == "gzip"
+    body = b'{"messages":[' + b'{"role":"user","content":"the same words again"},' * 500 + b"]}"
+    assert compress_body(body, "gzip") == compress_body(body, "gzip")
+    assert gzip.decompress(compress_body(body, "gzip")) == body
+    # Without h2 installed HTTP/2 falls back to aiohttp instead of failing
+    with patch.dict(os.environ, {"IONET_HTTP2": "1"}), patch.dict(sys.modules, {"h2": None}):
+        assert not llm_io_intelligence.http2_enabled()
+    print("✅ compression settings test passed")
+
+
+def test_large_bodies_are_compressed():
+    """Test that only bodies over the threshold are sent compressed"""
+    print("=== Testing compressed request bodies ===")
+    upstream = Upstream()
+    large = "Please review this log line. " * 5000
+    env = {"IONET_REQUEST_COMPRESSION": "gzip", "IONET_COMPRESS_MIN_BYTES": "4096",
+           "IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}
+    with patch.dict(os.environ, env):
+        small_reply, = asyncio.run(ask(upstream, "short prompt"))
+        large_reply, = asyncio.run(ask(upstream, large))
+
+    (small_encoding, _), (large_encoding, large_size) = upstream.received
+    assert small_encoding is None
+    assert large_encoding == "gzip"
+    sent = int(large_reply.split()[1])
+    print(f"Sent {large_size} bytes for a {sent} byte body")
+    assert sent > len(large) and large_size < sent / 10
+    assert small_reply.startswith("got ")
+    print("✅ compressed request body test passed")
+
+
+def test_rejected_compression_falls_back():
+    """Test that a server refusing compressed bodies gets plain ones from then on"""
+    print("=== Testing compression fallback ===")
+    upstream = Upstream(accept_gzip=False)
+    env = {"IONET_REQUEST_COMPRESSION": "gzip", "IONET_COMPRESS_MIN_BYTES": "1024",
+           "IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}
+    with patch.dict(os.environ, env), patch.object(llm_io_intelligence, "_uncompressed_api_bases", set()):
+        replies = asyncio.run(ask(upstream, "word " * 2000, times=2))
+
+    assert all(reply.startswith("got ") for reply in replies)
+    assert [encoding for encoding, _ in upstream.received] == ["gzip", None, None]
+    print("✅ compression fallback test passed")
+
+
+if __name__ == "__main__":
+    test_encoding_settings()
+    test_large_bodies_are_compressed()
+    test_rejected_compression_falls_back()
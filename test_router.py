@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test script for the latency-aware router model
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import IOIntelligenceModel, IORouterModel
+
+
+class FakeBackend(IOIntelligenceModel):
+    """Backend that answers after a fixed delay or fails"""
+
+    def __init__(self, model_id, full_model_name, delay=0.0, fail=False):
+        super().__init__(model_id, full_model_name, 32000)
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.probes = 0
+
+    def execute(self, prompt, stream, response, conversation=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise Exception(f"{self.model_id} is down")
+        return iter([f"answer from {self.model_id}"])
+
+    async def probe(self, api_key):
+        self.probes += 1
+        if self.fail:
+            raise Exception("still down")
+        return 0.01
+
+
+def run(router, attachments=None, tools=None):
+    prompt = SimpleNamespace(prompt="hi", attachments=attachments or [], tools=tools or [])
+    response = SimpleNamespace(set_resolved_model=lambda model_id: setattr(response, "resolved", model_id))
+    with patch.dict(os.environ, {"IONET_USAGE_LEDGER": "0"}):
+        text = "".join(router.execute(prompt, stream=True, response=response))
+    return text, response.resolved
+
+
+def test_routes_to_fastest_backend():
+    """Test that measured TTFT decides the backend"""
+    print("=== Testing fastest backend selection ===")
+    slow = FakeBackend("ionet/llama-3.3-70b", "meta-llama/Llama-3.3-70B-Instruct", delay=0.05)
+    fast = FakeBackend("ionet/qwen3-235b", "Qwen/Qwen3-235B-A22B-FP8", delay=0.0)
+    router = IORouterModel([slow, fast])
+
+    # Unmeasured backends are explored first, then the fastest one wins
+    for _ in range(2):
+        run(router)
+    results = [run(router)[1] for _ in range(5)]
+    assert results == ["ionet/qwen3-235b"] * 5, results
+    assert slow.calls == 1
+    print("✅ fastest backend test passed")
+
+
+def test_failover_and_probing():
+    """Test failover before the first chunk and background recovery of unhealthy backends"""
+    print("=== Testing failover and health probing ===")
+    broken = FakeBackend("ionet/llama-3.3-70b", "meta-llama/Llama-3.3-70B-Instruct", fail=True)
+    working = FakeBackend("ionet/mistral-large-2411", "mistralai/Mistral-Large-Instruct-2411", delay=0.01)
+    router = IORouterModel([broken, working])
+
+    with patch.dict(os.environ, {"IONET_ROUTER_PROBE_INTERVAL": "0.05", "IONET": "test-key"}):
+        text, resolved = run(router)
+        assert resolved == "ionet/mistral-large-2411"
+        run(router)
+        assert not router.stats[broken.model_id].healthy
+        calls_while_unhealthy = broken.calls
+        run(router)
+        assert broken.calls == calls_while_unhealthy, "unhealthy backend should be skipped"
+
+        broken.fail = False
+        deadline = time.time() + 2
+        while not router.stats[broken.model_id].healthy and time.time() < deadline:
+            time.sleep(0.02)
+    assert broken.probes >= 1
+    assert router.stats[broken.model_id].healthy
+    print("✅ failover and probing test passed")
+
+
+def test_capability_filtering():
+    """Test that vision prompts only reach vision backends and tool prompts skip tool-less ones"""
+    print("=== Testing capability filtering ===")
+    text_model = FakeBackend("ionet/mistral-large-2411", "mistralai/Mistral-Large-Instruct-2411")
+    vision_model = FakeBackend("ionet/llama-3.2-90b-vision", "meta-llama/Llama-3.2-90B-Vision-Instruct", delay=0.05)
+    router = IORouterModel([text_model, vision_model])
+
+    assert run(router, attachments=[object()])[1] == "ionet/llama-3.2-90b-vision"
+    assert run(router, tools=[object()])[1] == "ionet/llama-3.2-90b-vision"
+
+    text_only = IORouterModel([text_model])
+    try:
+        run(text_only, attachments=[object()])
+    except Exception as e:
+        assert "vision" in str(e)
+    else:
+        raise AssertionError("Expected an error for an unsupported capability")
+    print("✅ capability filtering test passed")
+
+
+def test_router_registration():
+    """Test that the router is registered over the configured backends"""
+    print("=== Testing router registration ===")
+    registered = []
+    with patch("llm_io_intelligence.get_api_key", return_value=None):
+        llm_io_intelligence.register_models(registered.append)
+    router = registered[-1]
+    assert isinstance(router, IORouterModel)
+    assert [backend.model_id for backend in router.backends] == [
+        "ionet/llama-3.3-70b", "ionet/mistral-large-2411", "ionet/qwen3-235b",
+    ]
+
+    registered.clear()
+    with patch("llm_io_intelligence.get_api_key", return_value=None):
+        with patch.dict(os.environ, {"IONET_ROUTER_MODELS": "deepseek-r1-0528, ionet/aya-expanse-32b"}):
+            llm_io_intelligence.register_models(registered.append)
+    assert [backend.model_id for backend in registered[-1].backends] == [
+        "ionet/deepseek-r1-0528", "ionet/aya-expanse-32b",
+    ]
+    print("✅ router registration test passed")
+
+
+if __name__ == "__main__":
+    test_routes_to_fastest_backend()
+    test_failover_and_probing()
+    test_capability_filtering()
+    test_router_registration()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Test script for the semantic response cache
+"""
+import os
+import re
+import sys
+import zlib
+import json
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import click
+from aiohttp import web
+from click.testing import CliRunner
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import IOIntelligenceModel, SemanticCache, close_sessions
+from mock_server import MockServer
+
+STOP_WORDS = {"what", "is", "the", "s", "a"}
+
+
+def embed_words(text):
+    """Bag-of-words vector, so rewordings with the same content words are identical"""
+    vector = [0.0] * 64
+    for word in re.findall(r"\w+", text.lower()):
+        if word not in STOP_WORDS:
+            vector[zlib.crc32(word.encode()) % 64] += 1.0
+    return vector
+
+
+def payload(text, system=None, **extra):
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": text})
+    return dict({"model": "test/model", "messages": messages, "stream": False, "tools": []}, **extra)
+
+
+def test_similarity_lookup():
+    """Test threshold matching, namespaces, TTLs, per-namespace limits and the audit log"""
+    print("=== Testing semantic lookup ===")
+
+    async def embed(text, api_key):
+        return embed_words(text)
+
+    async def ask(cache, model_id, request, answer=None):
+        query, cached = await cache.lookup(model_id, request)
+        if cached is None and query and answer:
+            cache.store(model_id, query, answer)
+        return query, cached
+
+    async def run(path):
+        cache = SemanticCache(path, threshold=0.9, ttl=60, embed=embed, max_entries=2)
+        results = {}
+        await ask(cache, "ionet/a", payload("What is the capital of France?"), "Paris")
+        results["paraphrase"] = (await ask(cache, "ionet/a", payload("what's the capital of france"), "x"))[1]
+        results["different"] = (await ask(cache, "ionet/a", payload("What is the capital of Spain?"), "Madrid"))[1]
+        results["other_model"] = (await ask(cache, "ionet/b", payload("capital of France"), "Paris?"))[1]
+        results["other_system"] = (await ask(cache, "ionet/a", payload("capital of France", system="Be terse")))[1]
+        results["with_tools"] = await ask(cache, "ionet/a", payload("capital of France", tools=[{"type": "function"}]))
+        # A third entry in the namespace pushes out the oldest (France)
+        await ask(cache, "ionet/a", payload("capital of Italy"), "Rome")
+        results["evicted"] = (await ask(cache, "ionet/a", payload("capital of France")))[1]
+        results["kept"] = (await ask(cache, "ionet/a", payload("The capital of Italy?")))[1]
+        cache.ttl = -1
+        await ask(cache, "ionet/c", payload("capital of Peru"), "Lima")
+        results["expired"] = (await ask(cache, "ionet/c", payload("capital of Peru")))[1]
+        return cache, results
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache, results = asyncio.run(run(os.path.join(tmp, "semantic.db")))
+        hits = cache.hits()
+        assert cache.forget(hits[0]["entry_id"]) and not cache.forget(hits[0]["entry_id"])
+
+    assert results["paraphrase"] == "Paris" and results["different"] is None
+    assert results["other_model"] is None and results["other_system"] is None
+    assert results["with_tools"] == (None, None)
+    assert results["evicted"] is None and results["kept"] == "Rome" and results["expired"] is None
+    assert [hit["prompt"] for hit in hits] == ["The capital of Italy?", "what's the capital of france"]
+    assert hits[1]["matched_prompt"] == "What is the capital of France?" and hits[1]["similarity"] > 0.99
+    print("✅ semantic lookup test passed")
+
+
+def test_embeddings_over_http2_session():
+    """Test fetch_embeddings with a session whose post is a coroutine, as HTTP2Session's is"""
+    print("=== Testing embeddings over an HTTP/2 session ===")
+    released = []
+
+    class Response:
+        status, headers = 200, {}
+
+        async def json(self):
+            return {"data": [{"index": 1, "embedding": [0.0, 1.0]}, {"index": 0, "embedding": [1.0, 0.0]}]}
+
+        def release(self):
+            released.append(True)
+
+    class Session:
+        async def post(self, url, headers=None, data=b"", timeout=None):
+            return Response()
+
+    with patch.dict(os.environ, {"IONET_USAGE_LEDGER": "0"}), patch.object(llm_io_intelligence, "get_session", lambda key: Session()):
+        vectors = asyncio.run(llm_io_intelligence.fetch_embeddings(["a", "b"], api_key="key"))
+    assert vectors == [[1.0, 0.0], [0.0, 1.0]] and released == [True]
+    print("✅ embeddings over an HTTP/2 session test passed")
+
+
+def test_model_requests():
+    """Test paraphrases answered across streaming modes, with embeddings from the API and the CLI audit log"""
+    print("=== Testing semantic cache requests ===")
+    seen = {"chat": [], "embeddings": []}
+
+    async def embeddings(request):
+        body = await request.json()
+        seen["embeddings"].append(body)
+        data = [{"index": index, "embedding": embed_words(text)} for index, text in enumerate(body["input"])]
+        return web.json_response({"data": data, "usage": {"prompt_tokens": 4, "total_tokens": 4}})
+
+    async def chat(request):
+        body = await request.json()
+        seen["chat"].append(body["messages"][-1]["content"])
+        answer = f"Answer {len(seen['chat'])}"
+        if not body["stream"]:
+            return web.json_response({"choices": [{"message": {"content": answer}}]})
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(f"data: {json.dumps({'choices': [{'delta': {'content': answer}}]})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def run(env):
+        async with MockServer({"POST /api/v1/embeddings": embeddings, "POST /api/v1/chat/completions": chat}) as server:
+            try:
+                with patch.dict(os.environ, dict(env, IONET_API_BASE=server.api_base)):
+                    model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+
+                    async def ask(text, stream):
+                        prompt = SimpleNamespace(prompt=text, attachments=[], tools=[])
+                        chunks = [c async for c in model.execute_async_with_tools(prompt, stream=stream)]
+                        return "".join(chunks) if stream else chunks[0]["content"]
+
+                    return [
+                        await ask("What is the capital of France?", False),
+                        await ask("what's the capital of france", True),
+                        await ask("The capital of France?", False),
+                        await ask("What is the capital of Spain?", True),
+                    ]
+            finally:
+                await close_sessions()
+
+    @click.group()
+    def cli():
+        pass
+
+    llm_io_intelligence.register_commands(cli)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            "IONET": "test-key", "IONET_DAEMON": "0", "IONET_USAGE_LEDGER": "0",
+            "IONET_SEMANTIC_CACHE_TTL": "3600", "IONET_SEMANTIC_CACHE_THRESHOLD": "0.9",
+            "IONET_SEMANTIC_CACHE_DB": os.path.join(tmp, "semantic.db"),
+        }
+        answers = asyncio.run(run(env))
+        with patch.dict(os.environ, env):
+            result = CliRunner().invoke(cli, ["ionet", "semantic-hits", "--json"])
+            text_result = CliRunner().invoke(cli, ["ionet", "semantic-hits"])
+
+    assert answers == ["Answer 1", "Answer 1", "Answer 1", "Answer 2"]
+    assert seen["chat"] == ["What is the capital of France?", "What is the capital of Spain?"]
+    assert len(seen["embeddings"]) == 4 and seen["embeddings"][0]["model"] == llm_io_intelligence.DEFAULT_EMBEDDING_MODEL
+    assert result.exit_code == 0, result.output
+    hits = json.loads(result.output)
+    assert [hit["prompt"] for hit in hits] == ["The capital of France?", "what's the capital of france"]
+    assert {hit["model"] for hit in hits} == {"ionet/test"}
+    assert "matched: What is the capital of France?" in text_result.output
+    print("✅ semantic cache requests test passed")
+
+
+if __name__ == "__main__":
+    test_similarity_lookup()
+    test_embeddings_over_http2_session()
+    test_model_requests()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Test script for cancelling a stream when the consumer stops iterating
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiohttp import web
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_io_intelligence import IOIntelligenceModel, close_sessions
+from mock_server import MockServer, delta
+
+
+class EndlessStreamServer(MockServer):
+    """Local server streaming tokens forever until the client disconnects"""
+
+    def __init__(self):
+        super().__init__({"POST /api/v1/chat/completions": self.handler})
+        self.tokens_sent = 0
+        self.disconnected = threading.Event()
+
+    async def handler(self, request):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            while True:
+                await response.write(delta(f"tok{self.tokens_sent} "))
+                self.tokens_sent += 1
+                await asyncio.sleep(0.02)
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.disconnected.set()
+            raise
+        return response
+
+
+def test_generator_close_aborts_request():
+    """Test that closing the execute() generator closes the upstream response"""
+    print("=== Testing generator close ===")
+    with EndlessStreamServer() as server:
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = server.api_base
+        prompt = SimpleNamespace(prompt="Count forever", attachments=[], tools=[])
+        response = SimpleNamespace(add_tool_call=lambda tool_call: None)
+
+        with patch.dict(os.environ, {"IONET": "test-key", "IONET_USAGE_LEDGER": "0"}):
+            stream = model.execute(prompt, stream=True, response=response)
+            received = [next(stream) for _ in range(3)]
+            stream.close()
+
+        print(f"Received before close: {received}")
+        assert len(received) == 3
+        assert server.disconnected.wait(2), "server never saw the client disconnect"
+        sent_at_close = server.tokens_sent
+        time.sleep(0.2)
+        assert server.tokens_sent == sent_at_close, "server kept streaming after close"
+        print("✅ generator close test passed")
+
+
+def test_keyboard_interrupt_in_consumer_aborts_stream():
+    """Test that Ctrl-C while printing a stream closes the upstream response"""
+    print("=== Testing Ctrl-C in the stream consumer ===")
+    with EndlessStreamServer() as server:
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = server.api_base
+        prompt = SimpleNamespace(prompt="Count forever", attachments=[], tools=[])
+        response = SimpleNamespace(add_tool_call=lambda tool_call: None)
+
+        def consume():
+            for count, chunk in enumerate(model.execute(prompt, stream=True, response=response)):
+                if count == 2:
+                    raise KeyboardInterrupt
+
+        with patch.dict(os.environ, {"IONET": "test-key", "IONET_USAGE_LEDGER": "0"}):
+            try:
+                consume()
+            except KeyboardInterrupt:
+                pass
+            else:
+                raise AssertionError("Expected KeyboardInterrupt")
+
+        assert server.disconnected.wait(2), "server never saw the client disconnect"
+        sent_at_interrupt = server.tokens_sent
+        time.sleep(0.2)
+        assert server.tokens_sent == sent_at_interrupt, "server kept streaming after Ctrl-C"
+        print("✅ Ctrl-C in the stream consumer test passed")
+
+
+def test_keyboard_interrupt_aborts_whole_request():
+    """Test that Ctrl-C while waiting for a non-streamed reply cancels the request"""
+    print("=== Testing Ctrl-C during a non-streamed request ===")
+
+    def interrupt():
+        raise KeyboardInterrupt
+
+    with EndlessStreamServer() as server:
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = server.api_base
+        prompt = SimpleNamespace(prompt="Count forever", attachments=[], tools=[])
+        response = SimpleNamespace(add_tool_call=lambda tool_call: None)
+        # execute() runs the request on the current event loop; Ctrl-C arrives there mid-request
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.call_later(0.3, interrupt)
+        try:
+            with patch.dict(os.environ, {"IONET": "test-key", "IONET_USAGE_LEDGER": "0"}):
+                model.execute(prompt, stream=False, response=response)
+        except KeyboardInterrupt:
+            pass
+        else:
+            raise AssertionError("Expected KeyboardInterrupt")
+        finally:
+            loop.run_until_complete(close_sessions())
+            loop.close()
+            asyncio.set_event_loop(None)
+
+        assert server.tokens_sent > 0
+        assert server.disconnected.wait(2), "server never saw the client disconnect"
+        print("✅ Ctrl-C during a non-streamed request test passed")
+
+
+if __name__ == "__main__":
+    test_generator_close_aborts_request()
+    test_keyboard_interrupt_in_consumer_aborts_stream()
+    test_keyboard_interrupt_aborts_whole_request()
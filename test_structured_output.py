@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Test script for schema-constrained output and incremental record parsing
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+from unittest.mock import patch
+
+import click
+from aiohttp import web
+from click.testing import CliRunner
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import (
+    IOIntelligenceModel, JSONRecordStreamParser, SchemaValidationError, close_sessions, validate_json
+)
+from mock_server import MockServer
+
+PERSON = {
+    "type": "object",
+    "properties": {"name": {"type": "string"}, "age": {"type": "integer", "minimum": 0}},
+    "required": ["name", "age"],
+}
+PEOPLE = {"type": "object", "properties": {"items": {"type": "array", "items": PERSON}}, "required": ["items"]}
+RECORDS = [{"name": "Ada [Countess]", "age": 36}, {"name": "Alan \"Prof\" Turing}", "age": 41}, {"name": "Grace", "age": 85}]
+
+
+def parse_in_pieces(text, schema=None):
+    parser = JSONRecordStreamParser(schema)
+    records = []
+    position = 0
+    while position < len(text):
+        size = random.randint(1, 7)
+        records.extend(parser.feed(text[position:position + size]))
+        position += size
+    return records + parser.finish()
+
+
+def test_parser_shapes():
+    """Test record extraction from wrapped arrays, bare arrays and single objects in arbitrary chunks"""
+    print("=== Testing JSONRecordStreamParser ===")
+    random.seed(7)
+    for _ in range(50):
+        assert parse_in_pieces(json.dumps({"items": RECORDS}, indent=2), PEOPLE) == RECORDS
+        assert parse_in_pieces(json.dumps(RECORDS)) == RECORDS
+    assert parse_in_pieces('[1, "two", true, null, 2.5, [3]]') == [1, "two", True, None, 2.5, [3]]
+    assert parse_in_pieces('{"name": "Ada", "age": 36}', PERSON) == [{"name": "Ada", "age": 36}]
+
+    # Records come out as soon as they close, before the array does
+    parser = JSONRecordStreamParser(PEOPLE)
+    assert parser.feed('{"items": [{"name": "Ada", "age": 36}, {"na') == [{"name": "Ada", "age": 36}]
+    try:
+        parser.finish()
+    except ValueError as e:
+        assert "1 records read" in str(e)
+    else:
+        raise AssertionError("a truncated response should be reported")
+    print("✅ JSONRecordStreamParser test passed")
+
+
+def test_validation():
+    """Test schema checks on records, including $ref definitions"""
+    print("=== Testing validation ===")
+    parser = JSONRecordStreamParser(PEOPLE)
+    try:
+        parser.feed('{"items": [{"name": "Ada", "age": -1}]}')
+    except SchemaValidationError as e:
+        assert "$[0].age" in str(e)
+    else:
+        raise AssertionError("a negative age should fail validation")
+
+    with_defs = {
+        "$defs": {"Person": PERSON},
+        "type": "object",
+        "properties": {"people": {"type": "array", "items": {"$ref": "#/$defs/Person"}}},
+    }
+    assert parse_in_pieces(json.dumps({"people": RECORDS}), with_defs) == RECORDS
+    assert validate_json({"name": "Ada"}, PERSON) == ["$: missing required property 'age'"]
+    assert validate_json({"name": "Ada", "age": True}, PERSON) == ["$.age: expected integer, got bool"]
+    assert validate_json("x", {"anyOf": [{"type": "integer"}, {"type": "string"}]}) == []
+    print("✅ validation test passed")
+
+
+def test_stream_records_and_extract_command():
+    """Test that records reach the caller while the model is still generating, and the extract command"""
+    print("=== Testing stream_records ===")
+    requests = []
+    text = json.dumps({"items": RECORDS})
+    cut = text.index("}") + 1
+
+    async def handler(request):
+        requests.append(await request.json())
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for index, piece in enumerate((text[:cut], text[cut:])):
+            if index:
+                await asyncio.sleep(0.3)
+            event = {"choices": [{"delta": {"content": piece}}]}
+            await response.write(f"data: {json.dumps(event)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def run():
+        async with MockServer({"POST /api/v1/chat/completions": handler}) as server:
+            model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+            model.api_base = server.api_base
+            start = time.monotonic()
+            arrivals = []
+            async for record in model.stream_records("List people", PEOPLE):
+                arrivals.append((record, time.monotonic() - start))
+            await close_sessions()
+            return arrivals
+
+    with patch.dict(os.environ, {"IONET": "test-key", "IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}):
+        arrivals = asyncio.run(run())
+
+    assert [record for record, _ in arrivals] == RECORDS
+    assert arrivals[0][1] < 0.25 <= arrivals[-1][1]
+    assert requests[0]["response_format"]["json_schema"]["schema"] == PEOPLE
+    assert IOIntelligenceModel.supports_schema
+
+    @click.group()
+    def cli():
+        pass
+
+    llm_io_intelligence.register_commands(cli)
+    model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+    schemas = []
+
+    async def fake_stream_records(text, schema, system=None, options=None):
+        schemas.append(schema)
+        for record in RECORDS:
+            yield record
+
+    with patch("llm.get_model", return_value=model), patch.object(model, "stream_records", fake_stream_records):
+        result = CliRunner().invoke(cli, ["ionet", "extract", "People in the text", "--schema", "name, age int"],
+                                    input="Ada was 36.")
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line) for line in result.output.splitlines()] == RECORDS
+    assert schemas[0]["properties"]["items"]["items"]["properties"]["age"] == {"type": "integer"}
+    print("✅ stream_records test passed")
+
+
+if __name__ == "__main__":
+    test_parser_shapes()
+    test_validation()
+    test_stream_records_and_extract_command()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Test script for the map-reduce document summarization pipeline
+"""
+import os
+import sys
+import json
+import asyncio
+import tempfile
+from unittest.mock import patch
+
+import click
+from aiohttp import web
+from click.testing import CliRunner
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import DocumentSummarizer, IOIntelligenceModel, chunk_document, close_sessions
+from mock_server import MockServer
+
+
+def make_document(paragraphs=60, edit=None):
+    text = []
+    for i in range(paragraphs):
+        paragraph = f"Paragraph {i} discusses topic {i % 7}. " + "It has some detail. " * 20
+        if i == edit:
+            paragraph += "This sentence was added in an edit."
+        text.append(paragraph)
+    return "\n\n".join(text)
+
+
+class SummaryServer:
+    """Local chat completions server that 'summarizes' by counting words"""
+
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handler(self, request):
+        body = await request.json()
+        self.requests.append(body)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        text = body["messages"][-1]["content"]
+        return web.json_response({"choices": [{"message": {"content": f"summary of {len(text.split())} words"}}]})
+
+    async def run(self, coroutine_factory):
+        async with MockServer({"POST /api/v1/chat/completions": self.handler}) as server:
+            try:
+                return await coroutine_factory(server.api_base)
+            finally:
+                await close_sessions()
+
+
+def test_chunking_is_content_defined():
+    """Test that chunks fit the budget and an edit only changes nearby chunks"""
+    print("=== Testing chunking ===")
+    original = chunk_document(make_document(), 500)
+    edited = chunk_document(make_document(edit=30), 500)
+    print(f"{len(original)} chunks, {len(set(original) - set(edited))} changed by the edit")
+    assert len(original) > 5
+    assert all(len(chunk) <= 2000 for chunk in original)
+    assert "Paragraph 0 " in original[0] and "Paragraph 59 " in original[-1]
+    assert len(set(edited) - set(original)) <= 2
+
+    # Oversized paragraphs are split on sentences and hard cuts
+    long_chunks = chunk_document("A" * 5000 + ". Short sentence.", 250)
+    assert all(len(chunk) <= 1000 for chunk in long_chunks)
+    assert "".join(long_chunks).replace(" ", "") == ("A" * 5000 + ".Shortsentence.")
+    print("✅ chunking test passed")
+
+
+def test_map_reduce_with_cache():
+    """Test bounded parallelism, hierarchical reduce and re-use of cached partials"""
+    print("=== Testing map-reduce summarization ===")
+    server = SummaryServer()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = os.path.join(tmp, "summaries.db")
+
+        def summarize(text):
+            async def run(api_base):
+                model = IOIntelligenceModel("ionet/test", "test/model", 1000)
+                model.api_base = api_base
+                summarizer = DocumentSummarizer(model, chunk_tokens=500, concurrency=3, cache_path=cache)
+                return await summarizer.summarize(text), summarizer.stats
+            return asyncio.run(server.run(run))
+
+        with patch.dict(os.environ, {"IONET": "test-key", "IONET_USAGE_LEDGER": "0"}):
+            summary, stats = summarize(make_document())
+            first_requests = len(server.requests)
+            print(f"First run: {stats}")
+            assert summary.startswith("summary of")
+            assert stats["requests"] == first_requests > stats["chunks"]
+            assert stats["levels"] >= 1
+            assert server.max_in_flight <= 3
+
+            _, stats = summarize(make_document())
+            print(f"Identical re-run: {stats}")
+            assert stats["requests"] == 0
+
+            _, stats = summarize(make_document(edit=30))
+            print(f"Edited re-run: {stats}")
+            # The changed chunks plus the reduce steps above them
+            assert 1 <= stats["requests"] <= 2 + stats["levels"] * 2
+            assert stats["cached"] >= stats["chunks"] - 2
+    print("✅ map-reduce test passed")
+
+
+def test_summarize_command():
+    """Test the llm ionet summarize command"""
+    print("=== Testing llm ionet summarize ===")
+
+    @click.group()
+    def cli():
+        pass
+
+    llm_io_intelligence.register_commands(cli)
+    model = IOIntelligenceModel("ionet/test", "test/model", 8000)
+
+    async def fake_complete(text, system=None):
+        return "short summary"
+
+    with patch("llm.get_model", return_value=model), patch.object(model, "complete", fake_complete):
+        result = CliRunner().invoke(cli, ["ionet", "summarize", "-m", "ionet/test", "--no-cache", "--stats"], input="Some text.")
+    print(result.output)
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith("short summary")
+    assert json.loads(result.output.splitlines()[-1])["chunks"] == 1
+    print("✅ summarize command test passed")
+
+
+if __name__ == "__main__":
+    test_chunking_is_content_defined()
+    test_map_reduce_with_cache()
+    test_summarize_command()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test script for the streaming text tool call parser
+"""
+import os
+import sys
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_io_intelligence import ToolCallStreamParser, parse_tool_calls
+
+
+def feed_in_chunks(parser, text, size):
+    """Feed text through the parser in fixed-size chunks"""
+    emitted = []
+    calls = []
+    for start in range(0, len(text), size):
+        chunk_text, chunk_calls = parser.feed(text[start:start + size])
+        emitted.append(chunk_text)
+        calls.extend(chunk_calls)
+    tail_text, tail_calls = parser.finish()
+    emitted.append(tail_text)
+    calls.extend(tail_calls)
+    return "".join(emitted), calls
+
+
+def test_xml_tool_call():
+    """Test <tool_call> blocks split across arbitrary chunk boundaries"""
+    print("=== Testing <tool_call> parsing ===")
+    text = 'Let me check.\n<tool_call>{"name": "llm_time", "arguments": {}}</tool_call>\nDone.'
+    for size in (1, 3, 7, len(text)):
+        emitted, calls = feed_in_chunks(ToolCallStreamParser(["llm_time"]), text, size)
+        assert emitted == "Let me check.\n\nDone.", emitted
+        assert len(calls) == 1
+        assert calls[0].name == "llm_time"
+        assert calls[0].arguments == {}
+    print("✅ <tool_call> parsing test passed")
+
+
+def test_bare_json_tool_call():
+    """Test bare JSON invocations at the start of a line"""
+    print("=== Testing bare JSON parsing ===")
+    text = 'Calculating:\n{"name": "calc", "arguments": "{\\"expression\\": \\"2 + {3}\\"}"}'
+    for size in (1, 5, len(text)):
+        emitted, calls = feed_in_chunks(ToolCallStreamParser(["calc"]), text, size)
+        assert emitted == "Calculating:\n", emitted
+        assert calls[0].name == "calc"
+        assert calls[0].arguments == {"expression": "2 + {3}"}
+    print("✅ bare JSON parsing test passed")
+
+
+def test_python_tag_tool_call():
+    """Test Llama-style <|python_tag|> invocations"""
+    print("=== Testing <|python_tag|> parsing ===")
+    text = '<|python_tag|>{"name": "calc", "parameters": {"expression": "1+1"}}'
+    emitted, calls = feed_in_chunks(ToolCallStreamParser(["calc"]), text, 4)
+    assert emitted == ""
+    assert calls[0].arguments == {"expression": "1+1"}
+    print("✅ <|python_tag|> parsing test passed")
+
+
+def test_python_tag_followed_by_text():
+    """Test that prose after <|python_tag|> streams straight away and unparsed calls keep the marker"""
+    print("=== Testing <|python_tag|> without a call ===")
+    text = "<|python_tag|>hello world, not json"
+    for size in (1, 4, len(text)):
+        parser = ToolCallStreamParser(["calc"])
+        streamed = "".join(parser.feed(text[start:start + size])[0] for start in range(0, len(text), size))
+        # Released as soon as the first character shows it is not JSON, not at the end of the stream
+        assert streamed == text, streamed
+        assert parser.finish() == ("", [])
+
+    # A call cut off by the end of the stream, or JSON that is not a call, comes out as it went in
+    unfinished = '<|python_tag|>{"name": "calc", "parameters": {"expr'
+    assert feed_in_chunks(ToolCallStreamParser(["calc"]), unfinished, 3) == (unfinished, [])
+    not_a_call = '<|python_tag|> {"answer": 42} done'
+    assert feed_in_chunks(ToolCallStreamParser(["calc"]), not_a_call, 3) == (not_a_call, [])
+    print("✅ <|python_tag|> without a call test passed")
+
+
+def test_ordinary_text_passes_through():
+    """Test that non-tool JSON, unknown tools and stray markup are emitted unchanged"""
+    print("=== Testing pass-through text ===")
+    text = (
+        "Use a < b when comparing.\n"
+        '{"name": "unknown_tool", "arguments": {}}\n'
+        "inline {braces} stay put\n"
+        "<b>bold</b>"
+    )
+    for size in (1, 2, len(text)):
+        emitted, calls = feed_in_chunks(ToolCallStreamParser(["calc"]), text, size)
+        assert emitted == text, emitted
+        assert calls == []
+    print("✅ pass-through text test passed")
+
+
+def test_unterminated_call_is_released():
+    """Test that an unfinished candidate is released as text at end of stream"""
+    print("=== Testing unterminated candidates ===")
+    emitted, calls = feed_in_chunks(ToolCallStreamParser(["calc"]), '{"name": "calc", "argu', 3)
+    assert emitted == '{"name": "calc", "argu'
+    assert calls == []
+
+    parser = ToolCallStreamParser(["calc"], max_call_chars=10)
+    emitted, calls = feed_in_chunks(parser, "{" + "x" * 50, 5)
+    assert emitted == "{" + "x" * 50
+    print("✅ unterminated candidate test passed")
+
+
+def test_parse_tool_calls_helper():
+    """Test the whole-response helper used for non-streaming responses"""
+    print("=== Testing parse_tool_calls ===")
+    remaining, calls = parse_tool_calls(
+        '<tool_call>[{"name": "a", "arguments": {}}, {"function": {"name": "b", "arguments": "{}"}}]</tool_call>',
+        ["a", "b"],
+    )
+    assert remaining == ""
+    assert [call.name for call in calls] == ["a", "b"]
+    print("✅ parse_tool_calls test passed")
+
+
+if __name__ == "__main__":
+    test_xml_tool_call()
+    test_bare_json_tool_call()
+    test_python_tag_tool_call()
+    test_python_tag_followed_by_text()
+    test_ordinary_text_passes_through()
+    test_unterminated_call_is_released()
+    test_parse_tool_calls_helper()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Test script for tracing spans across model calls, tool calls and HTTP fetches
+"""
+import os
+import sys
+import json
+import tempfile
+import threading
+import contextvars
+from unittest.mock import patch
+
+import click
+import llm
+from aiohttp import web
+from click.testing import CliRunner
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_functions"))
+
+import llm_io_intelligence
+from llm_io_intelligence import IOIntelligenceModel, chrome_trace, read_trace_spans, trace_span
+from ddg_search import curl_get
+from mock_server import MockServer, delta, stream_response
+
+ENV = {"IONET": "test-key", "IONET_USAGE_LEDGER": "0", "IONET_DAEMON": "0"}
+
+
+def attributes(span):
+    return {attribute["key"]: next(iter(attribute["value"].values())) for attribute in span["attributes"]}
+
+
+def test_spans_and_threads():
+    """Test nesting, error status, TRACEPARENT and propagation into a thread"""
+    print("=== Testing spans ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "trace.jsonl")
+        with patch.dict(os.environ, {"IONET_TRACE_FILE": path}):
+            with trace_span("turn", attributes={"turns": 1}) as turn:
+                context = contextvars.copy_context()
+
+                def work():
+                    with trace_span("in thread"):
+                        pass
+
+                thread = threading.Thread(target=context.run, args=(work,))
+                thread.start()
+                thread.join()
+                try:
+                    with trace_span("failing"):
+                        raise RuntimeError("boom")
+                except RuntimeError:
+                    pass
+            with patch.dict(os.environ, {"TRACEPARENT": f"00-{'a' * 32}-{'b' * 16}-01"}):
+                with trace_span("continued"):
+                    pass
+        with trace_span("untraced") as untraced:
+            pass
+        spans = {span["name"]: span for span in read_trace_spans(path)}
+
+    assert untraced is None and set(spans) == {"turn", "in thread", "failing", "continued"}
+    assert spans["in thread"]["parentSpanId"] == spans["failing"]["parentSpanId"] == turn.span_id
+    assert spans["in thread"]["traceId"] == turn.trace_id and "parentSpanId" not in spans["turn"]
+    assert spans["failing"]["status"] == {"code": 2, "message": "RuntimeError: boom"}
+    assert spans["failing"]["events"][0]["name"] == "exception"
+    assert attributes(spans["turn"]) == {"turns": "1"}
+    assert spans["continued"]["traceId"] == "a" * 32 and spans["continued"]["parentSpanId"] == "b" * 16
+    print("✅ spans test passed")
+
+
+def test_agent_turn_trace():
+    """Test one trace covering the model calls, the tool call and the fetch it makes"""
+    print("=== Testing agent turn trace ===")
+    seen = {"chat": [], "page": []}
+
+    async def chat(request):
+        body = await request.json()
+        seen["chat"].append(request.headers.get("Traceparent"))
+        if body["messages"][-1]["role"] == "tool":
+            reply = "The page says hello."
+        else:
+            call = {"name": "curl_get", "arguments": {"url": f"{base}/page"}}
+            reply = f"<tool_call>{json.dumps(call)}</tool_call>"
+        usage = {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8}
+        return await stream_response(request, [delta(reply), {"choices": [], "usage": usage}])
+
+    async def page(request):
+        seen["page"].append(request.headers.get("Traceparent"))
+        return web.Response(text="hello")
+
+    @click.group()
+    def cli():
+        pass
+
+    llm_io_intelligence.register_commands(cli)
+    with MockServer({"POST /api/v1/chat/completions": chat, "GET /page": page}) as server:
+        base = server.url
+        model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+        model.api_base = server.api_base
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.jsonl")
+            with patch.dict(os.environ, dict(ENV, IONET_TRACE_FILE=path)):
+                with trace_span("agent turn") as turn:
+                    text = model.chain("Fetch the page", tools=[llm.Tool.function(curl_get)]).text()
+            spans = read_trace_spans(path)
+            result = CliRunner().invoke(cli, ["ionet", "trace", path])
+
+    by_name = {}
+    for span in spans:
+        by_name.setdefault(span["name"], []).append(span)
+    chats, [tool], [fetch] = by_name["chat ionet/test"], by_name["execute_tool curl_get"], by_name["GET"]
+    assert "hello" in text
+    assert {span["traceId"] for span in spans} == {turn.trace_id}
+    assert len(chats) == 2 and all(span["parentSpanId"] == turn.span_id for span in chats)
+    assert tool["parentSpanId"] == turn.span_id and fetch["parentSpanId"] == tool["spanId"]
+    assert attributes(chats[0])["gen_ai.usage.output_tokens"] == "3"
+    assert attributes(fetch)["http.response.status_code"] == "200"
+    # The io.net request and the fetch carried the trace to the servers
+    assert seen["chat"] == [f"00-{turn.trace_id}-{span['spanId']}-01" for span in chats]
+    assert seen["page"] == [f"00-{turn.trace_id}-{fetch['spanId']}-01"]
+
+    assert result.exit_code == 0, result.output
+    events = [event for event in json.loads(result.output)["traceEvents"] if event["ph"] == "X"]
+    assert len(events) == len(spans) and {event["pid"] for event in events} == {1}
+    print("✅ agent turn trace test passed")
+
+
+def test_chrome_trace_lanes():
+    """Test that overlapping sibling spans are put on separate rows"""
+    print("=== Testing Chrome trace conversion ===")
+
+    def span(span_id, start, end, parent=None):
+        value = {"traceId": "t", "spanId": span_id, "name": span_id, "attributes": [],
+                 "startTimeUnixNano": str(start), "endTimeUnixNano": str(end)}
+        if parent:
+            value["parentSpanId"] = parent
+        return value
+
+    events = chrome_trace([span("root", 0, 100), span("a", 10, 50, "root"), span("b", 20, 60, "root"),
+                           span("c", 70, 80, "root")])["traceEvents"]
+    lanes = {event["name"]: event["tid"] for event in events if event["ph"] == "X"}
+    assert lanes["root"] == lanes["a"] == lanes["c"] and lanes["b"] != lanes["a"]
+    print("✅ Chrome trace conversion test passed")
+
+
+if __name__ == "__main__":
+    test_spans_and_threads()
+    test_agent_turn_trace()
+    test_chrome_trace_lanes()
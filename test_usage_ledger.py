@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Test script for token usage capture, the usage ledger and budget admission control
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import click
+from aiohttp import web
+from click.testing import CliRunner
+
+# Add the current directory to the path so we can import llm_io_intelligence
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_io_intelligence
+from llm_io_intelligence import BudgetExceededError, IOIntelligenceModel, TokenUsage, UsageLedger, close_sessions
+from mock_server import MockServer
+
+
+def test_streamed_usage_is_recorded():
+    """Test that stream usage is requested, yielded and written to the ledger"""
+    print("=== Testing streamed usage capture ===")
+    payloads = []
+
+    async def handler(request):
+        payloads.append(await request.json())
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        events = [
+            {"choices": [{"delta": {"content": "Hi"}}], "usage": None},
+            {"choices": [], "usage": {"prompt_tokens": 12, "completion_tokens": 3, "total_tokens": 15}},
+        ]
+        for event in events:
+            await response.write(f"data: {json.dumps(event)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def run():
+        async with MockServer({"POST /api/v1/chat/completions": handler}) as server:
+            try:
+                model = IOIntelligenceModel("ionet/test", "test/model", 32000)
+                model.api_base = server.api_base
+                prompt = SimpleNamespace(prompt="Hello", attachments=[], tools=[])
+                return [
+                    chunk
+                    async for chunk in model.execute_async_with_tools(prompt, get_env_var=lambda name: "key-a", stream=True)
+                ]
+            finally:
+                await close_sessions()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with patch.dict(os.environ, {"IONET_USAGE_DB": os.path.join(tmp, "usage.db")}):
+            chunks = asyncio.run(run())
+            ledger = llm_io_intelligence.get_usage_ledger()
+            summary = ledger.summary()
+
+    assert payloads[0]["stream_options"] == {"include_usage": True}
+    assert chunks[0] == "Hi"
+    assert isinstance(chunks[-1], TokenUsage)
+    assert chunks[-1].total == 15
+    assert summary == [{
+        "key": UsageLedger.key_hash("key-a"),
+        "model": "ionet/test",
+        "requests": 1,
+        "prompt_tokens": 12,
+        "completion_tokens": 3,
+        "total_tokens": 15,
+    }]
+    print("✅ streamed usage test passed")
+
+
+def test_set_usage_on_response():
+    """Test that usage is copied onto the llm response"""
+    print("=== Testing response.set_usage ===")
+    calls = []
+    response = SimpleNamespace(set_usage=lambda **kwargs: calls.append(kwargs))
+    usage = TokenUsage()
+    usage.add({"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7})
+    usage.add({"prompt_tokens": 9, "completion_tokens": 1, "total_tokens": 10})
+    llm_io_intelligence._set_response_usage(response, usage)
+    assert calls == [{"input": 14, "output": 3, "details": None}]
+    print("✅ response.set_usage test passed")
+
+
+def test_budget_admission():
+    """Test per-minute delays and daily budget rejections"""
+    print("=== Testing budget admission control ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = UsageLedger(os.path.join(tmp, "usage.db"))
+        ledger.record("key-a", "ionet/test", {"prompt_tokens": 80, "completion_tokens": 20})
+
+        with patch.dict(os.environ, {"IONET_TOKENS_PER_MINUTE": "1000"}):
+            assert ledger.seconds_until_admitted("key-a") == 0
+            asyncio.run(ledger.admit("key-a"))
+
+        with patch.dict(os.environ, {"IONET_TOKENS_PER_MINUTE": "100"}):
+            wait = ledger.seconds_until_admitted("key-a")
+            assert 55 < wait <= 60, wait
+            # Other keys have their own budget
+            assert ledger.seconds_until_admitted("key-b") == 0
+
+        env = {"IONET_DAILY_TOKEN_BUDGET": "50", "IONET_BUDGET_ACTION": "reject"}
+        with patch.dict(os.environ, env):
+            try:
+                asyncio.run(ledger.admit("key-a"))
+            except BudgetExceededError as e:
+                print(f"Rejected: {e}")
+            else:
+                raise AssertionError("Expected BudgetExceededError")
+
+        env = {"IONET_TOKENS_PER_MINUTE": "100", "IONET_BUDGET_MAX_WAIT": "0.2"}
+        with patch.dict(os.environ, env):
+            start = time.time()
+            try:
+                asyncio.run(ledger.admit("key-a"))
+            except BudgetExceededError:
+                pass
+            else:
+                raise AssertionError("Expected BudgetExceededError once the wait exceeds the maximum")
+            assert time.time() - start < 1
+    print("✅ budget admission test passed")
+
+
+def test_usage_command():
+    """Test the llm ionet usage command"""
+    print("=== Testing llm ionet usage ===")
+
+    @click.group()
+    def cli():
+        pass
+
+    llm_io_intelligence.register_commands(cli)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "usage.db")
+        UsageLedger(path).record("key-a", "ionet/test", {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3})
+        with patch.dict(os.environ, {"IONET_USAGE_DB": path}):
+            result = CliRunner().invoke(cli, ["ionet", "usage", "--json"])
+    print(result.output)
+    assert result.exit_code == 0
+    assert json.loads(result.output)[0]["total_tokens"] == 3
+    print("✅ usage command test passed")
+
+
+if __name__ == "__main__":
+    test_streamed_usage_is_recorded()
+    test_set_usage_on_response()
+    test_budget_admission()
+    test_usage_command()